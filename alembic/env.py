@@ -12,6 +12,9 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# The migration chain targets Postgres (it stops on SQLite at the replied_to FK of
+# 279ba50c368f); SQLite databases (local runs, benchmarks, tests) are built with
+# Base.metadata.create_all, so the model is the SQLite schema.
 target_metadata = Base.metadata
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,14 @@
+"""index messages.replied_to for reply fan-out lookups"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180001"
+down_revision = "add_is_deleted_messages_001"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_index("ix_messages_replied_to", "messages", ["replied_to"])
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_replied_to", table_name="messages")
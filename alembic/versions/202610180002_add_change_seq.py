@@ -0,0 +1,31 @@
+"""per-room change_seq on messages for delta resync"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180002"
+down_revision = "202610180001"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column("rooms", sa.Column("change_seq", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+    op.add_column("messages", sa.Column("change_seq", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+
+    # backfill: number existing rows per room in id order
+    op.execute("""
+        UPDATE messages AS m SET change_seq = s.rn
+        FROM (SELECT id, row_number() OVER (PARTITION BY room_id ORDER BY id) AS rn FROM messages) AS s
+        WHERE m.id = s.id
+    """)
+    op.execute("""
+        UPDATE rooms SET change_seq = COALESCE(
+            (SELECT max(m.change_seq) FROM messages AS m WHERE m.room_id = rooms.id), 0
+        )
+    """)
+
+    op.create_index("ix_messages_room_seq", "messages", ["room_id", "change_seq"])
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_room_seq", table_name="messages")
+    op.drop_column("messages", "change_seq")
+    op.drop_column("rooms", "change_seq")
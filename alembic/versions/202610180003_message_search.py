@@ -0,0 +1,56 @@
+"""full-text search on messages: tsvector + trigram on Postgres, FTS5 on SQLite"""
+from alembic import op
+
+revision = "202610180003"
+down_revision = "202610180002"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == "sqlite":
+        op.execute(
+            "CREATE VIRTUAL TABLE messages_fts USING fts5("
+            "content, content='messages', content_rowid='id', tokenize='unicode61')"
+        )
+        op.execute(
+            "CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN "
+            "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+        )
+        op.execute(
+            "CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN "
+            "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+        )
+        op.execute(
+            "CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+            "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+            "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+        )
+        op.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # STORED generated column: rewrites the table once, then Postgres keeps it in sync
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN search_tsv tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED"
+    )
+    # ساخت ایندکس بدون قفل نوشتن روی جدول
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_messages_search_tsv ON messages USING gin (room_id, search_tsv)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_messages_content_trgm ON messages USING gin (room_id, content gin_trgm_ops)"
+        )
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == "sqlite":
+        for trigger in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
+        return
+    op.execute("DROP INDEX IF EXISTS ix_messages_content_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_messages_search_tsv")
+    op.execute("ALTER TABLE messages DROP COLUMN IF EXISTS search_tsv")
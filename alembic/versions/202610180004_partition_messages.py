@@ -0,0 +1,119 @@
+"""range-partition messages by month on created_at (Postgres only)
+
+Copies the existing table into the partitioned one inside the migration, so run it
+in a maintenance window on large databases. The primary key becomes (id, created_at)
+and the self-referencing replied_to foreign key is dropped: a partitioned table can
+only be referenced through a unique key that includes the partition column.
+"""
+from alembic import op
+
+revision = "202610180004"
+down_revision = "202610180003"
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, room_id, user_id, content, created_at, edited_at, replied_to, is_deleted, change_seq"
+MONTHS_AHEAD = 3
+
+def _create_indexes() -> None:
+    op.execute("CREATE INDEX ix_messages_room_created ON messages (room_id, created_at, id)")
+    op.execute("CREATE INDEX ix_messages_room_seq ON messages (room_id, change_seq)")
+    op.execute("CREATE INDEX ix_messages_replied_to ON messages (replied_to)")
+    op.execute("CREATE INDEX ix_messages_search_tsv ON messages USING gin (room_id, search_tsv)")
+    op.execute("CREATE INDEX ix_messages_content_trgm ON messages USING gin (room_id, content gin_trgm_ops)")
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_unpartitioned_pkey")
+    # sequence را از جدول قدیمی جدا کن تا با DROP آن حذف نشود
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            room_id integer NOT NULL REFERENCES rooms (id) ON DELETE CASCADE,
+            user_id integer REFERENCES users (id) ON DELETE SET NULL,
+            content text NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            edited_at timestamptz,
+            replied_to integer,
+            is_deleted boolean NOT NULL DEFAULT false,
+            change_seq bigint NOT NULL DEFAULT 0,
+            search_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    # one partition per UTC month, from the oldest message up to MONTHS_AHEAD months from now
+    op.execute(f"""
+        DO $$
+        DECLARE
+            m date;
+            last date := (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{MONTHS_AHEAD} months')::date;
+        BEGIN
+            SELECT date_trunc('month', coalesce(min(created_at), now()) AT TIME ZONE 'UTC')::date
+              INTO m FROM messages_unpartitioned;
+            WHILE m <= last LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_p' || to_char(m, 'YYYY_MM'),
+                    m::text || ' 00:00:00+00',
+                    (m + interval '1 month')::date::text || ' 00:00:00+00'
+                );
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_unpartitioned")
+    op.execute("DROP TABLE messages_unpartitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    _create_indexes()
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_partitioned_pkey")
+    for name in ("ix_messages_room_created", "ix_messages_room_seq", "ix_messages_replied_to",
+                 "ix_messages_search_tsv", "ix_messages_content_trgm"):
+        op.execute(f"DROP INDEX {name}")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id integer PRIMARY KEY DEFAULT nextval('messages_id_seq'),
+            room_id integer NOT NULL REFERENCES rooms (id) ON DELETE CASCADE,
+            user_id integer REFERENCES users (id) ON DELETE SET NULL,
+            content text NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            edited_at timestamptz,
+            replied_to integer,
+            is_deleted boolean NOT NULL DEFAULT false,
+            change_seq bigint NOT NULL DEFAULT 0,
+            search_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+        )
+    """)
+    op.execute(f"INSERT INTO messages ({COLUMNS}) SELECT {COLUMNS} FROM messages_partitioned")
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    # archived rows are gone, so orphaned replies lose their parent
+    op.execute("""
+        UPDATE messages SET replied_to = NULL
+        WHERE replied_to IS NOT NULL AND NOT EXISTS (SELECT 1 FROM messages p WHERE p.id = messages.replied_to)
+    """)
+    op.execute(
+        "ALTER TABLE messages ADD CONSTRAINT fk_messages_replied_to_messages "
+        "FOREIGN KEY (replied_to) REFERENCES messages (id)"
+    )
+    op.execute("CREATE INDEX ix_messages_room_id ON messages (room_id)")
+    op.execute("CREATE INDEX ix_messages_room_time ON messages (room_id, created_at)")
+    op.execute("CREATE INDEX ix_messages_room_seq ON messages (room_id, change_seq)")
+    op.execute("CREATE INDEX ix_messages_replied_to ON messages (replied_to)")
+    op.execute("CREATE INDEX ix_messages_search_tsv ON messages USING gin (room_id, search_tsv)")
+    op.execute("CREATE INDEX ix_messages_content_trgm ON messages USING gin (room_id, content gin_trgm_ops)")
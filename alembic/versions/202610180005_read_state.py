@@ -0,0 +1,30 @@
+"""read_state table and rooms.message_count for unread counters"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180005"
+down_revision = "202610180004"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column("rooms", sa.Column("message_count", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+    # one-off backfill; from here on the count is kept by the unread counters
+    op.execute("""
+        UPDATE rooms SET message_count = COALESCE(
+            (SELECT count(*) FROM messages AS m WHERE m.room_id = rooms.id), 0
+        )
+    """)
+
+    op.create_table(
+        "read_state",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("last_read_id", sa.BigInteger(), nullable=False),
+        sa.Column("read_pos", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+def downgrade() -> None:
+    op.drop_table("read_state")
+    op.drop_column("rooms", "message_count")
@@ -0,0 +1,26 @@
+"""import_jobs table for bulk NDJSON imports"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180006"
+down_revision = "202610180005"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        "import_jobs",
+        sa.Column("id", sa.String(32), primary_key=True),
+        sa.Column("filename", sa.String(255), nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("total_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("offset", sa.BigInteger(), nullable=False, server_default=sa.text("0")),
+        sa.Column("rows", sa.BigInteger(), nullable=False, server_default=sa.text("0")),
+        sa.Column("skipped", sa.BigInteger(), nullable=False, server_default=sa.text("0")),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+def downgrade() -> None:
+    op.drop_table("import_jobs")
@@ -0,0 +1,50 @@
+"""author and reply-preview snapshots on messages, so history reads a single table"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180007"
+down_revision = "202610180006"
+branch_labels = None
+depends_on = None
+
+# app.db.models.REPLY_PREVIEW_CHARS at the time of this migration
+PREVIEW_CHARS = 200
+BATCH = 10000
+
+_BACKFILL = f"""
+    UPDATE messages SET
+        username = (SELECT u.username FROM users AS u WHERE u.id = messages.user_id),
+        reply_text = (SELECT substr(p.content, 1, {PREVIEW_CHARS}) FROM messages AS p
+                      WHERE p.id = messages.replied_to AND NOT p.is_deleted),
+        reply_user = (SELECT u.username FROM messages AS p JOIN users AS u ON u.id = p.user_id
+                      WHERE p.id = messages.replied_to AND NOT p.is_deleted),
+        reply_deleted = COALESCE((SELECT p.is_deleted FROM messages AS p WHERE p.id = messages.replied_to), false)
+"""
+
+def upgrade() -> None:
+    op.add_column("messages", sa.Column("username", sa.String(64), nullable=True))
+    op.add_column("messages", sa.Column("reply_text", sa.String(PREVIEW_CHARS), nullable=True))
+    op.add_column("messages", sa.Column("reply_user", sa.String(64), nullable=True))
+    op.add_column("messages", sa.Column("reply_deleted", sa.Boolean(), nullable=False, server_default=sa.text("false")))
+
+    context = op.get_context()
+    if context.as_sql:
+        # اسکریپت آفلاین: یک UPDATE کامل
+        op.execute(_BACKFILL)
+        return
+
+    # backfill in id ranges, each committed on its own, so no long lock on the whole table
+    bounds = op.get_bind().execute(sa.text("SELECT min(id), max(id) FROM messages")).one()
+    if bounds[0] is None:
+        return
+    with context.autocommit_block():
+        for lo in range(bounds[0], bounds[1] + 1, BATCH):
+            op.get_bind().execute(
+                sa.text(_BACKFILL + " WHERE id >= :lo AND id < :hi"), {"lo": lo, "hi": lo + BATCH}
+            )
+
+def downgrade() -> None:
+    op.drop_column("messages", "reply_deleted")
+    op.drop_column("messages", "reply_user")
+    op.drop_column("messages", "reply_text")
+    op.drop_column("messages", "username")
@@ -0,0 +1,28 @@
+"""sent_messages: unique (room_id, user_id, client_msg_id) for idempotent message sends
+
+Not a unique index on messages: on Postgres that table is partitioned by created_at,
+and a unique index there must include the partition key, which would let a retry
+landing in a later month through.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180009"
+down_revision = "202610180008"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table(
+        "sent_messages",
+        sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("client_msg_id", sa.String(64), primary_key=True),
+        sa.Column("message_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_sent_messages_created_at", "sent_messages", ["created_at"])
+
+def downgrade() -> None:
+    op.drop_index("ix_sent_messages_created_at", table_name="sent_messages")
+    op.drop_table("sent_messages")
@@ -0,0 +1,14 @@
+"""rooms.compacted_seq: change_seq horizon below which tombstones have been hard-deleted"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "202610180010"
+down_revision = "202610180009"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column("rooms", sa.Column("compacted_seq", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+
+def downgrade() -> None:
+    op.drop_column("rooms", "compacted_seq")
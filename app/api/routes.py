@@ -1,21 +1,125 @@
-from fastapi import APIRouter, Depends, HTTPException, File , UploadFile
+from fastapi import APIRouter, Depends, HTTPException, File , UploadFile, Query, Request, Response
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.db.session import get_async_session
-from app.db.schemas import HistoryOut, MessageOut
-from app.db.crud import get_or_create_room, get_history, update_message, delete_message_db
+from app.db.replicas import get_read_session, replicas, room_key
+from app.db.schemas import HistoryOut, MessageOut, SearchOut, UnreadOut
+from app.db.crud import get_room_seq, get_history, get_changes, search_messages, update_message, delete_message_db
+from app.db.history_cache import history_cache, get_recent_history
+from app.db import export
+from app.core import metrics, profiling
+from app.socket.unread import unread
+from app.socket.affinity import affinity
+from app.core.storage import (
+    CONTENT_ADDRESSED_RE,
+    DERIVED_DIR,
+    DERIVED_RE,
+    IMAGE_EXTENSIONS,
+    IMAGE_VARIANTS,
+    UploadTooLarge,
+    derived_urls,
+    find_original,
+    resolve,
+    save_upload,
+    safe_extension,
+)
+from app.tasks.derivatives import make_derivatives_task
+from app.tasks.bulk_import import import_messages_task, import_path
+from app.db.models import ImportJob
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime
+import logging
 import os
-from fastapi.responses import FileResponse
+import uuid
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
 
 @router.get("/rooms/{room_id}/history", response_model=HistoryOut)
-async def room_history(room_id: int, session: AsyncSession = Depends(get_async_session)):
-    await get_or_create_room(session, room_id)
-    messages, users = await get_history(session, room_id, limit=2000)
-    return {"room_id": room_id, "messages": messages, "users": users}
+async def room_history(
+    room_id: int,
+    before: str | None = None,
+    since_seq: int | None = None,
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    # continue into archived (detached) partitions once live history runs out
+    archived: bool = False,
+    session: AsyncSession = Depends(get_read_session),
+):
+    # seq از همان دیتابیسی که تاریخچه را می‌دهد، تا replica عقب‌مانده شکاف نسازد
+    seq = await get_room_seq(session, room_id)
+    if since_seq is not None:
+        changes = await get_changes(session, room_id, since_seq, settings.HISTORY_MAX_PAGE_SIZE)
+        if changes is not None:
+            users = sorted({m["username"] for m in changes if m["username"]})
+            return {"room_id": room_id, "messages": changes, "users": users, "seq": seq}
+    try:
+        if before or archived:
+            messages, users, next_cursor = await get_history(
+                session, room_id, limit=limit, before=before, archived=archived
+            )
+        else:
+            messages, users, next_cursor = await get_recent_history(session, room_id, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {
+        "room_id": room_id,
+        "messages": messages,
+        "users": users,
+        "next_cursor": next_cursor,
+        "seq": seq,
+        "reset": since_seq is not None,
+    }
+
+@router.get("/rooms/{room_id}/search", response_model=SearchOut)
+async def search_room(
+    room_id: int,
+    q: str = Query(..., min_length=1, max_length=256),
+    before: str | None = None,
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+):
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="empty query")
+    try:
+        messages, next_cursor = await search_messages(session, room_id, q, limit=limit, before=before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"room_id": room_id, "q": q, "messages": messages, "next_cursor": next_cursor}
+
+@router.get("/users/{username}/unread", response_model=UnreadOut)
+async def user_unread(username: str):
+    rooms = await unread.counts(username)
+    return {"username": username, "rooms": rooms, "total": sum(rooms.values())}
+
+@router.get("/rooms/{room_id}/worker")
+async def room_worker(room_id: int):
+    """Which worker owns the room under `app.supervisor`; worker and url are null in single-process mode."""
+    return affinity.route(room_id)
+
+@router.get("/rooms/{room_id}/export")
+async def export_room(
+    room_id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    include_deleted: bool = False,
+    gzip: bool = False,
+):
+    """Whole room history (or [since, until)) as NDJSON, oldest first; one message per line."""
+    if since and until and since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if export.busy():
+        raise HTTPException(status_code=429, detail="too many exports running, retry later")
+    filename = f"room-{room_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export.export_room(room_id, since, until, include_deleted, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 class EditIn(BaseModel):
     username: str
@@ -26,6 +130,10 @@ async def edit_message(message_id: int, body: EditIn, session: AsyncSession = De
     msg = await update_message(session, message_id, body.username, body.content)
     if not msg:
         raise HTTPException(status_code=403, detail="not allowed or message not found")
+    replicas.note_write(body.username)
+    replicas.note_write(room_key(msg.room_id))
+    if history_cache:
+        await history_cache.update_message(msg.room_id, msg.id, msg.content, msg.edited_at, msg.change_seq)
     # پاسخ استاندارد
     return {
         "id": msg.id,
@@ -41,29 +149,156 @@ class DeleteIn(BaseModel):
 
 @router.delete("/messages/{message_id}")
 async def remove_message(message_id: int, body: DeleteIn, session: AsyncSession = Depends(get_async_session)):
-    ok = await delete_message_db(session, message_id, body.username)
-    if not ok:
+    msg = await delete_message_db(session, message_id, body.username)
+    if not msg:
         raise HTTPException(status_code=403, detail="not allowed or message not found")
+    replicas.note_write(body.username)
+    replicas.note_write(room_key(msg.room_id))
+    if history_cache:
+        await history_cache.delete_message(msg.room_id, msg.id, msg.change_seq)
     return {"ok": True}
 
 @router.post("/upload/")
 async def upload_file(file: UploadFile = File(...)):
-    """دریافت فایل و ذخیره در uploads"""
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    """دریافت فایل و ذخیره در uploads (به صورت stream و بر اساس sha256)"""
     try:
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-    except Exception as e:
+        name, size, _ = await save_upload(file)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="file too large")
+    except OSError as e:
         raise HTTPException(status_code=500, detail=f"file upload failed: {e}")
 
-    file_url = f"/api/uploads/{file.filename}"
-    return {"url": file_url}
+    file_url = f"/api/uploads/{name}"
+    result = {"url": file_url, "sha256": name[:64], "size": size}
+    if safe_extension(name) in IMAGE_EXTENSIONS:
+        sha = name[:64]
+        if not os.path.exists(os.path.join(DERIVED_DIR, f"{sha}.json")):
+            try:
+                await run_in_threadpool(make_derivatives_task.delay, name)
+            except Exception:
+                # آپلود موفق است؛ derivative ها بعداً با درخواست دوباره ساخته می‌شوند
+                log.exception("could not queue derivatives for %s", name)
+        result["derivatives"] = derived_urls(sha)
+    return result
+
+
+def _job_out(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "rows": job.rows,
+        "skipped": job.skipped,
+        "progress": round(job.offset / job.total_bytes, 4) if job.total_bytes else 1.0,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+@router.post("/import", status_code=202)
+async def import_messages(file: UploadFile = File(...), session: AsyncSession = Depends(get_async_session)):
+    """NDJSON bulk import (format in app/tasks/bulk_import.py); loaded by a Celery worker."""
+    job_id = uuid.uuid4().hex
+    path = import_path(job_id)
+    os.makedirs(settings.IMPORT_DIR, exist_ok=True)
+    size = 0
+    try:
+        with open(path + ".part", "wb") as out:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.IMPORT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="file too large")
+                await run_in_threadpool(out.write, chunk)
+        os.replace(path + ".part", path)
+    except BaseException:
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        raise
+
+    job = ImportJob(id=job_id, filename=(file.filename or "import.ndjson")[:255], status="queued", total_bytes=size)
+    session.add(job)
+    await session.commit()
+    await session.refresh(job)
+    try:
+        await run_in_threadpool(import_messages_task.delay, job_id)
+    except Exception:
+        # فایل و job ذخیره شده‌اند؛ با /resume دوباره صف می‌شود
+        log.exception("could not queue import %s", job_id)
+    return _job_out(job)
+
+@router.get("/import/{job_id}")
+async def import_status(job_id: str, session: AsyncSession = Depends(get_async_session)):
+    job = await session.get(ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="import not found")
+    return _job_out(job)
+
+@router.post("/import/{job_id}/resume", status_code=202)
+async def resume_import(job_id: str, session: AsyncSession = Depends(get_async_session)):
+    """Re-dispatch a failed or stalled import; it continues from its last committed batch."""
+    job = await session.get(ImportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="import not found")
+    if job.status == "done":
+        raise HTTPException(status_code=409, detail="import already finished")
+    await run_in_threadpool(import_messages_task.delay, job_id)
+    return _job_out(job)
+
+
+@router.get("/uploads/derived/{filename}")
+async def get_derived_file(filename: str, request: Request):
+    """thumbnail/WebP؛ تا وقتی آماده نشده به فایل اصلی redirect می‌شود"""
+    match = DERIVED_RE.match(filename)
+    if not match or match.group(2) not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="file not found")
+    file_path = os.path.join(DERIVED_DIR, filename)
+    if not os.path.isfile(file_path):
+        original = find_original(match.group(1))
+        if not original:
+            raise HTTPException(status_code=404, detail="file not found")
+        return RedirectResponse(f"/api/uploads/{original}", status_code=307, headers={"Cache-Control": "no-store"})
+    return _immutable_file(file_path, match.group(1) + "_" + match.group(2), request)
 
 
 @router.get("/uploads/{filename}")
-async def get_uploaded_file(filename: str):
-    """دریافت فایل آپلود‌شده"""
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+async def get_uploaded_file(filename: str, request: Request):
+    """دریافت فایل آپلود‌شده (Range و If-None-Match هم پشتیبانی می‌شود)"""
+    file_path = resolve(filename)
+    if not file_path:
         raise HTTPException(status_code=404, detail="file not found")
-    return FileResponse(file_path)
\ No newline at end of file
+
+    match = CONTENT_ADDRESSED_RE.match(filename)
+    if not match:
+        # فایل‌های قدیمی با نام اصلی؛ ETag پیش‌فرض Starlette و بدون کش طولانی
+        return FileResponse(file_path)
+
+    return _immutable_file(file_path, match.group(1), request)
+
+
+def _immutable_file(file_path: str, tag: str, request: Request) -> Response:
+    # محتوای این نام هرگز عوض نمی‌شود، پس هش همان ETag است
+    etag = f'"{tag}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    # Range توسط خود FileResponse پاسخ داده می‌شود
+    return FileResponse(file_path, headers=headers)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@router.get("/debug/profile", include_in_schema=False)
+async def profile(seconds: float = Query(10, gt=0, le=120), sort: str = "cumulative"):
+    if not settings.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if sort not in ("cumulative", "tottime", "calls"):
+        raise HTTPException(status_code=400, detail="sort must be cumulative, tottime or calls")
+    try:
+        return PlainTextResponse(await profiling.sample(seconds, sort))
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="a profile is already running")
@@ -4,9 +4,19 @@ from app.core.config import settings
 # Celery application
 app = Celery(
     "chatapp",
-    broker=settings.REDIS_URL,
-    backend=settings.REDIS_URL,
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND,
+    include=["app.tasks.save_message", "app.tasks.derivatives", "app.tasks.archive", "app.tasks.bulk_import",
+             "app.tasks.compaction"],
 )
 
-# Autodiscover tasks package
-app.autodiscover_tasks(["app.tasks"])
+# For tests/local runs: CELERY_ALWAYS_EAGER=1 with CELERY_BROKER_URL=memory://
+app.conf.task_always_eager = settings.CELERY_ALWAYS_EAGER
+
+# celery -A app.celery_app beat
+app.conf.beat_schedule = {
+    "ensure-message-partitions": {"task": "ensure_partitions_task", "schedule": 24 * 3600},
+    "archive-message-partitions": {"task": "archive_partitions_task", "schedule": 24 * 3600},
+    "compact-message-tombstones": {"task": "compact_tombstones_task", "schedule": 3600},
+    "prune-sent-messages": {"task": "prune_sent_messages_task", "schedule": 3600},
+}
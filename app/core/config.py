@@ -5,6 +5,123 @@ class Settings(BaseModel):
     DATABASE_URL_SYNC: str = os.getenv("DATABASE_URL")
     DATABASE_URL_ASYNC: str = os.getenv("ASYNC_DATABASE_URL")
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
+    CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+    CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
+    CELERY_ALWAYS_EAGER: bool = os.getenv("CELERY_ALWAYS_EAGER", "false").lower() in ("1", "true", "yes")
+    # Connection pool, per engine and per process (the async and the sync engine each get one)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    # Read replicas (comma-separated async URLs) for history, search and export; empty = primary only
+    REPLICA_DATABASE_URLS: str = os.getenv("REPLICA_DATABASE_URLS", "")
+    # seconds: replicas further behind are skipped; health check period; how long a sid that
+    # wrote keeps reading from the primary
+    REPLICA_MAX_LAG: float = float(os.getenv("REPLICA_MAX_LAG", "5"))
+    REPLICA_CHECK_INTERVAL: float = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))
+    READ_YOUR_WRITES_WINDOW: float = float(os.getenv("READ_YOUR_WRITES_WINDOW", "10"))
     CORS_ORIGINS: str = os.getenv("CORS_ORIGINS", "*")
+    # "json" or "msgpack" (needs the msgpack package and socket.io-msgpack-parser on clients)
+    SOCKETIO_SERIALIZER: str = os.getenv("SOCKETIO_SERIALIZER", "json")
+    # "redis" (cross-process fan-out) or "memory" (single process: tests, benchmarks)
+    SOCKETIO_CLIENT_MANAGER: str = os.getenv("SOCKETIO_CLIENT_MANAGER", "redis")
+    # Room-affine workers (python -m app.supervisor): the slot is set by the supervisor,
+    # which keeps {slot: url} of the live workers in AFFINITY_KEY
+    WORKER_SLOT: str = os.getenv("WORKER_SLOT", "")
+    AFFINITY_KEY: str = os.getenv("AFFINITY_KEY", "affinity:workers")
+    AFFINITY_REFRESH_INTERVAL: float = float(os.getenv("AFFINITY_REFRESH_INTERVAL", "1"))
+
+    # Uploads
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+    # History pagination
+    HISTORY_PAGE_SIZE: int = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+    HISTORY_MAX_PAGE_SIZE: int = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+    # Hot history cache: "redis", "memory" or "off"
+    HISTORY_CACHE_BACKEND: str = os.getenv("HISTORY_CACHE_BACKEND", "redis")
+    HISTORY_CACHE_SIZE: int = int(os.getenv("HISTORY_CACHE_SIZE", "200"))
+    HISTORY_CACHE_MAX_ROOMS: int = int(os.getenv("HISTORY_CACHE_MAX_ROOMS", "10000"))
+
+    # Room presence: "redis" or "memory"; seconds, except the diff window
+    PRESENCE_BACKEND: str = os.getenv("PRESENCE_BACKEND", "redis")
+    PRESENCE_TTL: float = float(os.getenv("PRESENCE_TTL", "30"))
+    PRESENCE_HEARTBEAT: float = float(os.getenv("PRESENCE_HEARTBEAT", "10"))
+    PRESENCE_DIFF_WINDOW_MS: int = int(os.getenv("PRESENCE_DIFF_WINDOW_MS", "250"))
+
+    # Unread counters and read receipts: "redis" or "memory"; flushed to read_state every interval
+    UNREAD_BACKEND: str = os.getenv("UNREAD_BACKEND", "redis")
+    UNREAD_FLUSH_INTERVAL: float = float(os.getenv("UNREAD_FLUSH_INTERVAL", "5"))
+    READ_RECEIPT_WINDOW_MS: int = int(os.getenv("READ_RECEIPT_WINDOW_MS", "500"))
+    # seconds a user's Redis read pointers outlive their last activity (reloaded from read_state after)
+    UNREAD_POINTER_TTL: int = int(os.getenv("UNREAD_POINTER_TTL", str(7 * 24 * 3600)))
+
+    # Idempotent sends: `message` acks with the row an earlier send with the same client_msg_id
+    # created. "redis" or "memory" cache of recent acks (seconds); sent_messages rows are kept for hours.
+    SEND_DEDUP_BACKEND: str = os.getenv("SEND_DEDUP_BACKEND", "redis")
+    SEND_DEDUP_TTL: float = float(os.getenv("SEND_DEDUP_TTL", "600"))
+    SEND_DEDUP_MAX: int = int(os.getenv("SEND_DEDUP_MAX", "100000"))
+    CLIENT_MSG_ID_RETENTION_HOURS: float = float(os.getenv("CLIENT_MSG_ID_RETENTION_HOURS", "24"))
+
+    USER_ID_CACHE_SIZE: int = int(os.getenv("USER_ID_CACHE_SIZE", "100000"))
+
+    # Write-behind batching for the `message` event (opt-in)
+    WRITE_BEHIND_ENABLED: bool = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+    WRITE_BEHIND_FLUSH_MS: int = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "10"))
+    WRITE_BEHIND_QUEUE_SIZE: int = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "5000"))
+    WRITE_BEHIND_PUT_TIMEOUT: float = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "1.0"))
+
+    # Token buckets per sid (events/sec, burst); a rate of 0 disables that limit.
+    # edit covers edit_message and delete_message; read covers join, load_older, search and mark_read.
+    RATE_LIMIT_MESSAGE: float = float(os.getenv("RATE_LIMIT_MESSAGE", "5"))
+    RATE_LIMIT_MESSAGE_BURST: int = int(os.getenv("RATE_LIMIT_MESSAGE_BURST", "10"))
+    RATE_LIMIT_EDIT: float = float(os.getenv("RATE_LIMIT_EDIT", "2"))
+    RATE_LIMIT_EDIT_BURST: int = int(os.getenv("RATE_LIMIT_EDIT_BURST", "5"))
+    RATE_LIMIT_READ: float = float(os.getenv("RATE_LIMIT_READ", "5"))
+    RATE_LIMIT_READ_BURST: int = int(os.getenv("RATE_LIMIT_READ_BURST", "10"))
+    # messages per room, counted separately by each API process
+    RATE_LIMIT_ROOM: float = float(os.getenv("RATE_LIMIT_ROOM", "100"))
+    RATE_LIMIT_ROOM_BURST: int = int(os.getenv("RATE_LIMIT_ROOM_BURST", "200"))
+
+    # Adaptive broadcast batching: rooms sending at least BROADCAST_BATCH_RATE events/sec (0: never)
+    # get message / message_edited / system coalesced into one `message_batch` per window.
+    # Per-room overrides: "42=always,7=off,9=20" (a number is that room's own threshold).
+    BROADCAST_BATCH_RATE: float = float(os.getenv("BROADCAST_BATCH_RATE", "50"))
+    BROADCAST_BATCH_WINDOW_MS: int = int(os.getenv("BROADCAST_BATCH_WINDOW_MS", "20"))
+    BROADCAST_BATCH_MAX: int = int(os.getenv("BROADCAST_BATCH_MAX", "200"))
+    BROADCAST_BATCH_ROOMS: str = os.getenv("BROADCAST_BATCH_ROOMS", "")
+
+    # Outbound packets queued per client before SLOW_CONSUMER_POLICY ("disconnect" or "drop") applies
+    OUTBOUND_QUEUE_MAX: int = int(os.getenv("OUTBOUND_QUEUE_MAX", "500"))
+    SLOW_CONSUMER_POLICY: str = os.getenv("SLOW_CONSUMER_POLICY", "disconnect")
+
+    # Socket handler instrumentation
+    SLOW_HANDLER_MS: int = int(os.getenv("SLOW_HANDLER_MS", "250"))
+    LOOP_LAG_INTERVAL: float = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+    LOOP_LAG_WARN_MS: int = int(os.getenv("LOOP_LAG_WARN_MS", "100"))
+    # GET /api/debug/profile?seconds=N; keep off unless the API is not publicly reachable
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+    # GET /api/rooms/{id}/export: rows fetched per server-side cursor batch, concurrent exports per process
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    EXPORT_MAX_CONCURRENT: int = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+    # Bulk NDJSON import (POST /api/import): files are kept in IMPORT_DIR, which the Celery worker must see too
+    IMPORT_DIR: str = os.getenv("IMPORT_DIR", "imports")
+    IMPORT_MAX_BYTES: int = int(os.getenv("IMPORT_MAX_BYTES", str(20 * 1024**3)))
+    IMPORT_BATCH_SIZE: int = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+
+    # Monthly partitions of `messages` (Postgres) and cold archival of old ones
+    PARTITION_MONTHS_AHEAD: int = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    ARCHIVE_AFTER_MONTHS: int = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", "archive")
+
+    # Tombstone compaction: soft-deleted messages are hard-deleted this long after their deletion
+    TOMBSTONE_RETENTION_DAYS: float = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+    TOMBSTONE_BATCH_SIZE: int = int(os.getenv("TOMBSTONE_BATCH_SIZE", "1000"))
 
 settings = Settings()
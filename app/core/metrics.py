@@ -0,0 +1,77 @@
+"""
+Prometheus metrics, scraped at GET /api/metrics.
+
+With several worker processes, point PROMETHEUS_MULTIPROC_DIR at an empty shared
+directory before start-up and the endpoint aggregates every process's samples.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# 0.5ms .. 10s; chat queries are expected in the low milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DB_QUERY_SECONDS = Histogram(
+    "chat_db_query_seconds", "SQL statement latency, by the crud function that issued it",
+    ["engine", "op"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_ERRORS = Counter("chat_db_query_errors_total", "SQL statements that raised", ["engine", "op"])
+DB_POOL_WAIT_SECONDS = Histogram(
+    "chat_db_pool_checkout_seconds", "Time spent waiting for a pooled connection",
+    ["engine"], buckets=LATENCY_BUCKETS,
+)
+DB_POOL_TIMEOUTS = Counter("chat_db_pool_timeouts_total", "Checkouts that hit pool_timeout", ["engine"])
+DB_POOL_CHECKED_OUT = Gauge(
+    "chat_db_pool_checked_out", "Connections currently checked out", ["engine"], multiprocess_mode="livesum",
+)
+REPLICA_LAG_SECONDS = Gauge(
+    "chat_db_replica_lag_seconds", "Replication lag seen by the last health check", ["replica"], multiprocess_mode="max",
+)
+REPLICA_HEALTHY = Gauge(
+    "chat_db_replica_healthy", "1 while the replica is used for reads", ["replica"], multiprocess_mode="min",
+)
+DB_READ_ROUTES = Counter("chat_db_read_routes_total", "Read sessions handed out, by target", ["target"])
+
+SOCKET_EVENT_SECONDS = Histogram(
+    "chat_socket_event_seconds", "Socket.IO handler latency", ["event"], buckets=LATENCY_BUCKETS,
+)
+SOCKET_EVENT_ERRORS = Counter("chat_socket_event_errors_total", "Socket.IO handlers that raised", ["event"])
+SOCKET_EVENTS_IN_FLIGHT = Gauge(
+    "chat_socket_events_in_flight", "Socket.IO handlers currently running", ["event"], multiprocess_mode="livesum",
+)
+SOCKET_EMIT_FANOUT = Histogram(
+    "chat_socket_emit_recipients", "Local recipients per emit", ["event"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+LOOP_LAG_SECONDS = Histogram(
+    "chat_event_loop_lag_seconds", "How late the event loop woke a sleeping monitor task", buckets=LATENCY_BUCKETS,
+)
+
+RATE_LIMITED = Counter("chat_rate_limited_total", "Socket events rejected by a token bucket", ["event", "scope"])
+SLOW_CONSUMER_PACKETS = Counter(
+    "chat_slow_consumer_packets_total", "Outbound packets not queued because the client's queue was full", ["policy"],
+)
+SLOW_CONSUMER_DISCONNECTS = Counter("chat_slow_consumer_disconnects_total", "Clients dropped for falling behind")
+BROADCAST_BATCHES = Counter("chat_broadcast_batches_total", "message_batch events sent to busy rooms")
+BROADCAST_BATCHED_EVENTS = Counter(
+    "chat_broadcast_batched_events_total", "Room events delivered inside a message_batch", ["event"],
+)
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition body and content type for the /metrics response."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
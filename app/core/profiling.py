@@ -0,0 +1,35 @@
+"""On-demand cProfile sampling of a live process (GET /api/debug/profile)."""
+import asyncio
+import cProfile
+import io
+import pstats
+
+_running = False
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+async def sample(seconds: float, sort: str = "cumulative", limit: int = 60) -> str:
+    """
+    Profile everything the event loop thread runs for `seconds` and return the
+    top `limit` entries as pstats text. One sample at a time per process.
+    """
+    global _running
+    if _running:
+        raise ProfilerBusy()
+    _running = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _running = False
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
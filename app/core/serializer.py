@@ -0,0 +1,52 @@
+"""
+JSON codec shared by Socket.IO, the Redis client manager and the history cache.
+
+Exposes the `dumps`/`loads` pair python-socketio expects from a json module.
+Backed by orjson when installed, stdlib json otherwise; both encode datetime/date
+as ISO 8601, so payloads can be emitted as-is without a dumps/loads round trip.
+"""
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj, **kwargs) -> str:
+        # socketio passes separators=...; orjson output is already compact
+        return dumps_bytes(obj).decode()
+
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+else:
+    def dumps(obj, **kwargs) -> str:
+        return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps_bytes(obj) -> bytes:
+        return dumps(obj).encode()
+
+    def loads(s, **kwargs):
+        return json.loads(s)
+
+
+def packet_class(mode: str):
+    """Socket.IO packet class for SOCKETIO_SERIALIZER ("json" or "msgpack")."""
+    if mode == "msgpack":
+        # msgpack اختیاری است و فقط در این حالت لازم می‌شود
+        from socketio.msgpack_packet import MsgPackPacket
+        return MsgPackPacket.configure(dumps_default=_default)
+    return "default"
@@ -0,0 +1,89 @@
+"""Content-addressed storage for uploaded files: uploads/<sha256><ext>."""
+import hashlib
+import os
+import re
+import tempfile
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+UPLOAD_DIR = settings.UPLOAD_DIR
+DERIVED_DIR = os.path.join(UPLOAD_DIR, "derived")
+os.makedirs(DERIVED_DIR, exist_ok=True)
+
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+CONTENT_ADDRESSED_RE = re.compile(r"^([0-9a-f]{64})(\.[a-z0-9]{1,10})?$")
+DERIVED_RE = re.compile(r"^([0-9a-f]{64})_([a-z]+)\.webp$")
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
+# variant -> longest side in pixels
+IMAGE_VARIANTS = {"thumb": 320, "preview": 1280}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def safe_extension(filename: str | None) -> str:
+    ext = os.path.splitext(os.path.basename(filename or ""))[1].lower()
+    return ext if _EXT_RE.match(ext) else ""
+
+def resolve(filename: str) -> str | None:
+    """Path of a stored file, or None for names that must not be served (traversal, temp files)."""
+    name = os.path.basename(filename)
+    if not name or name != filename or name.startswith("."):
+        return None
+    path = os.path.join(UPLOAD_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def derived_name(sha: str, variant: str) -> str:
+    return f"{sha}_{variant}.webp"
+
+def derived_urls(sha: str) -> dict[str, str]:
+    return {v: f"/api/uploads/derived/{derived_name(sha, v)}" for v in IMAGE_VARIANTS}
+
+def find_original(sha: str) -> str | None:
+    """Stored name of the original for `sha`, whatever its extension."""
+    for ext in ("", *IMAGE_EXTENSIONS):
+        if os.path.isfile(os.path.join(UPLOAD_DIR, sha + ext)):
+            return sha + ext
+    return None
+
+
+def _write_chunk(out, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(file: UploadFile) -> tuple[str, int, bool]:
+    """
+    Stream `file` to disk chunk by chunk, hashing as it goes.
+    Returns (stored name, size, created); identical content is stored once.
+    """
+    ext = safe_extension(file.filename)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge()
+                # هش و نوشتن هر دو در thread pool، تا event loop آزاد بماند
+                await run_in_threadpool(_write_chunk, out, digest, chunk)
+
+        name = digest.hexdigest() + ext
+        final_path = os.path.join(UPLOAD_DIR, name)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return name, size, False
+        os.replace(tmp_path, final_path)
+        return name, size, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
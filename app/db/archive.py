@@ -0,0 +1,130 @@
+"""
+Cold storage for archived message partitions: <ARCHIVE_DIR>/messages/<YYYY-MM>.ndjson.gz.
+
+Rows are history dicts (the shape get_history returns), sorted by (room_id, created_at, id).
+Each room is written as its own gzip member, so the file is still one valid .gz for zcat,
+and the <YYYY-MM>.index.json sidecar maps room_id -> [offset, length, rows] so a reader
+decompresses only the room it needs.
+"""
+import gzip
+import json
+import os
+import zlib
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Iterable
+
+from app.core import serializer
+from app.core.config import settings
+
+ARCHIVE_MESSAGES_DIR = os.path.join(settings.ARCHIVE_DIR, "messages")
+
+
+def segment_paths(month: date) -> tuple[str, str]:
+    label = f"{month.year:04d}-{month.month:02d}"
+    return (
+        os.path.join(ARCHIVE_MESSAGES_DIR, f"{label}.ndjson.gz"),
+        os.path.join(ARCHIVE_MESSAGES_DIR, f"{label}.index.json"),
+    )
+
+
+def _fsync_replace(tmp_path: str, path: str) -> None:
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_segment(month: date, rows: Iterable[dict]) -> int:
+    """
+    Write one month's rows (already sorted by room_id, created_at, id); returns the row count.
+    The index is written last, so a segment without one is incomplete and never read.
+    """
+    os.makedirs(ARCHIVE_MESSAGES_DIR, exist_ok=True)
+    data_path, index_path = segment_paths(month)
+    index: dict[int, list[int]] = {}
+    total = 0
+
+    with open(data_path + ".tmp", "wb") as out:
+        room_id = None
+        comp = None
+        start = count = 0
+
+        def close_member():
+            out.write(comp.flush())
+            index[room_id] = [start, out.tell() - start, count]
+
+        for row in rows:
+            if row["room_id"] != room_id:
+                if comp is not None:
+                    close_member()
+                room_id, start, count = row["room_id"], out.tell(), 0
+                comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip container
+            out.write(comp.compress(serializer.dumps_bytes(row) + b"\n"))
+            count += 1
+            total += 1
+        if comp is not None:
+            close_member()
+
+    _fsync_replace(data_path + ".tmp", data_path)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    _fsync_replace(index_path + ".tmp", index_path)
+    return total
+
+
+def remove_segment(month: date) -> None:
+    for path in reversed(segment_paths(month)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def archived_months() -> list[date]:
+    """Months with a complete segment, newest first."""
+    if not os.path.isdir(ARCHIVE_MESSAGES_DIR):
+        return []
+    months = []
+    for name in os.listdir(ARCHIVE_MESSAGES_DIR):
+        if name.endswith(".index.json"):
+            y, m = name[:-len(".index.json")].split("-")
+            months.append(date(int(y), int(m), 1))
+    return sorted(months, reverse=True)
+
+
+@lru_cache(maxsize=64)
+def _load_index(path: str, mtime: float) -> dict[int, list[int]]:
+    with open(path) as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def _room_rows(month: date, room_id: int) -> list[dict]:
+    data_path, index_path = segment_paths(month)
+    entry = _load_index(index_path, os.path.getmtime(index_path)).get(room_id)
+    if entry is None:
+        return []
+    offset, length, _ = entry
+    with open(data_path, "rb") as f:
+        f.seek(offset)
+        raw = gzip.decompress(f.read(length))
+    return [serializer.loads(line) for line in raw.splitlines()]
+
+
+def read_history(room_id: int, limit: int, before: tuple[datetime, int] | None = None):
+    """
+    Up to `limit` live archived messages of a room older than `before` (created_at, id),
+    in ascending order, and whether even older ones exist. Blocking: run it in a thread.
+    """
+    picked: list[dict] = []
+    for month in archived_months():
+        if before and month > before[0].astimezone(timezone.utc).date():
+            continue
+        for row in reversed(_room_rows(month, room_id)):
+            if row["is_deleted"]:
+                continue
+            if before and (datetime.fromisoformat(row["created_at"]), row["id"]) >= before:
+                continue
+            if len(picked) == limit:
+                picked.reverse()
+                return picked, True
+            picked.append(row)
+    picked.reverse()
+    return picked, False
@@ -1,10 +1,22 @@
+import asyncio
+import base64
+from collections import OrderedDict
 from datetime import datetime, timezone
-from sqlalchemy import select, func, update, delete
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, update, delete, tuple_, insert, literal, Integer, String, or_, table, column, literal_column, bindparam, case, exists, true, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
 from sqlalchemy.orm import Session , aliased
-from app.db.models import User, Room, Message
+from app.core.config import settings
+from app.db.models import User, Room, Message, ReadState, SentMessage, REPLY_PREVIEW_CHARS
+from app.db import archive
+from app.db.instrument import query_tag
+
+class RoomNotFound(LookupError):
+    """A message was sent to a room that has no rooms row."""
 
 # ---------- Async (FastAPI) ----------
+@query_tag
 async def get_or_create_user(session: AsyncSession, username: str) -> User:
     res = await session.execute(select(User).where(User.username == username))
     user = res.scalar_one_or_none()
@@ -12,10 +24,32 @@ async def get_or_create_user(session: AsyncSession, username: str) -> User:
         return user
     user = User(username=username)
     session.add(user)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        # اولین join هم‌زمان از دو سوکت؛ ردیف را دیگری ساخته
+        await session.rollback()
+        return (await session.execute(select(User).where(User.username == username))).scalar_one()
     await session.refresh(user)
     return user
 
+# username -> user_id, shared by all socket handlers in this process.
+# Usernames are unique and never renamed, so entries never go stale.
+_user_id_cache: "OrderedDict[str, int]" = OrderedDict()
+
+@query_tag
+async def get_user_id(session: AsyncSession, username: str) -> int:
+    user_id = _user_id_cache.get(username)
+    if user_id is not None:
+        _user_id_cache.move_to_end(username)
+        return user_id
+    user = await get_or_create_user(session, username)
+    _user_id_cache[username] = user.id
+    if len(_user_id_cache) > settings.USER_ID_CACHE_SIZE:
+        _user_id_cache.popitem(last=False)
+    return user.id
+
+@query_tag
 async def get_or_create_room(session: AsyncSession, room_id: int) -> Room:
     res = await session.execute(select(Room).where(Room.id == room_id))
     room = res.scalar_one_or_none()
@@ -23,24 +57,63 @@ async def get_or_create_room(session: AsyncSession, room_id: int) -> Room:
         return room
     room = Room(id=room_id)
     session.add(room)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return (await session.execute(select(Room).where(Room.id == room_id))).scalar_one()
     await session.refresh(room)
     return room
 
+@query_tag
+async def get_room_seq(session, room_id: int) -> int:
+    """Room change_seq without creating the room; 0 if it does not exist (yet, on a replica)."""
+    seq = await session.scalar(select(Room.change_seq).where(Room.id == room_id))
+    return seq or 0
+
+def _bump_seq(room_id: int, n: int = 1):
+    """UPDATE rooms ... RETURNING the room's new change_seq; the row lock orders concurrent writers."""
+    return (
+        update(Room)
+        .where(Room.id == room_id)
+        .values(change_seq=Room.change_seq + n)
+        .returning(Room.change_seq)
+    )
+
+@query_tag
+async def next_change_seq(session, room_id: int, n: int = 1) -> int:
+    """Reserve `n` seqs for a room; returns the last one (the first is last - n + 1)."""
+    return (await session.execute(_bump_seq(room_id, n))).scalar_one()
+
+@query_tag
 async def create_message(session: AsyncSession, room_id: int, username: str, content: str) -> Message:
     user = await get_or_create_user(session, username)
     await get_or_create_room(session, room_id)
-    msg = Message(room_id=room_id, user_id=user.id, content=content)
+    seq = await next_change_seq(session, room_id)
+    msg = Message(room_id=room_id, user_id=user.id, username=username, content=content, change_seq=seq)
     session.add(msg)
     await session.commit()
     await session.refresh(msg)
     return msg
 
-async def get_history(session, room_id: int, limit: int = 2000):
-    Parent = aliased(Message)
-    ParentUser = aliased(User)
+def encode_cursor(created_at: datetime | str, message_id: int) -> str:
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = f"{created_at}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    q = await session.execute(
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError on malformed input."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+def _history_select():
+    # فقط جدول messages؛ نام نویسنده و پیش‌نمایش پاسخ روی خود ردیف ذخیره شده‌اند
+    return (
         select(
             Message.id,
             Message.room_id,
@@ -50,44 +123,184 @@ async def get_history(session, room_id: int, limit: int = 2000):
             Message.edited_at,
             Message.replied_to,
             Message.is_deleted,
-            User.username.label("username"),
-            Parent.content.label("reply_text"),
-            Parent.is_deleted.label("reply_deleted"),
-            ParentUser.username.label("reply_user"),
+            Message.change_seq,
+            Message.username,
+            Message.reply_text,
+            Message.reply_deleted,
+            Message.reply_user,
         )
-        .join(User, User.id == Message.user_id)
-        .join(Parent, Parent.id == Message.replied_to, isouter=True)
-        .join(ParentUser, ParentUser.id == Parent.user_id, isouter=True)
-        .where(Message.room_id == room_id, Message.is_deleted == False)
-        .order_by(Message.created_at.asc())
-        .limit(limit)
+        # پیام‌های کاربر حذف‌شده، مثل join قبلی با users، نمایش داده نمی‌شوند
+        .where(Message.user_id.isnot(None))
+    )
+
+def _reply_snapshot(parent) -> dict:
+    """reply_* column values for a new reply to `parent` (a row with content, is_deleted, username, or None)."""
+    if parent is None or parent.is_deleted:
+        return {"reply_text": None, "reply_user": None, "reply_deleted": parent is not None}
+    return {"reply_text": parent.content[:REPLY_PREVIEW_CHARS], "reply_user": parent.username, "reply_deleted": False}
+
+def _parent_select(replied_to: int):
+    return select(Message.content, Message.is_deleted, Message.username).where(Message.id == replied_to)
+
+@query_tag
+async def get_reply_snapshot(session, replied_to: int | None) -> dict:
+    if not replied_to:
+        return _reply_snapshot(None)
+    return _reply_snapshot((await session.execute(_parent_select(replied_to))).first())
+
+def _history_row(m) -> dict:
+    reply_text = None if m["reply_deleted"] else m["reply_text"]
+    reply_user = None if m["reply_deleted"] else m["reply_user"]
+    return {
+        "id": m["id"],
+        "room_id": m["room_id"],
+        "username": m["username"],
+        "content": m["content"] if not m["is_deleted"] else None,
+        "created_at": m["created_at"],
+        "edited_at": m["edited_at"],
+        "replied_to": m["replied_to"],
+        "reply_text": reply_text,
+        "reply_user": reply_user,
+        "reply_deleted": bool(m["reply_deleted"]),
+        "is_deleted": bool(m["is_deleted"]),
+        "seq": m["change_seq"],
+    }
+
+def _time_key(session):
+    """
+    created_at as the history keyset compares it. SQLite keeps it as text, and the server
+    default ("... 14:53:30") and bound datetimes ("... 14:53:30.000000") differ in format,
+    so both sides are rewritten to one format there.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        return lambda value: func.strftime("%Y-%m-%d %H:%M:%f", value)
+    return lambda value: value
+
+@query_tag
+async def get_history(session, room_id: int, limit: int = 50, before: str | None = None, archived: bool = False):
+    """
+    Newest-first keyset page over (created_at, id), returned in ascending order.
+    `before` is a cursor from a previous page; next_cursor is None when there is nothing older.
+    With `archived`, a page that runs past the oldest live partition continues into the archive.
+    """
+    stmt = _history_select().where(Message.room_id == room_id, Message.is_deleted == False)
+    created = _time_key(session)
+    before_key = None
+    if before:
+        before_key = decode_cursor(before)
+        stmt = stmt.where(tuple_(created(Message.created_at), Message.id) < tuple_(created(before_key[0]), before_key[1]))
+
+    # یک ردیف اضافه برای اینکه بفهمیم صفحه‌ی قدیمی‌تری هست یا نه
+    q = await session.execute(
+        stmt.order_by(created(Message.created_at).desc(), Message.id.desc()).limit(limit + 1)
     )
 
     rows = q.all()
-    messages = []
-    for r in rows:
-        m = r._mapping
-        reply_text = None if m["reply_deleted"] else m["reply_text"]
-        reply_user = None if m["reply_deleted"] else m["reply_user"]
-
-        messages.append({
-            "id": m["id"],
-            "room_id": m["room_id"],
-            "username": m["username"],
-            "content": m["content"] if not m["is_deleted"] else None,
-            "created_at": m["created_at"],
-            "edited_at": m["edited_at"],
-            "replied_to": m["replied_to"],
-            "reply_text": reply_text,
-            "reply_user": reply_user,
-            "reply_deleted": bool(m["reply_deleted"]),
-            "is_deleted": bool(m["is_deleted"]),
-        })
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    messages = [_history_row(r._mapping) for r in rows]
+
+    if archived and not has_more:
+        if messages:
+            before_key = (messages[0]["created_at"], messages[0]["id"])
+        older, has_more = await asyncio.to_thread(
+            archive.read_history, room_id, limit - len(messages), before_key
+        )
+        messages = older + messages
+
+    next_cursor = None
+    if has_more and messages:
+        next_cursor = encode_cursor(messages[0]["created_at"], messages[0]["id"])
 
     users = sorted({mm["username"] for mm in messages})
-    return messages, users
+    return messages, users, next_cursor
+
+@query_tag
+async def get_changes(session, room_id: int, since_seq: int, limit: int):
+    """
+    Messages inserted, edited or soft-deleted after `since_seq`, oldest change first.
+    Returns None when more than `limit` rows changed, or when tombstones newer than
+    `since_seq` have since been compacted away; the caller should resend the full page.
+    """
+    compacted = await session.scalar(select(Room.compacted_seq).where(Room.id == room_id))
+    if compacted and since_seq < compacted:
+        return None
+    q = await session.execute(
+        _history_select()
+        .where(Message.room_id == room_id, Message.change_seq > since_seq)
+        .order_by(Message.change_seq.asc())
+        .limit(limit + 1)
+    )
+    rows = q.all()
+    if len(rows) > limit:
+        return None
+    return [_history_row(r._mapping) for r in rows]
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = f"{rank!r}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, message_id = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return float(rank), int(message_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+def _fts5_query(q: str) -> str:
+    # هر کلمه به‌صورت رشته‌ی نقل‌قول‌شده + پیشوند؛ عملگرهای FTS5 از ورودی کاربر اجرا نمی‌شوند
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in q.split())
+
+def _like_escape(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@query_tag
+async def search_messages(session, room_id: int, q: str, limit: int = 50, before: str | None = None):
+    """
+    Ranked search over a room's live messages, best match first; keyset-paginated on (rank, id).
+    Postgres matches the tsvector or, for 3+ characters, a trigram substring; SQLite uses FTS5.
+    Returns (messages, next_cursor).
+    """
+    stmt = _history_select().where(Message.room_id == room_id, Message.is_deleted == False)
+    if session.get_bind().dialect.name == "sqlite":
+        fts = table("messages_fts", column("rowid"))
+        rank = -func.bm25(literal_column("messages_fts"))
+        stmt = stmt.join(fts, fts.c.rowid == Message.id).where(
+            literal_column("messages_fts").op("MATCH")(_fts5_query(q))
+        )
+    else:
+        tsv = literal_column("messages.search_tsv")
+        tsq = func.websearch_to_tsquery("simple", q)
+        rank = func.ts_rank_cd(tsv, tsq)
+        match = tsv.op("@@")(tsq)
+        if len(q) >= 3:
+            # word_similarity تا برخوردهای فقط-زیررشته هم رتبه‌ی صفر نگیرند
+            rank = rank + func.word_similarity(q, Message.content)
+            match = or_(match, Message.content.ilike(f"%{_like_escape(q)}%", escape="\\"))
+        stmt = stmt.where(match)
 
+    if before:
+        before_rank, before_id = decode_search_cursor(before)
+        stmt = stmt.where(tuple_(rank, Message.id) < tuple_(before_rank, before_id))
 
+    res = await session.execute(
+        stmt.add_columns(rank.label("rank")).order_by(rank.desc(), Message.id.desc()).limit(limit + 1)
+    )
+    rows = res.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [_history_row(r._mapping) for r in rows]
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = encode_search_cursor(float(rows[-1].rank), rows[-1].id)
+    return messages, next_cursor
+
+
+@query_tag
 async def update_message(session: AsyncSession, message_id: int, username: str, new_content: str) -> Message | None:
     res = await session.execute(
         select(Message, User).join(User, Message.user_id == User.id).where(Message.id == message_id)
@@ -96,16 +309,29 @@ async def update_message(session: AsyncSession, message_id: int, username: str,
     if not row:
         return None
     msg, user = row
-    if user.username != username:
+    # tombstone محتوایی ندارد که ویرایش شود
+    if user.username != username or msg.is_deleted:
         return None
 
+    seq = await next_change_seq(session, msg.room_id)
     msg.content = new_content
     msg.edited_at = datetime.utcnow()
+    msg.change_seq = seq
+    # پیش‌نمایش همه‌ی پاسخ‌ها با یک UPDATE
+    await session.execute(
+        update(Message)
+        .where(Message.replied_to == message_id, Message.reply_deleted == False)
+        .values(reply_text=new_content[:REPLY_PREVIEW_CHARS])
+        .execution_options(synchronize_session=False)
+    )
     await session.commit()
     await session.refresh(msg)
     return msg
 
-def save_message_sync(db: Session, room_id: int, username: str, content: str) -> int:
+@query_tag
+def save_message_sync(db: Session, room_id: int, username: str, content: str, replied_to: int | None = None,
+                      client_msg_id: str | None = None) -> Message | None:
+    """Save a message (the Celery fallback of write-behind); None if client_msg_id was already sent."""
     user = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
     if not user:
         user = User(username=username)
@@ -118,20 +344,192 @@ def save_message_sync(db: Session, room_id: int, username: str, content: str) ->
         db.add(room)
         db.flush()
 
-    msg = Message(room_id=room.id, user_id=user.id, content=content)
+    if client_msg_id is not None:
+        claimed = db.execute(
+            _claim_insert(db.get_bind().dialect.name)
+            .values(room_id=room.id, user_id=user.id, client_msg_id=client_msg_id)
+            .on_conflict_do_nothing()
+        ).rowcount
+        if not claimed:
+            # همین ارسال قبلاً ثبت شده
+            db.rollback()
+            return None
+
+    seq = db.execute(_bump_seq(room.id)).scalar_one()
+    reply = _reply_snapshot(db.execute(_parent_select(replied_to)).first() if replied_to else None)
+    msg = Message(room_id=room.id, user_id=user.id, username=username, content=content,
+                  replied_to=replied_to, change_seq=seq, **reply)
     db.add(msg)
+    db.flush()
+    if client_msg_id is not None:
+        db.execute(
+            update(SentMessage)
+            .where(*_sent_key(room.id, user.id, client_msg_id))
+            .values(message_id=msg.id, created_at=msg.created_at)
+        )
     db.commit()
     db.refresh(msg)
-    return msg.id
+    return msg
 
-async def create_message(session, room_id, user_id, content, replied_to=None):
-    msg = Message(room_id=room_id, user_id=user_id, content=content, replied_to=replied_to)
+@query_tag
+async def create_message(session, room_id, user_id, content, replied_to=None, username=None):
+    seq = await next_change_seq(session, room_id)
+    reply = await get_reply_snapshot(session, replied_to)
+    msg = Message(room_id=room_id, user_id=user_id, username=username, content=content,
+                  replied_to=replied_to, change_seq=seq, **reply)
     session.add(msg)
     await session.commit()
     await session.refresh(msg)
     return msg
 
-async def delete_message_db(session, message_id: int, username: str) -> bool:
+def _claim_insert(dialect_name: str):
+    return postgresql.insert(SentMessage) if dialect_name == "postgresql" else sqlite.insert(SentMessage)
+
+def _claim_values(room_id: int, user_id: int, client_msg_id: str):
+    # FROM rooms: برای اتاقی که نیست ردیفی ساخته نمی‌شود، به‌جای خطای FK روی sent_messages
+    return select(literal(room_id, Integer), literal(user_id, Integer), literal(client_msg_id, String)).where(
+        Room.id == room_id
+    )
+
+async def _room_exists(conn, room_id: int) -> bool:
+    """Tells a missing room from an already-claimed client_msg_id when nothing was inserted."""
+    return bool(await conn.scalar(select(exists().where(Room.id == room_id))))
+
+def _sent_key(room_id: int, user_id: int, client_msg_id: str) -> tuple:
+    return (SentMessage.room_id == room_id, SentMessage.user_id == user_id,
+            SentMessage.client_msg_id == client_msg_id)
+
+@query_tag
+async def get_sent_message(conn, room_id: int, user_id: int, client_msg_id: str) -> dict | None:
+    """
+    {id, created_at, seq} of the message an earlier send with this client_msg_id created;
+    id is None while that send is still inserting, seq once the message is compacted away.
+    Takes a connection or a session.
+    """
+    on = [Message.id == SentMessage.message_id]
+    bind = conn if isinstance(conn, AsyncConnection) else conn.get_bind()
+    if bind.dialect.name == "postgresql":
+        # created_at پیام همان created_at ادعاست؛ فقط یک پارتیشن بررسی می‌شود
+        on.append(Message.created_at == SentMessage.created_at)
+    row = (await conn.execute(
+        select(SentMessage.message_id.label("id"), SentMessage.created_at, Message.change_seq.label("seq"))
+        .outerjoin(Message, and_(*on))
+        .where(*_sent_key(room_id, user_id, client_msg_id))
+    )).first()
+    return dict(row._mapping) if row else None
+
+@query_tag
+async def insert_message_with_preview(conn: AsyncConnection, room_id: int, user_id: int, username: str,
+                                     content: str, replied_to: int | None = None,
+                                     client_msg_id: str | None = None):
+    """
+    Insert a message with its reply-preview snapshot in one statement:
+    WITH seq AS (UPDATE rooms ... RETURNING)
+    INSERT ... SELECT FROM seq LEFT JOIN parent RETURNING.
+    Use an autocommit connection to keep it to a single round trip.
+    Returns a dict with id, created_at, change_seq, reply_text, reply_deleted, reply_user.
+
+    With a client_msg_id the (room_id, user_id, client_msg_id) row in sent_messages is
+    claimed first; if it already exists nothing is inserted and None is returned
+    (get_sent_message then has the original message). Raises RoomNotFound when the
+    room has no rooms row.
+    """
+    returning = (Message.id, Message.created_at, Message.change_seq,
+                 Message.reply_text, Message.reply_deleted, Message.reply_user)
+
+    if conn.dialect.name != "postgresql":
+        # SQLite و بقیه DML داخل CTE ندارند؛ چند کوئری
+        if client_msg_id is not None:
+            claimed = (await conn.execute(
+                _claim_insert(conn.dialect.name)
+                .from_select(["room_id", "user_id", "client_msg_id"], _claim_values(room_id, user_id, client_msg_id))
+                .on_conflict_do_nothing()
+            )).rowcount
+            if not claimed:
+                if not await _room_exists(conn, room_id):
+                    raise RoomNotFound(room_id)
+                return None
+        try:
+            reply = _reply_snapshot((await conn.execute(_parent_select(replied_to))).first() if replied_to else None)
+            seq = (await conn.execute(_bump_seq(room_id))).scalar_one_or_none()
+            if seq is None:
+                raise RoomNotFound(room_id)
+            inserted = (await conn.execute(
+                insert(Message)
+                .values(room_id=room_id, user_id=user_id, username=username, content=content,
+                        replied_to=replied_to, change_seq=seq, **reply)
+                .returning(*returning)
+            )).one()
+        except BaseException:
+            if client_msg_id is not None:
+                # تا تکرار همین ارسال دوباره امتحان شود، نه اینکه همیشه «در جریان» بماند
+                await conn.execute(delete(SentMessage).where(*_sent_key(room_id, user_id, client_msg_id)))
+            raise
+        if client_msg_id is not None:
+            await conn.execute(
+                update(SentMessage)
+                .where(*_sent_key(room_id, user_id, client_msg_id))
+                .values(message_id=inserted.id, created_at=inserted.created_at)
+            )
+        return dict(inserted._mapping)
+
+    Parent = aliased(Message)
+    live = Parent.is_deleted == False
+    columns = ["room_id", "user_id", "username", "content", "replied_to", "change_seq",
+               "reply_text", "reply_user", "reply_deleted"]
+    bump = _bump_seq(room_id)
+    claim = None
+    if client_msg_id is not None:
+        # id و created_at پیام همین‌جا تعیین می‌شوند تا ردیف sent_messages در همان دستور کامل باشد
+        claim = (
+            postgresql.insert(SentMessage)
+            .from_select(
+                ["room_id", "user_id", "client_msg_id", "message_id", "created_at"],
+                _claim_values(room_id, user_id, client_msg_id).add_columns(
+                    literal_column("nextval('messages_id_seq')"),
+                    func.now(),
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(SentMessage.message_id, SentMessage.created_at)
+            .cte("claim")
+        )
+        bump = bump.where(exists(select(claim.c.message_id)))
+        columns = ["id", "created_at", *columns]
+    seq = bump.cte("seq")
+    source = select(
+        *((claim.c.message_id, claim.c.created_at) if claim is not None else ()),
+        literal(room_id, Integer),
+        literal(user_id, Integer),
+        literal(username, Message.username.type),
+        literal(content, Message.content.type),
+        literal(replied_to, Integer),
+        seq.c.change_seq,
+        case((live, func.substr(Parent.content, 1, REPLY_PREVIEW_CHARS))),
+        case((live, Parent.username)),
+        func.coalesce(Parent.is_deleted, False),
+    ).select_from(seq)
+    if claim is not None:
+        source = source.join(claim, true())
+    ins = (
+        insert(Message)
+        .from_select(columns, source.join(Parent, Parent.id == literal(replied_to, Integer), isouter=True))
+        .returning(*returning)
+        .cte("ins")
+    )
+    row = (await conn.execute(select(ins))).first()
+    if row is None and (client_msg_id is None or not await _room_exists(conn, room_id)):
+        # UPDATE rooms (یا claim) در CTE چیزی پیدا نکرد
+        raise RoomNotFound(room_id)
+    return dict(row._mapping) if row else None
+
+@query_tag
+async def get_reply_ids(session, message_id: int) -> list[int]:
+    q = await session.execute(select(Message.id).where(Message.replied_to == message_id))
+    return list(q.scalars())
+
+@query_tag
+async def delete_message_db(session, message_id: int, username: str) -> Message | None:
     q = await session.execute(
         select(Message, User.username)
         .join(User, User.id == Message.user_id)
@@ -139,16 +537,69 @@ async def delete_message_db(session, message_id: int, username: str) -> bool:
     )
     row = q.first()
     if not row:
-        return False
+        return None
     msg, owner = row
     if owner != username:
-        return False
+        return None
 
+    seq = await next_change_seq(session, msg.room_id)
     await session.execute(
         update(Message)
         .where(Message.id == message_id)
-        .values(is_deleted=True, edited_at=datetime.now(timezone.utc))
+        # محتوا همین حالا پاک می‌شود تا فضا زودتر آزاد شود؛ ردیف بعداً compact می‌شود
+        .values(is_deleted=True, content="", edited_at=datetime.now(timezone.utc), change_seq=seq)
+    )
+    await session.execute(
+        update(Message)
+        .where(Message.replied_to == message_id)
+        .values(reply_text=None, reply_user=None, reply_deleted=True)
+        .execution_options(synchronize_session=False)
     )
     await session.commit()
     await session.refresh(msg)
-    return True
\ No newline at end of file
+    return msg
+
+# ---------- unread counters (durable side) ----------
+@query_tag
+async def get_message_counts(session, room_ids) -> dict[int, int]:
+    q = await session.execute(select(Room.id, Room.message_count).where(Room.id.in_(list(room_ids))))
+    return dict(q.all())
+
+@query_tag
+async def get_read_state(session, username: str) -> list[tuple[int, int, int]]:
+    """(room_id, read_pos, last_read_id) for every room the user has a pointer in."""
+    q = await session.execute(
+        select(ReadState.room_id, ReadState.read_pos, ReadState.last_read_id)
+        .join(User, User.id == ReadState.user_id)
+        .where(User.username == username)
+    )
+    return [tuple(r) for r in q.all()]
+
+@query_tag
+async def save_read_state(session, heads: dict[int, int], reads: list[dict]) -> None:
+    """
+    Flush head counters ({room_id: count}) and read pointers
+    ({user_id, room_id, read_pos, last_read_id}); neither ever moves backwards.
+    """
+    if heads:
+        rooms = Room.__table__
+        await session.execute(
+            rooms.update()
+            .where(rooms.c.id == bindparam("b_id"), rooms.c.message_count < bindparam("b_count"))
+            .values(message_count=bindparam("b_count")),
+            [{"b_id": r, "b_count": c} for r, c in heads.items()],
+        )
+    if reads:
+        dialect_insert = sqlite.insert if session.get_bind().dialect.name == "sqlite" else postgresql.insert
+        stmt = dialect_insert(ReadState)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ReadState.user_id, ReadState.room_id],
+            set_={
+                "read_pos": stmt.excluded.read_pos,
+                "last_read_id": stmt.excluded.last_read_id,
+                "updated_at": func.now(),
+            },
+            where=stmt.excluded.last_read_id >= ReadState.last_read_id,
+        )
+        await session.execute(stmt, reads)
+    await session.commit()
@@ -0,0 +1,66 @@
+"""
+Streaming NDJSON export of a room's history, oldest first.
+
+Rows come off a server-side cursor (on a replica when one is healthy) EXPORT_BATCH_SIZE
+at a time and each batch is written out before the next is fetched, so memory stays flat
+however big the room is. gzip runs in a worker thread and the generator yields to the
+event loop between batches, so a long export does not hold up socket handlers. Exports
+hold a pooled connection for their whole duration, hence the per-process
+EXPORT_MAX_CONCURRENT cap.
+"""
+import asyncio
+import zlib
+from datetime import datetime
+from typing import AsyncIterator
+
+from app.core import serializer
+from app.core.config import settings
+from app.db.crud import _history_row, _history_select
+from app.db.instrument import current_op
+from app.db.models import Message
+from app.db.replicas import replicas, room_key
+
+_slots = asyncio.Semaphore(settings.EXPORT_MAX_CONCURRENT)
+
+
+def busy() -> bool:
+    """EXPORT_MAX_CONCURRENT exports are already running in this process."""
+    return _slots.locked()
+
+
+def export_select(room_id: int, since: datetime | None, until: datetime | None, include_deleted: bool):
+    stmt = _history_select().where(Message.room_id == room_id)
+    if not include_deleted:
+        stmt = stmt.where(Message.is_deleted == False)
+    # روی جدول پارتیشن‌بندی‌شده فقط ماه‌های داخل بازه اسکن می‌شوند
+    if since is not None:
+        stmt = stmt.where(Message.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(Message.created_at < until)
+    return stmt.order_by(Message.created_at, Message.id)
+
+
+async def export_room(
+    room_id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    include_deleted: bool = False,
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """NDJSON chunks, gzip-compressed when `gzip`. Waits for a slot if all are taken."""
+    async with _slots:
+        current_op.set("export_room")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip else None
+        stmt = export_select(room_id, since, until, include_deleted)
+        async with replicas.connect(room_key(room_id)) as conn:
+            result = await conn.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+            async for rows in result.mappings().partitions():
+                chunk = b"".join(serializer.dumps_bytes(_history_row(r)) + b"\n" for r in rows)
+                if compressor is not None:
+                    chunk = await asyncio.to_thread(compressor.compress, chunk)
+                if chunk:
+                    yield chunk
+                # بین دسته‌ها نوبت را به هندلرهای سوکت بده
+                await asyncio.sleep(0)
+        if compressor is not None:
+            yield compressor.flush()
@@ -0,0 +1,302 @@
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional
+
+import redis
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError, WatchError
+
+from app.core import serializer
+from app.core.config import settings
+from app.db.crud import encode_cursor, get_history
+from app.db.models import REPLY_PREVIEW_CHARS
+from app.db.session import AsyncSessionLocal, async_engine
+
+log = logging.getLogger(__name__)
+
+# entry -> patched entry, or None when the entry is untouched
+Patch = Callable[[dict], Optional[dict]]
+
+
+_dumps = serializer.dumps_bytes
+_loads = serializer.loads
+
+
+def _edit_patch(message_id: int, content: str, edited_at, seq: int) -> Patch:
+    edited_at = edited_at.isoformat() if edited_at else None
+
+    def patch(m: dict):
+        if m["id"] == message_id:
+            return {**m, "content": content, "edited_at": edited_at, "seq": seq}
+        if m.get("replied_to") == message_id and not m.get("reply_deleted"):
+            return {**m, "reply_text": content[:REPLY_PREVIEW_CHARS]}
+        return None
+    return patch
+
+def _delete_patch(message_id: int, seq: int) -> Patch:
+    def patch(m: dict):
+        # tombstone بجای حذف، تا طول بافر و محاسبه‌ی has_more درست بماند
+        if m["id"] == message_id:
+            return {**m, "content": None, "is_deleted": True, "seq": seq}
+        if m.get("replied_to") == message_id:
+            return {**m, "reply_text": None, "reply_user": None, "reply_deleted": True}
+        return None
+    return patch
+
+
+class HistoryCache:
+    """
+    Per-room ring buffer of the newest `capacity` serialized messages.
+
+    Deleted messages stay in the buffer as tombstones and are filtered on read.
+    Writers bump a per-room generation so a fill that raced with a write is dropped.
+    """
+
+    def __init__(self, capacity: int, max_rooms: int):
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+
+    # --- backend primitives ---
+    async def _load(self, room_id: int) -> list[dict] | None: ...
+    async def _store(self, room_id: int, entries: list[bytes], gen: int) -> None: ...
+    async def generation(self, room_id: int) -> int: ...
+    async def append(self, room_id: int, message: dict) -> None: ...
+    async def _patch(self, room_id: int, patch: Patch) -> None: ...
+
+    # --- public API ---
+    # seq: the message's new change_seq; replies only get a new preview, their seq is unchanged
+    async def update_message(self, room_id: int, message_id: int, content: str, edited_at, seq: int) -> None:
+        await self._patch(room_id, _edit_patch(message_id, content, edited_at, seq))
+
+    async def delete_message(self, room_id: int, message_id: int, seq: int) -> None:
+        await self._patch(room_id, _delete_patch(message_id, seq))
+
+    async def get_page(self, room_id: int, limit: int):
+        """Newest `limit` live messages as (messages, users, next_cursor), or None on a miss."""
+        if limit > self.capacity:
+            return None
+        entries = await self._load(room_id)
+        if entries is None:
+            return None
+        live = [m for m in entries if not m.get("is_deleted")]
+        page = live[-limit:] if limit else []
+        # بافر پر یعنی پیام‌های قدیمی‌تری در دیتابیس هست
+        has_more = len(live) > len(page) or len(entries) >= self.capacity
+        next_cursor = encode_cursor(page[0]["created_at"], page[0]["id"]) if has_more and page else None
+        users = sorted({m["username"] for m in page})
+        return page, users, next_cursor
+
+    async def fill(self, room_id: int, messages: list[dict], gen: int) -> None:
+        await self._store(room_id, [_dumps(m) for m in messages[-self.capacity:]], gen)
+
+
+class MemoryHistoryCache(HistoryCache):
+    """In-process backend for tests and single-worker setups."""
+
+    def __init__(self, capacity: int, max_rooms: int):
+        super().__init__(capacity, max_rooms)
+        self._rooms: "OrderedDict[int, Deque[bytes]]" = OrderedDict()
+        self._gens: Dict[int, int] = {}
+
+    def _touch(self, room_id: int) -> None:
+        self._rooms.move_to_end(room_id)
+        while len(self._rooms) > self.max_rooms:
+            evicted, _ = self._rooms.popitem(last=False)
+            self._gens.pop(evicted, None)
+
+    async def _load(self, room_id):
+        buf = self._rooms.get(room_id)
+        if not buf:
+            return None
+        self._touch(room_id)
+        return [_loads(raw) for raw in buf]
+
+    async def _store(self, room_id, entries, gen):
+        if not entries or self._gens.get(room_id, 0) != gen:
+            return
+        self._rooms[room_id] = deque(entries, maxlen=self.capacity)
+        self._touch(room_id)
+
+    async def generation(self, room_id):
+        return self._gens.get(room_id, 0)
+
+    async def append(self, room_id, message):
+        self._gens[room_id] = self._gens.get(room_id, 0) + 1
+        buf = self._rooms.get(room_id)
+        if buf is not None:
+            buf.append(_dumps(message))
+
+    async def _patch(self, room_id, patch):
+        self._gens[room_id] = self._gens.get(room_id, 0) + 1
+        buf = self._rooms.get(room_id)
+        if not buf:
+            return
+        for i, raw in enumerate(buf):
+            new = patch(_loads(raw))
+            if new is not None:
+                buf[i] = _dumps(new)
+
+
+class RedisHistoryCache(HistoryCache):
+    """
+    Redis backend: one list per room trimmed to `capacity`, plus a sorted set of
+    last-access times used to evict the least recently used rooms.
+    Any Redis failure degrades to a cache miss.
+    """
+
+    LRU_KEY = "history:lru"
+
+    def __init__(self, redis: aioredis.Redis, capacity: int, max_rooms: int):
+        super().__init__(capacity, max_rooms)
+        self._redis = redis
+
+    @staticmethod
+    def _key(room_id: int) -> str:
+        return f"history:{room_id}"
+
+    @staticmethod
+    def _gen_key(room_id: int) -> str:
+        return f"history:{room_id}:gen"
+
+    async def _evict(self) -> None:
+        excess = await self._redis.zcard(self.LRU_KEY) - self.max_rooms
+        if excess <= 0:
+            return
+        cold = await self._redis.zpopmin(self.LRU_KEY, excess)
+        keys = []
+        for member, _ in cold:
+            room_id = int(member)
+            keys += [self._key(room_id), self._gen_key(room_id)]
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def _load(self, room_id):
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(self._key(room_id), 0, -1)
+                pipe.zadd(self.LRU_KEY, {room_id: time.time()})
+                raw, _ = await pipe.execute()
+            if not raw:
+                return None
+            return [_loads(r) for r in raw]
+        except RedisError as e:
+            log.warning("history cache read failed for room %s: %s", room_id, e)
+            return None
+
+    async def _store(self, room_id, entries, gen):
+        if not entries:
+            return
+        key, gen_key = self._key(room_id), self._gen_key(room_id)
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(gen_key)
+                if int(await pipe.get(gen_key) or 0) != gen:
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *entries)
+                pipe.zadd(self.LRU_KEY, {room_id: time.time()})
+                await pipe.execute()
+            await self._evict()
+        except WatchError:
+            pass
+        except RedisError as e:
+            log.warning("history cache fill failed for room %s: %s", room_id, e)
+
+    async def generation(self, room_id):
+        try:
+            return int(await self._redis.get(self._gen_key(room_id)) or 0)
+        except RedisError:
+            # gen=-1 هیچ‌وقت با مقدار واقعی برابر نمی‌شود، پس fill انجام نمی‌شود
+            return -1
+
+    async def append(self, room_id, message):
+        key = self._key(room_id)
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.rpushx(key, _dumps(message))
+                pipe.ltrim(key, -self.capacity, -1)
+                pipe.incr(self._gen_key(room_id))
+                await pipe.execute()
+        except RedisError as e:
+            log.warning("history cache append failed for room %s: %s", room_id, e)
+
+    async def _patch(self, room_id, patch):
+        key, gen_key = self._key(room_id), self._gen_key(room_id)
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                for _ in range(3):
+                    try:
+                        await pipe.watch(key)
+                        raw = await pipe.lrange(key, 0, -1)
+                        pipe.multi()
+                        for i, r in enumerate(raw):
+                            new = patch(_loads(r))
+                            if new is not None:
+                                pipe.lset(key, i, _dumps(new))
+                        pipe.incr(gen_key)
+                        await pipe.execute()
+                        return
+                    except WatchError:
+                        continue
+            # رقابت دائمی روی این اتاق؛ کش را دور می‌ریزیم
+            await self._redis.delete(key)
+        except RedisError as e:
+            log.warning("history cache patch failed for room %s: %s", room_id, e)
+
+
+def build_history_cache() -> HistoryCache | None:
+    backend = settings.HISTORY_CACHE_BACKEND
+    capacity, max_rooms = settings.HISTORY_CACHE_SIZE, settings.HISTORY_CACHE_MAX_ROOMS
+    if backend == "redis":
+        return RedisHistoryCache(aioredis.from_url(settings.REDIS_URL), capacity, max_rooms)
+    if backend == "memory":
+        return MemoryHistoryCache(capacity, max_rooms)
+    return None
+
+history_cache = build_history_cache()
+
+
+def invalidate_sync(room_id: int) -> None:
+    """
+    Drop a room's cached page from a process without an event loop (the Celery fallback
+    of write-behind), after a write that never went through append().
+    """
+    if settings.HISTORY_CACHE_BACKEND != "redis":
+        return
+    try:
+        with redis.Redis.from_url(settings.REDIS_URL) as r, r.pipeline(transaction=True) as pipe:
+            pipe.delete(RedisHistoryCache._key(room_id))
+            pipe.incr(RedisHistoryCache._gen_key(room_id))
+            pipe.execute()
+    except RedisError as e:
+        log.warning("history cache invalidation failed for room %s: %s", room_id, e)
+
+
+async def get_recent_history(session, room_id: int, limit: int):
+    """
+    Newest page of a room, served from the hot cache and filled from the DB on a miss.
+    `session` may be a replica session; fills always read the primary, since a lagging
+    replica would pin a stale page in the cache.
+    """
+    if history_cache is None or limit > history_cache.capacity:
+        return await get_history(session, room_id, limit=limit)
+
+    cached = await history_cache.get_page(room_id, limit)
+    if cached is not None:
+        return cached
+
+    gen = await history_cache.generation(room_id)
+    if session.bind is async_engine:
+        # همان کانکشن؛ session دوم از همان pool زیر بار به بن‌بست می‌رسد
+        messages, users, next_cursor = await get_history(session, room_id, limit=history_cache.capacity)
+    else:
+        async with AsyncSessionLocal() as primary:
+            messages, users, next_cursor = await get_history(primary, room_id, limit=history_cache.capacity)
+    await history_cache.fill(room_id, messages, gen)
+
+    if len(messages) <= limit:
+        return messages, users, next_cursor
+    page = messages[-limit:]
+    return page, sorted({m["username"] for m in page}), encode_cursor(page[0]["created_at"], page[0]["id"])
@@ -0,0 +1,104 @@
+"""
+Query and pool timing for the SQLAlchemy engines.
+
+Statements are labelled with the crud function running them: functions decorated with
+@query_tag set a contextvar that the cursor hooks read, so the cost per statement is
+two perf_counter() calls and one histogram observe.
+"""
+import contextvars
+import functools
+import inspect
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.core.metrics import (
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_TIMEOUTS,
+    DB_POOL_WAIT_SECONDS,
+    DB_QUERY_ERRORS,
+    DB_QUERY_SECONDS,
+)
+
+current_op: contextvars.ContextVar[str] = contextvars.ContextVar("db_op", default="other")
+# set by callers that want their DB time broken out (socket handlers): any object with a float `db`
+query_timer: contextvars.ContextVar = contextvars.ContextVar("query_timer", default=None)
+
+
+def query_tag(fn):
+    """Label every statement `fn` runs with its name in chat_db_query_seconds."""
+    name = fn.__qualname__
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            token = current_op.set(name)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                current_op.reset(token)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_op.set(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_op.reset(token)
+    return wrapper
+
+
+class _TimedCheckout:
+    """Mixin timing the wait inside Pool._do_get (queue wait + new connects)."""
+    metrics_name = "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            DB_POOL_TIMEOUTS.labels(self.metrics_name).inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.labels(self.metrics_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Attach the query/pool hooks to a sync Engine (for AsyncEngine pass .sync_engine)."""
+    engine.pool.metrics_name = name
+    queries = DB_QUERY_SECONDS
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+        queries.labels(name, current_op.get()).observe(elapsed)
+        timer = query_timer.get()
+        if timer is not None:
+            timer.db += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        DB_QUERY_ERRORS.labels(name, current_op.get()).inc()
+
+    @event.listens_for(engine.pool, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        checked_out.inc()
+
+    @event.listens_for(engine.pool, "checkin")
+    def _checkin(dbapi_conn, record):
+        checked_out.dec()
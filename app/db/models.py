@@ -1,6 +1,11 @@
 from datetime import datetime
 from sqlalchemy.orm import DeclarativeBase, relationship, Mapped, mapped_column
-from sqlalchemy import Integer, String, Text, ForeignKey, DateTime, func, Column, Boolean, text
+from sqlalchemy import Integer, BigInteger, String, Text, ForeignKey, DateTime, func, Column, Boolean, Index, text, event, DDL
+
+# characters of the parent message kept on each reply (messages.reply_text)
+REPLY_PREVIEW_CHARS = 200
+# longest client_msg_id accepted on `message` (sent_messages.client_msg_id)
+CLIENT_MSG_ID_CHARS = 64
 
 class Base(DeclarativeBase):
     pass
@@ -17,25 +22,140 @@ class Room(Base):
     __tablename__ = "rooms"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # last change_seq handed out to this room's messages
+    change_seq: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    # messages ever posted; durable copy of the unread head counter (app/socket/unread.py)
+    message_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    # highest change_seq among the tombstones app/tasks/compaction.py has hard-deleted;
+    # crud.get_changes cannot serve a delta from before it
+    compacted_seq: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
 
     messages = relationship("Message", back_populates="room", cascade="all,delete-orphan")
 
 class Message(Base):
     __tablename__ = "messages"
+    # On Postgres the table is range-partitioned by month on created_at (see migration
+    # 202610180004): the real primary key is (id, created_at).
+    __table_args__ = (
+        Index("ix_messages_room_created", "room_id", "created_at", "id"),
+        Index("ix_messages_room_seq", "room_id", "change_seq"),
+        # live messages only (migration 202610180008): history pages skip tombstones entirely.
+        # SQLite uses a partial index only when the query repeats its WHERE term verbatim.
+        Index(
+            "ix_messages_room_live", "room_id", "created_at", "id",
+            postgresql_where=text("NOT is_deleted"), sqlite_where=text("is_deleted = 0"),
+        ),
+        # tombstones by deletion time, for app/tasks/compaction.py
+        Index(
+            "ix_messages_tombstones", "edited_at",
+            postgresql_where=text("is_deleted"), sqlite_where=text("is_deleted = 1"),
+        ),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"), index=True)
+    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"))
     user_id: Mapped[int | None] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"))
     content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     edited_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # soft delete: content is cleared and edited_at records the deletion time;
+    # app/tasks/compaction.py hard-deletes tombstones after TOMBSTONE_RETENTION_DAYS
     is_deleted = Column(Boolean, nullable=False, default=False)
+    # bumped from rooms.change_seq on insert, edit and soft delete
+    change_seq: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    # snapshots written on insert so history reads only this table (migration 202610180007):
+    # the author's username (never renamed) and a preview of the parent, refreshed by
+    # crud.update_message / delete_message_db with one UPDATE ... WHERE replied_to = :id
+    username: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    reply_text: Mapped[str | None] = mapped_column(String(REPLY_PREVIEW_CHARS), nullable=True)
+    reply_user: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    reply_deleted = Column(Boolean, nullable=False, default=False, server_default=text("false"))
 
     room = relationship("Room", back_populates="messages")
     user = relationship("User", back_populates="messages")
 
-    replied_to = Column(
-        Integer,
-        ForeignKey("messages.id", ondelete="SET NULL"),
-        nullable=True
+    # no FK: a partitioned table cannot be referenced by id alone (migration 202610180004);
+    # a reply whose parent was archived keeps its reply_* snapshot
+    replied_to = Column(Integer, nullable=True, index=True)
+    reply_parent = relationship(
+        "Message",
+        primaryjoin="foreign(Message.replied_to) == remote(Message.id)",
+        uselist=False,
     )
-    reply_parent = relationship("Message", remote_side=[id], uselist=False)
+
+
+class SentMessage(Base):
+    """
+    Client-generated ids of sent messages: a retried `message` with the same
+    (room_id, user_id, client_msg_id) gets the original row back instead of a new one.
+    A table of its own because a unique key on partitioned `messages` would have to
+    include created_at; app/tasks/compaction.py prunes rows older than
+    CLIENT_MSG_ID_RETENTION_HOURS.
+    """
+    __tablename__ = "sent_messages"
+    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    client_msg_id: Mapped[str] = mapped_column(String(CLIENT_MSG_ID_CHARS), primary_key=True)
+    # null only while the send that claimed it is still inserting (SQLite path)
+    message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False, index=True
+    )
+
+
+class ReadState(Base):
+    """Per-user read pointer into a room, flushed periodically from the unread counters."""
+    __tablename__ = "read_state"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True)
+    last_read_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # the room's message_count when the user last read it
+    read_pos: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class ImportJob(Base):
+    """Bulk NDJSON import (app/tasks/bulk_import.py); offset and rows advance in the same transaction as each batch."""
+    __tablename__ = "import_jobs"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
+    # queued, running, done or failed
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")
+    total_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    # bytes of the file already imported (the resume point) and rows loaded / rejected so far
+    offset: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    skipped: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+# --- full-text search ---
+# Postgres: generated tsvector + trigram index (the 'simple' config: no Persian stemmer ships with PG).
+# SQLite (local runs): an external-content FTS5 table kept in sync by triggers.
+# Neither is mapped on Message; crud.search_messages queries them directly.
+_SEARCH_DDL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_tsv ON messages USING gin (room_id, search_tsv)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_content_trgm ON messages USING gin (room_id, content gin_trgm_ops)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    ],
+}
+
+for _dialect, _statements in _SEARCH_DDL.items():
+    for _sql in _statements:
+        event.listen(Message.__table__, "after_create", DDL(_sql).execute_if(dialect=_dialect))
@@ -0,0 +1,102 @@
+"""Monthly range partitions of `messages` on Postgres, named messages_pYYYY_MM (UTC months)."""
+import logging
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+from app.db.models import Message
+
+log = logging.getLogger(__name__)
+
+PARTITION_RE = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+# catches rows outside every monthly partition (migration 202610180004)
+DEFAULT_PARTITION = "messages_default"
+
+
+def month_start(d: date | datetime) -> date:
+    return date(d.year, d.month, 1)
+
+def add_months(month: date, n: int) -> date:
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"messages_p{month.year:04d}_{month.month:02d}"
+
+def month_bounds(month: date) -> tuple[datetime, datetime]:
+    lower = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    upper_month = add_months(month, 1)
+    return lower, datetime(upper_month.year, upper_month.month, 1, tzinfo=timezone.utc)
+
+
+def list_partitions(conn: Connection) -> list[tuple[str, date]]:
+    """(name, month) of every monthly partition currently attached, oldest first."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'messages'::regclass"
+    )).scalars()
+    found = []
+    for name in rows:
+        m = PARTITION_RE.match(name)
+        if m:
+            found.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(found, key=lambda p: p[1])
+
+def _create_month(conn: Connection, name: str, month: date) -> None:
+    lower, upper = month_bounds(month)
+    bounds = f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+    in_range = f"created_at >= '{lower.isoformat()}' AND created_at < '{upper.isoformat()}'"
+    # نوشتن در default تا attach شدن ماه صبر می‌کند، پس ردیف تازه‌ای از این بازه آنجا نمی‌افتد
+    conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE"))
+    if not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})")).scalar():
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF messages {bounds}"))
+        return
+
+    # CREATE ... PARTITION OF fails while the default partition holds rows of this month:
+    # build the month as a plain table, move those rows into it, then attach it
+    columns = ", ".join(c.name for c in Message.__table__.columns)
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)"
+    ))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING {columns}) "
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+    )).rowcount
+    conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} {bounds}"))
+    log.warning("moved %d rows of %s out of %s", moved, name, DEFAULT_PARTITION)
+
+def ensure_months(conn: Connection, months) -> list[str]:
+    """
+    Create the partitions of `months` that do not exist yet; returns the ones created.
+    Runs inside the caller's transaction, one savepoint per month: a month that cannot be
+    created is logged and skipped, and its rows keep landing in the default partition.
+    """
+    existing = {name for name, _ in list_partitions(conn)}
+    created = []
+    for month in sorted(set(months)):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        try:
+            with conn.begin_nested():
+                _create_month(conn, name, month)
+        except DBAPIError as e:
+            log.error("could not create partition %s; its rows stay in %s: %s", name, DEFAULT_PARTITION, e)
+            continue
+        created.append(name)
+        log.info("created partition %s", name)
+    return created
+
+def ensure_partitions(conn: Connection, months_ahead: int) -> list[str]:
+    """Create partitions for this month and the next `months_ahead`; returns the ones created."""
+    this_month = month_start(datetime.now(timezone.utc))
+    return ensure_months(conn, [add_months(this_month, i) for i in range(months_ahead + 1)])
+
+def detach_and_drop(conn: Connection, name: str) -> None:
+    if not PARTITION_RE.match(name):
+        raise ValueError(f"not a monthly partition: {name!r}")
+    conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
@@ -0,0 +1,163 @@
+"""
+Read routing between the primary and read replicas.
+
+Reads that tolerate a few seconds of staleness (history pages, deltas, search, export)
+take a session from `replicas.session(key)`; everything that writes keeps using
+AsyncSessionLocal. A replica is used only while its last health check passed and its
+lag was under REPLICA_MAX_LAG. A key (the username, so it survives reconnects) that wrote
+within READ_YOUR_WRITES_WINDOW reads from the primary, so users always see their own writes.
+REST callers may not say who they are, so REST writes also mark the room (room_key) and
+REST reads of that room go to the primary for the same window.
+
+Without REPLICA_DATABASE_URLS every read goes to the primary. For a local setup, point
+REPLICA_DATABASE_URLS at a second database (another SQLite file, or a streaming standby
+of a local Postgres); SQLite always reports zero lag.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.config import settings
+from app.core.metrics import DB_READ_ROUTES, REPLICA_HEALTHY, REPLICA_LAG_SECONDS
+from app.db.instrument import TimedAsyncQueuePool, instrument_engine
+from app.db.session import AsyncSessionLocal, _pool_options, async_engine
+
+log = logging.getLogger(__name__)
+
+# 0 while the standby has replayed everything it received: an idle primary is not lag
+_PG_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class ReplicaSet:
+    MAX_WRITERS = 100000
+
+    def __init__(self, urls: list[str], max_lag: float, check_interval: float, ryw_window: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.ryw_window = ryw_window
+        self.engines: list[AsyncEngine] = []
+        self._sessions: list[async_sessionmaker] = []
+        for i, url in enumerate(urls):
+            engine = create_async_engine(url, future=True, **_pool_options(url, TimedAsyncQueuePool))
+            instrument_engine(engine.sync_engine, f"replica{i}")
+            self.engines.append(engine)
+            self._sessions.append(async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession))
+        # تا اولین health check، replica ها استفاده نمی‌شوند
+        self._healthy = [False] * len(urls)
+        self._turn = itertools.count()
+        # key -> monotonic deadline until which it reads from the primary
+        self._writers: Dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+
+    # --- routing ---
+    def note_write(self, key: str | None) -> None:
+        if key is None or not self.engines:
+            return
+        now = time.monotonic()
+        if len(self._writers) >= self.MAX_WRITERS:
+            self._writers = {k: d for k, d in self._writers.items() if d > now}
+        self._writers[key] = now + self.ryw_window
+
+    def _pick(self, keys) -> int | None:
+        """Index of the replica to read from, or None for the primary."""
+        if not self.engines:
+            return None
+        now = time.monotonic()
+        for key in keys:
+            deadline = self._writers.get(key) if key is not None else None
+            if deadline is None:
+                continue
+            if deadline > now:
+                DB_READ_ROUTES.labels("primary_ryw").inc()
+                return None
+            del self._writers[key]
+        healthy = [i for i, ok in enumerate(self._healthy) if ok]
+        if not healthy:
+            DB_READ_ROUTES.labels("primary_fallback").inc()
+            return None
+        DB_READ_ROUTES.labels("replica").inc()
+        return healthy[next(self._turn) % len(healthy)]
+
+    def session(self, *keys: str | None) -> AsyncSession:
+        """A read-only session: use as `async with replicas.session(username) as session:`."""
+        i = self._pick(keys)
+        return AsyncSessionLocal() if i is None else self._sessions[i]()
+
+    @asynccontextmanager
+    async def connect(self, *keys: str | None) -> AsyncIterator:
+        i = self._pick(keys)
+        async with (async_engine if i is None else self.engines[i]).connect() as conn:
+            yield conn
+
+    # --- health ---
+    async def check(self) -> None:
+        for i, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as conn:
+                    lag = float(await conn.scalar(_PG_LAG)) if engine.dialect.name == "postgresql" else 0.0
+            except Exception as e:
+                if self._healthy[i]:
+                    log.warning("replica%d unreachable, reading from the primary: %s", i, e)
+                self._healthy[i] = False
+                REPLICA_HEALTHY.labels(f"replica{i}").set(0)
+                continue
+            ok = lag <= self.max_lag
+            if ok != self._healthy[i]:
+                log.warning("replica%d %s (lag %.1fs)", i, "back in rotation" if ok else "lagging, skipped", lag)
+            self._healthy[i] = ok
+            REPLICA_LAG_SECONDS.labels(f"replica{i}").set(lag)
+            REPLICA_HEALTHY.labels(f"replica{i}").set(int(ok))
+
+    def start(self) -> None:
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                log.exception("replica health check failed")
+            await asyncio.sleep(self.check_interval)
+
+
+replicas = ReplicaSet(
+    [u.strip() for u in settings.REPLICA_DATABASE_URLS.split(",") if u.strip()],
+    settings.REPLICA_MAX_LAG,
+    settings.REPLICA_CHECK_INTERVAL,
+    settings.READ_YOUR_WRITES_WINDOW,
+)
+
+
+def room_key(room_id: int) -> str:
+    return f"room:{room_id}"
+
+
+async def get_read_session(room_id: int, username: str | None = None) -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency for /rooms/{room_id}/... reads: a session on a healthy replica, or
+    the primary while the room (or `?username=`) has a REST write in the read-your-writes window.
+    """
+    async with replicas.session(room_key(room_id), username) as session:
+        yield session
@@ -5,9 +5,17 @@ class MessageOut(BaseModel):
     id: int
     room_id: int
     username: str | None
-    content: str
+    content: str | None
     created_at: datetime
     edited_at: datetime | None = None
+    is_deleted: bool = False
+    # same fields as the socket payloads; reply_* are snapshots of the parent (messages.reply_*)
+    replied_to: int | None = None
+    reply_text: str | None = None
+    reply_user: str | None = None
+    reply_deleted: bool = False
+    # the message's change_seq; None on rows archived before it was exported
+    seq: int | None = None
 
     @property
     def edited(self) -> bool:
@@ -17,3 +25,21 @@ class HistoryOut(BaseModel):
     room_id: int
     messages: list[MessageOut]
     users: list[str]
+    next_cursor: str | None = None
+    # room change_seq as of this response; pass it back as since_seq to get a delta
+    seq: int | None = None
+    # true when since_seq was too far behind and the newest page is sent instead
+    reset: bool = False
+
+class SearchOut(BaseModel):
+    room_id: int
+    q: str
+    # best match first
+    messages: list[MessageOut]
+    next_cursor: str | None = None
+
+class UnreadOut(BaseModel):
+    username: str
+    # room_id -> unread messages, for every room the user has joined
+    rooms: dict[int, int]
+    total: int
@@ -2,18 +2,42 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, Asyn
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
 from app.core.config import settings
+from app.db.instrument import TimedAsyncQueuePool, TimedQueuePool, instrument_engine
 from typing import AsyncGenerator
 
+
+def _pool_options(url: str, poolclass) -> dict:
+    # SQLite (local runs) keeps SQLAlchemy's default pool
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
 # Async engine for FastAPI
-async_engine = create_async_engine(settings.DATABASE_URL_ASYNC, echo=False, future=True)
+async_engine = create_async_engine(
+    settings.DATABASE_URL_ASYNC, echo=False, future=True,
+    **_pool_options(settings.DATABASE_URL_ASYNC, TimedAsyncQueuePool),
+)
+instrument_engine(async_engine.sync_engine, "async")
 AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False, class_=AsyncSession)
+# Same pool, no BEGIN/COMMIT: for single-statement writes on the hot path
+async_autocommit_engine = async_engine.execution_options(isolation_level="AUTOCOMMIT")
 
 # Sync engine/session for Celery & Alembic
-sync_engine = create_engine(settings.DATABASE_URL_SYNC, echo=False, future=True)
+sync_engine = create_engine(
+    settings.DATABASE_URL_SYNC, echo=False, future=True,
+    **_pool_options(settings.DATABASE_URL_SYNC, TimedQueuePool),
+)
+instrument_engine(sync_engine, "sync")
 SyncSessionLocal = sessionmaker(bind=sync_engine, expire_on_commit=False)
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
         yield session
-
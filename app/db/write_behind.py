@@ -0,0 +1,239 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError, NoResultFound
+
+from app.core.config import settings
+from app.db.crud import next_change_seq
+from app.db.instrument import query_tag
+from app.db.models import Message, SentMessage
+from app.db.session import AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehindBusy(Exception):
+    """Queue stayed full for longer than WRITE_BEHIND_PUT_TIMEOUT."""
+
+class WriteBehindDeferred(Exception):
+    """The batch insert failed and the row was handed to the Celery worker instead; it broadcasts once saved."""
+
+class WriteBehindRejected(Exception):
+    """The row fails on its own (a constraint, a room that does not exist); it was not saved."""
+
+# errors caused by the rows themselves: the batch is split until the bad row is alone,
+# anything else (connection loss, timeouts) defers the whole batch to Celery
+_ROW_ERRORS = (IntegrityError, DataError, NoResultFound)
+
+
+class PendingMessage(NamedTuple):
+    room_id: int
+    user_id: int
+    username: str
+    content: str
+    replied_to: int | None
+    # reply_text / reply_user / reply_deleted snapshot (crud.get_reply_snapshot)
+    reply: dict
+    client_msg_id: str | None
+    future: asyncio.Future
+
+
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    Write-behind pipeline for chat messages.
+
+    submit() enqueues a row and waits for it to be persisted; a single flusher task
+    turns everything queued within `flush_ms` (or up to `batch_size` rows) into one
+    multi-row INSERT ... RETURNING id, created_at, change_seq.
+
+    Rows with a client_msg_id claim it in sent_messages within the same transaction;
+    a send whose id is already taken (or repeated within the batch) is not inserted
+    and resolves to None.
+
+    A batch that fails because of its own rows is split in halves until the bad row is
+    alone and rejected (WriteBehindRejected); other failures hand the batch to Celery.
+    """
+
+    def __init__(self, batch_size: int, flush_ms: int, queue_size: int, put_timeout: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.put_timeout = put_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop accepting messages and flush everything already queued."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def submit(self, room_id: int, user_id: int, username: str, content: str,
+                     replied_to: int | None = None, reply: dict | None = None,
+                     client_msg_id: str | None = None) -> tuple[int, datetime, int] | None:
+        if self._closing or self._task is None:
+            raise RuntimeError("message writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        item = PendingMessage(room_id, user_id, username, content, replied_to, reply or {}, client_msg_id, future)
+        try:
+            # صف پر = فشار برگشتی روی همین فرستنده
+            await asyncio.wait_for(self._queue.put(item), self.put_timeout)
+        except asyncio.TimeoutError:
+            raise WriteBehindBusy()
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # drain: هرچه بعد از STOP در صف مانده
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for i in range(0, len(rest), self.batch_size):
+            await self._flush(rest[i:i + self.batch_size])
+
+    async def _flush(self, batch: list[PendingMessage]) -> None:
+        try:
+            results = await self._write(batch)
+        except _ROW_ERRORS as e:
+            if len(batch) == 1:
+                # خطای خود همین ردیف؛ Celery هم همین‌طور شکست می‌خورد
+                log.warning("write-behind rejected a message for room %s: %s", batch[0].room_id, e)
+                if not batch[0].future.done():
+                    batch[0].future.set_exception(WriteBehindRejected(str(e)))
+                return
+            # نصف‌کردن تا ردیف خراب بقیه‌ی دسته را از بین نبرد
+            mid = len(batch) // 2
+            await self._flush(batch[:mid])
+            await self._flush(batch[mid:])
+            return
+        except Exception as e:
+            log.exception("write-behind flush of %d messages failed, deferring to worker", len(batch))
+            self._defer(batch, e)
+            return
+
+        for p in batch:
+            if not p.future.done():
+                p.future.set_result(results.get(id(p)))
+
+    @query_tag
+    async def _write(self, batch: list[PendingMessage]) -> dict[int, tuple[int, datetime, int]]:
+        """Insert the batch in one transaction; id(pending) -> (id, created_at, change_seq) for rows inserted."""
+        async with AsyncSessionLocal() as session:
+            fresh = await self._claim(session, batch)
+            rows = [
+                {"room_id": p.room_id, "user_id": p.user_id, "username": p.username, "content": p.content,
+                 "replied_to": p.replied_to, "reply_text": None, "reply_user": None, "reply_deleted": False,
+                 **p.reply}
+                for p in fresh
+            ]
+            per_room: dict[int, list[dict]] = {}
+            for row in rows:
+                per_room.setdefault(row["room_id"], []).append(row)
+            # یک UPDATE برای هر اتاق؛ به ترتیب id تا بین پروسه‌ها deadlock نشود
+            for room_id in sorted(per_room):
+                room_rows = per_room[room_id]
+                last = await next_change_seq(session, room_id, len(room_rows))
+                for i, row in enumerate(room_rows):
+                    row["change_seq"] = last - len(room_rows) + 1 + i
+            returned = []
+            if rows:
+                res = await session.execute(
+                    insert(Message).returning(
+                        Message.id, Message.created_at, Message.change_seq, sort_by_parameter_order=True
+                    ),
+                    rows,
+                )
+                returned = res.all()
+            sent = [
+                {"room_id": p.room_id, "user_id": p.user_id, "client_msg_id": p.client_msg_id,
+                 "message_id": msg_id, "created_at": created_at}
+                for p, (msg_id, created_at, _) in zip(fresh, returned)
+                if p.client_msg_id is not None
+            ]
+            if sent:
+                # به‌روزرسانی دسته‌ای با کلید اصلی
+                await session.execute(update(SentMessage), sent)
+            await session.commit()
+        return {id(p): tuple(r) for p, r in zip(fresh, returned)}
+
+    @staticmethod
+    async def _claim(session, batch: list[PendingMessage]) -> list[PendingMessage]:
+        """Claim the batch's client_msg_ids; returns the messages to insert."""
+        first: dict[tuple, PendingMessage] = {}
+        for p in batch:
+            if p.client_msg_id is not None:
+                first.setdefault((p.room_id, p.user_id, p.client_msg_id), p)
+        if not first:
+            return batch
+        dialect_insert = sqlite.insert if session.get_bind().dialect.name == "sqlite" else postgresql.insert
+        res = await session.execute(
+            dialect_insert(SentMessage)
+            .on_conflict_do_nothing()
+            .returning(SentMessage.room_id, SentMessage.user_id, SentMessage.client_msg_id),
+            [{"room_id": r, "user_id": u, "client_msg_id": c} for r, u, c in first],
+        )
+        won = {id(first[tuple(row)]) for row in res}
+        return [p for p in batch if p.client_msg_id is None or id(p) in won]
+
+    def _defer(self, batch: list[PendingMessage], error: Exception) -> None:
+        from app.tasks.save_message import save_message_task
+
+        for p in batch:
+            try:
+                save_message_task.delay(p.room_id, p.username, p.content, p.replied_to, p.client_msg_id)
+                exc: Exception = WriteBehindDeferred()
+            except Exception:
+                log.exception("could not hand message to worker; it is lost")
+                exc = error
+            if not p.future.done():
+                p.future.set_exception(exc)
+
+
+message_writer = (
+    MessageWriter(
+        settings.WRITE_BEHIND_BATCH_SIZE,
+        settings.WRITE_BEHIND_FLUSH_MS,
+        settings.WRITE_BEHIND_QUEUE_SIZE,
+        settings.WRITE_BEHIND_PUT_TIMEOUT,
+    )
+    if settings.WRITE_BEHIND_ENABLED
+    else None
+)
@@ -1,13 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import socketio
 
+from app.core import serializer
 from app.core.config import settings
 from app.api.routes import router as api_router
 from app.socket.events import register_socket_events
+from app.socket.presence import presence
+from app.socket.unread import unread
+from app.socket.batching import batcher
+from app.socket.affinity import affinity, AffineRedisManager
+from app.socket.instrument import instrument, loop_monitor
+from app.socket import backpressure
+from app.db.write_behind import message_writer
+from app.db.replicas import replicas
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    if message_writer:
+        message_writer.start()
+    replicas.start()
+    presence.start(sio)
+    unread.start(sio)
+    affinity.start(sio)
+    loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+    await affinity.stop()
+    await unread.stop()
+    await batcher.flush_all()
+    await replicas.stop()
+    await presence.stop()
+    if message_writer:
+        await message_writer.stop()
 
 # FastAPI app
-fastapi_app = FastAPI(title="Chat Backend (FastAPI + Socket.IO)")
+fastapi_app = FastAPI(title="Chat Backend (FastAPI + Socket.IO)", lifespan=lifespan)
 
 # CORS
 origins = [o.strip() for o in settings.CORS_ORIGINS.split(",") if o.strip()]
@@ -23,9 +53,23 @@ fastapi_app.add_middleware(
 fastapi_app.include_router(api_router, prefix="/api")
 
 # Socket.IO with Redis message queue (good for scale)
-mgr = socketio.AsyncRedisManager(settings.REDIS_URL)
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins=origins or "*", client_manager=mgr)
+if settings.SOCKETIO_CLIENT_MANAGER == "memory":
+    mgr = socketio.AsyncManager()
+elif affinity.enabled:
+    # هر worker فقط کانال خودش را گوش می‌دهد (app/socket/affinity.py)
+    mgr = AffineRedisManager(settings.REDIS_URL, affinity, json=serializer)
+else:
+    mgr = socketio.AsyncRedisManager(settings.REDIS_URL, json=serializer)
+sio = socketio.AsyncServer(
+    async_mode="asgi",
+    cors_allowed_origins=origins or "*",
+    client_manager=mgr,
+    json=serializer,
+    serializer=serializer.packet_class(settings.SOCKETIO_SERIALIZER),
+)
 register_socket_events(sio)
+instrument(sio)
+backpressure.install(sio, settings.OUTBOUND_QUEUE_MAX, settings.SLOW_CONSUMER_POLICY)
 
 # Expose a single ASGI app (Socket.IO wrapping FastAPI)
 app = socketio.ASGIApp(sio, other_asgi_app=fastapi_app)
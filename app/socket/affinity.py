@@ -0,0 +1,171 @@
+"""
+Room-affine serving: every room is owned by one worker process.
+
+`python -m app.supervisor --workers N` starts N API processes (WORKER_SLOT 0..N-1) and
+keeps the live ones in the Redis hash AFFINITY_KEY ({slot: public url}). Each process
+reads it every AFFINITY_REFRESH_INTERVAL and maps rooms to slots with a consistent-hash
+ring, so when a worker dies or comes back only that worker's rooms move.
+
+A socket joins a room only on the room's owner (others answer `room_moved` with the
+owner's url; GET /api/rooms/{id}/worker tells clients where to connect first). Since
+all of a room's members sit in one process, its broadcasts stay local: AffineRedisManager
+listens on its own channel only and publishes just the emits aimed at rooms another
+worker owns (REST edits, deletes). Per-room state such as broadcast batching and
+presence (PRESENCE_BACKEND=memory) then needs nothing shared.
+
+Without WORKER_SLOT the process owns every room, as before.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+from typing import Dict
+
+import socketio
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of room ids onto worker slots, `vnodes` points per slot."""
+
+    def __init__(self, slots, vnodes: int = 64):
+        points = sorted((_hash(f"{slot}#{v}"), slot) for slot in slots for v in range(vnodes))
+        self._keys = [k for k, _ in points]
+        self._slots = [s for _, s in points]
+
+    def owner(self, room_id: int) -> int | None:
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(str(room_id))) % len(self._keys)
+        return self._slots[i]
+
+
+def channel(slot: int) -> str:
+    return f"socketio:w{slot}"
+
+
+class Affinity:
+    def __init__(self, slot: int | None, key: str, refresh: float):
+        self.slot = slot
+        self.key = key
+        self.refresh_interval = refresh
+        self.urls: Dict[int, str] = {}
+        self.ring = HashRing(())
+        self._redis = aioredis.from_url(settings.REDIS_URL) if slot is not None else None
+        self._sio: socketio.AsyncServer | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.slot is not None
+
+    def owner(self, room_id: int) -> int | None:
+        return self.ring.owner(room_id) if self.enabled else None
+
+    def is_local(self, room_id: int) -> bool:
+        # تا اولین خواندن حلقه (یا بدون supervisor) همه‌ی اتاق‌ها محلی‌اند
+        owner = self.owner(room_id)
+        return owner is None or owner == self.slot
+
+    def route(self, room_id: int) -> dict:
+        owner = self.owner(room_id)
+        return {"room_id": room_id, "worker": owner, "url": self.urls.get(owner)}
+
+    async def refresh(self) -> None:
+        raw = await self._redis.hgetall(self.key)
+        urls = {int(k): v.decode() for k, v in raw.items()}
+        if urls == self.urls:
+            return
+        log.info("worker ring changed: %s", sorted(urls))
+        self.urls, self.ring = urls, HashRing(urls)
+        await self._hand_off()
+
+    async def _hand_off(self) -> None:
+        """Tell sockets in rooms this worker no longer owns to reconnect to the new owner."""
+        if self._sio is None:
+            return
+        from app.socket.batching import batcher
+
+        rooms = [r for r in self._sio.manager.rooms.get("/", {}) if isinstance(r, str) and r.isdigit()]
+        for room in rooms:
+            room_id = int(room)
+            if self.is_local(room_id):
+                continue
+            await batcher.flush(room_id)
+            await self._sio.emit("room_moved", self.route(room_id), room=room, ignore_queue=True)
+
+    def start(self, sio: socketio.AsyncServer) -> None:
+        self._sio = sio
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._redis.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except RedisError as e:
+                # حلقه‌ی قبلی معتبر می‌ماند
+                log.warning("could not read the worker ring: %s", e)
+            await asyncio.sleep(self.refresh_interval)
+
+
+class AffineRedisManager(socketio.AsyncRedisManager):
+    """
+    Redis client manager for room-affine workers: subscribes to this worker's channel
+    only, and publishes an emit only when the target room is owned by another worker.
+    Emits to a sid are always local (a socket never leaves the worker it connected to).
+    """
+
+    def __init__(self, url: str, affinity: Affinity, **kwargs):
+        super().__init__(url, channel=channel(affinity.slot), **kwargs)
+        self.affinity = affinity
+
+    def _targets(self, data: dict) -> list[str]:
+        room = data.get("room")
+        if data.get("method") != "emit" or (room is not None and not str(room).isdigit()):
+            return []
+        if room is None:
+            return [channel(s) for s in self.affinity.urls if s != self.affinity.slot]
+        owner = self.affinity.owner(int(room))
+        return [] if owner is None or owner == self.affinity.slot else [channel(owner)]
+
+    async def _publish(self, data):
+        for target in self._targets(data):
+            message = self.json.dumps(data)
+            for attempt in range(2):
+                try:
+                    if not self.connected:
+                        self._redis_connect()
+                    await self.redis.publish(target, message)
+                    break
+                except Exception as exc:
+                    self.connected = False
+                    if attempt:
+                        self._get_logger().error("cannot publish to %s: %s", target, exc)
+
+
+affinity = Affinity(
+    int(settings.WORKER_SLOT) if settings.WORKER_SLOT else None,
+    settings.AFFINITY_KEY,
+    settings.AFFINITY_REFRESH_INTERVAL,
+)
@@ -0,0 +1,48 @@
+"""
+Bounded outbound queues for Socket.IO clients.
+
+Engine.IO gives every client an unbounded packet queue that its writer task drains
+as fast as the client reads, so one stalled consumer grows it forever. install()
+caps it: once a client has `max_queue` packets waiting, further packets are either
+dropped or the client is disconnected. Disconnecting is the default because a
+reconnecting client resyncs via since_seq, while a dropped packet is just lost.
+"""
+import asyncio
+import logging
+
+import socketio
+
+from app.core.metrics import SLOW_CONSUMER_DISCONNECTS, SLOW_CONSUMER_PACKETS
+
+log = logging.getLogger(__name__)
+
+POLICIES = ("disconnect", "drop")
+
+
+def install(sio: socketio.AsyncServer, max_queue: int, policy: str) -> None:
+    if policy not in POLICIES:
+        raise ValueError(f"SLOW_CONSUMER_POLICY must be one of {POLICIES}, got {policy!r}")
+    eio = sio.eio
+    send_packet = eio.send_packet
+    closing: set[str] = set()
+
+    async def close(eio_sid: str) -> None:
+        try:
+            await eio.disconnect(eio_sid)
+        finally:
+            closing.discard(eio_sid)
+
+    async def bounded_send_packet(eio_sid, pkt):
+        # eio internals: socket.queue is the per-client outbound queue
+        socket = eio.sockets.get(eio_sid)
+        if socket is not None and socket.queue.qsize() >= max_queue:
+            SLOW_CONSUMER_PACKETS.labels(policy).inc()
+            if policy == "disconnect" and eio_sid not in closing:
+                closing.add(eio_sid)
+                SLOW_CONSUMER_DISCONNECTS.inc()
+                log.warning("disconnecting slow consumer %s (%d packets queued)", eio_sid, socket.queue.qsize())
+                asyncio.ensure_future(close(eio_sid))
+            return
+        await send_packet(eio_sid, pkt)
+
+    eio.send_packet = bounded_send_packet
@@ -0,0 +1,136 @@
+"""
+Adaptive per-room broadcast batching.
+
+Every room broadcast costs one pub/sub publish plus one websocket frame per member.
+Once a room sends `threshold` events per second or more, its `message`,
+`message_edited` and `system` broadcasts are held for `window` seconds and go out as
+one `message_batch` event: {"room_id", "events": [[event, data], ...]} in send
+order. Quiet rooms keep immediate delivery. Any other room broadcast first flushes
+what the room has pending, so clients never see events out of order.
+
+The rate is measured per process, from the broadcasts this process makes.
+"""
+import asyncio
+import math
+import time
+from typing import Dict
+
+import socketio
+
+from app.core.config import settings
+from app.core.metrics import BROADCAST_BATCHED_EVENTS, BROADCAST_BATCHES
+
+BATCHED_EVENTS = frozenset({"message", "message_edited", "system"})
+
+
+def parse_overrides(spec: str) -> Dict[int, float]:
+    """ "42=always,7=off,9=20" -> {42: 0.0, 7: inf, 9: 20.0} """
+    overrides = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        room_id, _, mode = item.partition("=")
+        mode = mode.strip().lower()
+        if mode == "always":
+            threshold = 0.0
+        elif mode == "off":
+            threshold = math.inf
+        else:
+            threshold = float(mode)
+        overrides[int(room_id)] = threshold
+    return overrides
+
+
+class _Room:
+    __slots__ = ("second", "count", "last_count", "pending")
+
+    def __init__(self, second: int):
+        self.second = second
+        self.count = 0
+        self.last_count = 0
+        self.pending: list[tuple[str, dict]] | None = None
+
+
+class RoomBatcher:
+    MAX_ROOMS = 10000
+
+    def __init__(self, threshold: float, window: float, max_batch: int, overrides: Dict[int, float]):
+        self.threshold = threshold if threshold > 0 else math.inf
+        self.window = window
+        self.max_batch = max_batch
+        self.overrides = overrides
+        self._rooms: Dict[int, _Room] = {}
+        self._sio: socketio.AsyncServer | None = None
+
+    def attach(self, sio: socketio.AsyncServer) -> None:
+        self._sio = sio
+
+    def configure(self, room_id: int, threshold: float | None) -> None:
+        """Per-room threshold in events/sec (0 always batches, inf never); None restores the default."""
+        if threshold is None:
+            self.overrides.pop(room_id, None)
+        else:
+            self.overrides[room_id] = threshold
+
+    async def emit(self, event: str, data: dict, room_id: int) -> None:
+        state = self._tick(room_id)
+        if state.pending is None and (event not in BATCHED_EVENTS or not self._hot(room_id, state)):
+            await self._sio.emit(event, data, room=str(room_id))
+            return
+        if event not in BATCHED_EVENTS:
+            await self.flush(room_id)
+            await self._sio.emit(event, data, room=str(room_id))
+            return
+
+        if state.pending is None:
+            state.pending = []
+            asyncio.get_running_loop().call_later(self.window, lambda: asyncio.ensure_future(self.flush(room_id)))
+        state.pending.append((event, data))
+        if len(state.pending) >= self.max_batch:
+            await self.flush(room_id)
+
+    async def flush(self, room_id: int) -> None:
+        state = self._rooms.get(room_id)
+        if state is None or not state.pending:
+            return
+        events, state.pending = state.pending, None
+        if len(events) == 1:
+            # یک رویداد تنها را به شکل عادی بفرست
+            await self._sio.emit(*events[0], room=str(room_id))
+            return
+        BROADCAST_BATCHES.inc()
+        for event, _ in events:
+            BROADCAST_BATCHED_EVENTS.labels(event).inc()
+        await self._sio.emit("message_batch", {"room_id": room_id, "events": events}, room=str(room_id))
+
+    async def flush_all(self) -> None:
+        for room_id in [r for r, s in self._rooms.items() if s.pending]:
+            await self.flush(room_id)
+
+    # --- rate per room: events in the current and the previous whole second ---
+    def _tick(self, room_id: int) -> _Room:
+        now = int(time.monotonic())
+        state = self._rooms.get(room_id)
+        if state is None:
+            if len(self._rooms) >= self.MAX_ROOMS:
+                self._prune(now)
+            state = self._rooms[room_id] = _Room(now)
+        if state.second != now:
+            state.last_count = state.count if state.second == now - 1 else 0
+            state.count = 0
+            state.second = now
+        state.count += 1
+        return state
+
+    def _hot(self, room_id: int, state: _Room) -> bool:
+        return max(state.count, state.last_count) >= self.overrides.get(room_id, self.threshold)
+
+    def _prune(self, now: int) -> None:
+        for room_id in [r for r, s in self._rooms.items() if s.pending is None and s.second < now - 1]:
+            del self._rooms[room_id]
+
+
+batcher = RoomBatcher(
+    settings.BROADCAST_BATCH_RATE,
+    settings.BROADCAST_BATCH_WINDOW_MS / 1000,
+    settings.BROADCAST_BATCH_MAX,
+    parse_overrides(settings.BROADCAST_BATCH_ROOMS),
+)
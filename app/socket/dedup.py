@@ -0,0 +1,115 @@
+"""
+Recent `message` acks by (room_id, user_id, client_msg_id), so a retried send is
+answered without a database round trip.
+
+The durable guard is sent_messages (crud.insert_message_with_preview claims the key in
+the same statement as the insert); this cache makes the common retry cheap and holds a
+placeholder while the first send is still in flight, so a retry racing it is told to
+wait instead of being inserted twice.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.core import serializer
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+Key = Tuple[int, int, str]
+
+# seconds a claim lives without done(); a send that died mid-way blocks retries no longer
+PENDING_TTL = 30
+
+
+class SendDedup:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    # --- backend primitives ---
+    # claim: None if this send goes ahead; otherwise the earlier send's ack, {} while it is in flight.
+    # release: drop a claim whose send failed, so the client can retry it.
+    async def claim(self, key: Key) -> dict | None: ...
+    async def done(self, key: Key, ack: dict) -> None: ...
+    async def release(self, key: Key) -> None: ...
+
+
+class MemorySendDedup(SendDedup):
+    """Single-process backend; with app.supervisor a room's senders all reach its owner."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        # key -> (deadline, ack or None while pending)
+        self._entries: "OrderedDict[Key, Tuple[float, dict | None]]" = OrderedDict()
+
+    async def claim(self, key):
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1] or {}
+        self._set(key, now + PENDING_TTL, None)
+        return None
+
+    async def done(self, key, ack):
+        self._set(key, time.monotonic() + self.ttl, ack)
+
+    async def release(self, key):
+        self._entries.pop(key, None)
+
+    def _set(self, key, deadline, ack):
+        self._entries[key] = (deadline, ack)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisSendDedup(SendDedup):
+    """SET NX claims an empty placeholder; done() overwrites it with the ack. Errors fall through to the database."""
+
+    def __init__(self, redis: aioredis.Redis, ttl: float):
+        super().__init__(ttl)
+        self._redis = redis
+
+    @staticmethod
+    def _key(key: Key) -> str:
+        room_id, user_id, client_msg_id = key
+        return f"sent:{room_id}:{user_id}:{client_msg_id}"
+
+    async def claim(self, key):
+        name = self._key(key)
+        try:
+            for _ in range(2):
+                if await self._redis.set(name, b"", nx=True, ex=PENDING_TTL):
+                    return None
+                raw = await self._redis.get(name)
+                if raw is not None:
+                    return serializer.loads(raw) if raw else {}
+                # بین SET و GET منقضی شد
+        except RedisError as e:
+            log.warning("send dedup unavailable, relying on sent_messages: %s", e)
+        return None
+
+    async def done(self, key, ack):
+        try:
+            await self._redis.set(self._key(key), serializer.dumps_bytes(ack), ex=max(int(self.ttl), 1))
+        except RedisError as e:
+            log.warning("could not cache send ack: %s", e)
+
+    async def release(self, key):
+        try:
+            await self._redis.delete(self._key(key))
+        except RedisError as e:
+            log.warning("could not release send claim: %s", e)
+
+
+def build_send_dedup() -> SendDedup:
+    if settings.SEND_DEDUP_BACKEND == "memory":
+        return MemorySendDedup(settings.SEND_DEDUP_TTL, settings.SEND_DEDUP_MAX)
+    return RedisSendDedup(aioredis.from_url(settings.REDIS_URL), settings.SEND_DEDUP_TTL)
+
+send_dedup = build_send_dedup()
@@ -1,131 +1,246 @@
-import json
+import asyncio
+
 import socketio
-from sqlalchemy.orm import aliased
-from typing import Dict, Set
-from datetime import date, datetime  
-from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, async_autocommit_engine
 from app.db.crud import (
-    get_or_create_user,
+    RoomNotFound,
+    get_user_id,
     get_or_create_room,
+    get_room_seq,
     get_history,
-    create_message,
+    get_changes,
+    search_messages,
+    insert_message_with_preview,
+    get_reply_ids,
+    get_reply_snapshot,
+    get_sent_message,
     update_message,
     delete_message_db,
 )
-from sqlalchemy import select
-from app.db.models import User
-from app.db.models import Message, User
-
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code."""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    raise TypeError(f"Type {type(obj)} not serializable")
-
-def to_json_safe(obj):
-    """Return a JSON-safe (dict/list/primitive) structure by converting unknowns via json_serial."""
-    return json.loads(json.dumps(obj, default=json_serial))
+from app.db.models import CLIENT_MSG_ID_CHARS
+from app.db.history_cache import history_cache, get_recent_history
+from app.db.replicas import replicas
+from app.db.write_behind import message_writer, WriteBehindBusy, WriteBehindDeferred, WriteBehindRejected
+from app.socket.affinity import affinity
+from app.socket.batching import batcher
+from app.socket.dedup import send_dedup
+from app.socket.presence import presence
+from app.socket.ratelimit import limiter
+from app.socket.unread import unread
 
+# Payloads may contain datetimes: the server's json module (app.core.serializer)
+# encodes them once per emit, so there is no dumps/loads pass here.
 
-active_users_by_room: Dict[int, Set[str]] = {}
+def _sent_ack(client_msg_id: str, earlier: dict) -> dict:
+    """Ack for a send whose client_msg_id was seen before; `earlier` is {} while that send is in flight."""
+    if not earlier:
+        return {"ok": False, "error": "send in progress", "client_msg_id": client_msg_id, "retry": True}
+    return {"ok": True, **earlier, "client_msg_id": client_msg_id, "duplicate": True}
 
 def register_socket_events(sio: socketio.AsyncServer):
+    # room broadcasts go through the batcher (app/socket/batching.py)
+    batcher.attach(sio)
+    # sid -> lock that keeps one socket's pipelined sends in order
+    send_locks: dict[str, asyncio.Lock] = {}
+
+    async def throttled(sid, event, room_id=None) -> bool:
+        # قبل از هر کار دیتابیسی؛ رد شدن ارزان است
+        if limiter.check(sid, event, room_id) is None:
+            return False
+        await sio.emit("error", {"message": "rate limit exceeded, slow down", "event": event}, to=sid)
+        return True
 
     @sio.event
-    async def connect(sid, environ):
+    async def connect(sid, environ, auth=None):
         await sio.emit("connected", {"sid": sid}, to=sid)
 
     @sio.event
     async def join(sid, data):
+        if await throttled(sid, "join"):
+            return
         username = str(data.get("username", "")).strip()
         room_id = int(data.get("room_id"))
         if not username:
             await sio.emit("error", {"message": "username required"}, to=sid)
             return
+        if not affinity.is_local(room_id):
+            # اتاق مال worker دیگری است؛ کلاینت باید به آن وصل شود
+            await sio.emit("room_moved", affinity.route(room_id), to=sid)
+            return
 
-        room_users = active_users_by_room.setdefault(room_id, set())
-        if username in room_users:
+        if not await presence.join(room_id, username, sid):
             await sio.emit("error", {"message": "این یوزرنیم در این گروه فعال است"}, to=sid)
             await sio.disconnect(sid)
             return
+        # قبل از دیتابیس، تا disconnect در هر حالتی presence را آزاد کند
+        await sio.save_session(sid, {"username": username, "room_id": room_id})
 
+        since_seq = data.get("since_seq")
+        changes = None
         async with AsyncSessionLocal() as session:
-            user = await get_or_create_user(session, username)
+            await get_user_id(session, username)
             await get_or_create_room(session, room_id)
-            await sio.save_session(sid, {"username": user.username, "room_id": room_id})
-            await sio.enter_room(sid, str(room_id))
-            messages, users = await get_history(session, room_id, limit=2000)
+        await sio.enter_room(sid, str(room_id))
+        await unread.joined(room_id, username)
+        # خواندن‌ها از replica (مگر این کاربر تازه نوشته باشد)؛ seq هم از همان‌جا
+        async with replicas.session(username) as session:
+            # seq قبل از تاریخچه خوانده می‌شود؛ در بدترین حالت یک تغییر دوباره فرستاده می‌شود
+            seq = await get_room_seq(session, room_id)
+            if since_seq is not None:
+                changes = await get_changes(session, room_id, int(since_seq), settings.HISTORY_MAX_PAGE_SIZE)
+            if changes is None:
+                messages, users, next_cursor = await get_recent_history(session, room_id, settings.HISTORY_PAGE_SIZE)
 
-        room_users.add(username)
+        online = await presence.members(room_id)
+        if changes is not None:
+            # reconnect: فقط تغییرات از since_seq به بعد
+            await sio.emit(
+                "history_delta",
+                {"room_id": room_id, "messages": changes, "online": online, "seq": seq},
+                to=sid,
+            )
+        else:
+            await sio.emit(
+                "history",
+                {
+                    "room_id": room_id,
+                    "messages": messages,
+                    "users": users,
+                    "online": online,
+                    "next_cursor": next_cursor,
+                    "seq": seq,
+                },
+                to=sid,
+            )
+
+        # ✅ پیام برای خودش
+        await sio.emit("system", {
+            "content": f"You joined room {room_id}.",
+            "room_id": room_id
+        }, to=sid)
+        # بقیه‌ی اعضا ورود را از presence_diff (دسته‌ای) می‌بینند
+
+
+    @sio.on("load_older")
+    async def handle_load_older(sid, data):
+        if await throttled(sid, "load_older"):
+            return
+        sess = await sio.get_session(sid)
+        room_id = sess.get("room_id") if sess else None
+        if room_id is None:
+            await sio.emit("error", {"message": "join a room first"}, to=sid)
+            return
+        before = data.get("before")
+        if not before:
+            await sio.emit("error", {"message": "before cursor required"}, to=sid)
+            return
+        limit = min(int(data.get("limit") or settings.HISTORY_PAGE_SIZE), settings.HISTORY_MAX_PAGE_SIZE)
+
+        async with replicas.session(sess.get("username")) as session:
+            try:
+                messages, _, next_cursor = await get_history(
+                    session, room_id, limit=max(limit, 1), before=before, archived=bool(data.get("archived"))
+                )
+            except ValueError:
+                await sio.emit("error", {"message": "invalid cursor"}, to=sid)
+                return
 
         await sio.emit(
-            "history",
-            to_json_safe({"room_id": room_id, "messages": messages, "users": users}),
+            "older_history",
+            {"room_id": room_id, "messages": messages, "next_cursor": next_cursor},
             to=sid,
         )
 
-        # ✅ پیام برای خودش
-        await sio.emit("system", to_json_safe({
-            "content": f"You joined room {room_id}.",
-            "room_id": room_id
-        }), to=sid)
 
-        # ✅ پیام برای بقیه
-        await sio.emit("system", to_json_safe({
-            "content": f"{username} joined room {room_id}.",
-            "room_id": room_id
-        }), room=str(room_id))
-        print(f"Sent System message: {username} joined room {room_id}")
+    @sio.on("search")
+    async def handle_search(sid, data):
+        if await throttled(sid, "search"):
+            return
+        sess = await sio.get_session(sid)
+        room_id = sess.get("room_id") if sess else None
+        if room_id is None:
+            await sio.emit("error", {"message": "join a room first"}, to=sid)
+            return
+        q = str(data.get("q", "")).strip()[:256]
+        if not q:
+            await sio.emit("error", {"message": "search query required"}, to=sid)
+            return
+        limit = min(int(data.get("limit") or settings.HISTORY_PAGE_SIZE), settings.HISTORY_MAX_PAGE_SIZE)
+
+        async with replicas.session(sess.get("username")) as session:
+            try:
+                messages, next_cursor = await search_messages(
+                    session, room_id, q, limit=max(limit, 1), before=data.get("before")
+                )
+            except ValueError:
+                await sio.emit("error", {"message": "invalid cursor"}, to=sid)
+                return
+
+        await sio.emit(
+            "search_results",
+            {"room_id": room_id, "q": q, "messages": messages, "next_cursor": next_cursor},
+            to=sid,
+        )
+
+
+    @sio.on("mark_read")
+    async def handle_mark_read(sid, data):
+        if await throttled(sid, "mark_read"):
+            return
+        sess = await sio.get_session(sid)
+        if not sess or "room_id" not in sess:
+            await sio.emit("error", {"message": "join a room first"}, to=sid)
+            return
+        # بقیه‌ی اعضا رسید را از read_receipts (دسته‌ای) می‌بینند
+        await unread.mark_read(sess["room_id"], sess["username"], int(data.get("message_id")))
 
 
     @sio.on("delete_message")
     async def handle_delete_message(sid, data, callback=None):
+        if await throttled(sid, "delete_message"):
+            return
         message_id = int(data.get("message_id"))
         username = str(data.get("username", "")).strip()
 
         async with AsyncSessionLocal() as session:
-            ok = await delete_message_db(session, message_id, username)
-            if not ok:
+            msg = await delete_message_db(session, message_id, username)
+            if not msg:
                 await sio.emit("error", {"message": "Delete not allowed or message not found"}, to=sid)
                 return
+            child_ids = await get_reply_ids(session, message_id)
+        replicas.note_write(username)
 
-        sess = await sio.get_session(sid)
-        room_id = sess.get("room_id") or data.get("room_id")
+        room_id = msg.room_id
+        if history_cache:
+            await history_cache.delete_message(room_id, message_id, msg.change_seq)
 
-        await sio.emit("message_deleted", {"id": message_id, "room_id": room_id}, room=str(room_id))
-        async with AsyncSessionLocal() as db2:
-            q = await db2.execute(
-                select(Message.id).where(Message.replied_to == message_id)
-            )
-            children = [r[0] for r in q.fetchall()]
-            for child_id in children:
-                await sio.emit(
-                    "parent_deleted",
-                    {"parent_id": message_id, "room_id": room_id},
-                    room=str(room_id),
-                )
-        await sio.emit(
-            "parent_deleted",
-            {"parent_id": message_id, "room_id": room_id},
-            room=str(room_id),
+        await batcher.emit(
+            "message_deleted", {"id": message_id, "room_id": room_id, "seq": msg.change_seq}, room_id
         )
-
+        # یک broadcast برای همه‌ی ریپلای‌ها، نه یکی به ازای هر فرزند
+        if child_ids:
+            await batcher.emit(
+                "parent_deleted",
+                {"parent_id": message_id, "room_id": room_id, "child_ids": child_ids},
+                room_id,
+            )
 
 
     @sio.event
-    async def disconnect(sid):
+    async def disconnect(sid, reason=None):
+        limiter.forget(sid)
+        send_locks.pop(sid, None)
         sess = await sio.get_session(sid)
         if sess and "room_id" in sess and "username" in sess:
             room_id = sess["room_id"]
             username = sess["username"]
-            users = active_users_by_room.get(room_id)
-            if users and username in users:
-                users.remove(username)
-            await sio.emit("system", {"content": f"{username} left room {room_id}."}, room=str(room_id))
-            print(f"Sent System message: {username} Left room {room_id}")
+            await presence.leave(room_id, username, sid)
 
     @sio.on("edit_message")
     async def handle_edit_message(sid, data, callback=None):
+        if await throttled(sid, "edit_message"):
+            return
         message_id = int(data.get("message_id"))
         username = str(data.get("username", "")).strip()
         new_content = (data.get("content") or "").strip()
@@ -139,24 +254,8 @@ def register_socket_events(sio: socketio.AsyncServer):
                 await sio.emit("error", {"message": "Edit not allowed or message not found"}, to=sid)
                 return
 
-            reply_user = None
-            reply_text = None
-            reply_deleted = False
-            if msg.replied_to:
-                Parent = aliased(Message)
-                ParentUser = aliased(User)
-                q = await db.execute(
-                    select(Parent.content, Parent.is_deleted, ParentUser.username)
-                    .join(ParentUser, ParentUser.id == Parent.user_id)
-                    .where(Parent.id == msg.replied_to)
-                )
-                row = q.first()
-                if row:
-                    p_content, p_deleted, p_user = row
-                    reply_deleted = bool(p_deleted)
-                    if not reply_deleted:
-                        reply_text = p_content
-                        reply_user = p_user
+            child_ids = await get_reply_ids(db, msg.id)
+        replicas.note_write(username)
 
         payload = {
             "id": msg.id,
@@ -166,67 +265,153 @@ def register_socket_events(sio: socketio.AsyncServer):
             "created_at": msg.created_at,
             "edited_at": msg.edited_at,
             "replied_to": msg.replied_to,
-            "reply_text": reply_text,
-            "reply_user": reply_user,
-            "reply_deleted": reply_deleted,
+            "reply_text": msg.reply_text,
+            "reply_user": msg.reply_user,
+            "reply_deleted": bool(msg.reply_deleted),
+            "seq": msg.change_seq,
         }
-        await sio.emit("message_edited", to_json_safe(payload), room=str(msg.room_id))
-        async with AsyncSessionLocal() as db2:
-            q = await db2.execute(
-                select(Message.id).where(Message.replied_to == msg.id)
+        if history_cache:
+            await history_cache.update_message(msg.room_id, msg.id, msg.content, msg.edited_at, msg.change_seq)
+        await batcher.emit("message_edited", payload, msg.room_id)
+        if child_ids:
+            await batcher.emit(
+                "parent_edited",
+                {
+                    "parent_id": msg.id,
+                    "new_text": msg.content,
+                    "parent_user": username,
+                    "room_id": msg.room_id,
+                    "child_ids": child_ids,
+                },
+                msg.room_id,
             )
-            children = [r[0] for r in q.fetchall()]
-            for child_id in children:
-                await sio.emit(
-                    "parent_edited",
-                    {
-                        "parent_id": msg.id,
-                        "new_text": msg.content,
-                        "parent_user": username,
-                        "room_id": msg.room_id,
-                    },
-                    room=str(msg.room_id),
-                )
-        await sio.emit(
-            "parent_edited",
-            {"parent_id": msg.id, "new_text": msg.content, "parent_user": username, "room_id": msg.room_id},
-            room=str(msg.room_id),
-        )
 
 
     @sio.on("message")
     async def handle_message(sid, data):
+        """
+        Ack (the handler's return value): {ok, id, created_at, seq, client_msg_id, duplicate},
+        or {ok: False, error, client_msg_id, retry}. Resending with the same client_msg_id
+        is safe: the original message is acked again and nothing is inserted or broadcast.
+        With write-behind a send handed to Celery acks {ok, queued, client_msg_id} and is
+        broadcast once the worker has saved it.
+        """
         username = data.get("username")
-        room_id = data.get("room_id")
+        room_id = int(data.get("room_id"))
         content = data.get("content")
         replied_to = data.get("replied_to")
+        client_msg_id = data.get("client_msg_id")
+        if client_msg_id is not None:
+            client_msg_id = str(client_msg_id)
+            if not client_msg_id or len(client_msg_id) > CLIENT_MSG_ID_CHARS:
+                return {"ok": False, "error": "invalid client_msg_id", "client_msg_id": client_msg_id, "retry": False}
+        if await throttled(sid, "message", room_id):
+            return {"ok": False, "error": "rate limit exceeded", "client_msg_id": client_msg_id, "retry": True}
+
+        # ارسال‌های پشت‌سرهم یک سوکت به همان ترتیب ثبت و پخش شوند؛
+        # قفل پیش از اولین await گرفته می‌شود تا ترتیب رسیدن حفظ شود
+        async with send_locks.setdefault(sid, asyncio.Lock()):
+            return await _send(sid, room_id, username, content, replied_to, client_msg_id)
 
+    async def _send(sid, room_id, username, content, replied_to, client_msg_id) -> dict:
+        sess = await sio.get_session(sid)
+        if not sess or sess.get("room_id") != room_id:
+            await sio.emit("error", {"message": "join the room first"}, to=sid)
+            return {"ok": False, "error": "join the room first", "client_msg_id": client_msg_id, "retry": False}
+        # کش username -> id؛ در حالت hit اصلاً کانکشنی گرفته نمی‌شود
         async with AsyncSessionLocal() as db:
-            user = await get_or_create_user(db, username)
-            msg = await create_message(db, room_id, user.id, content, replied_to)
-            reply_user = None
-            reply_text = None
+            user_id = await get_user_id(db, username)
+
+        key = (room_id, user_id, client_msg_id)
+        if client_msg_id is not None:
+            earlier = await send_dedup.claim(key)
+            if earlier is not None:
+                return _sent_ack(client_msg_id, earlier)
+        try:
+            return await _store_and_broadcast(sid, room_id, user_id, username, content, replied_to, client_msg_id)
+        except BaseException:
+            if client_msg_id is not None:
+                await send_dedup.release(key)
+            raise
+
+    async def _store_and_broadcast(sid, room_id, user_id, username, content, replied_to, client_msg_id) -> dict:
+        key = (room_id, user_id, client_msg_id)
+        try:
+            sent = await _insert_message(room_id, user_id, username, content, replied_to, client_msg_id)
+        except WriteBehindBusy:
+            # کلاینت می‌تواند با همان client_msg_id دوباره بفرستد
+            return await _send_failed(sid, key, "server busy, please retry", retry=True)
+        except (WriteBehindRejected, RoomNotFound):
+            return await _send_failed(sid, key, "message rejected", retry=False)
+        except WriteBehindDeferred:
+            # Celery ذخیره و بعد پخشش می‌کند؛ ارسال دوباره لازم نیست
+            if client_msg_id is not None:
+                await send_dedup.release(key)
+            return {"ok": True, "queued": True, "client_msg_id": client_msg_id, "duplicate": False}
+        if sent is None and client_msg_id is None:
+            return await _send_failed(sid, key, "message rejected", retry=False)
+        if sent is None:
+            # قبلاً ثبت شده (کش منقضی شده بود یا روی worker دیگری)
+            async with AsyncSessionLocal() as db:
+                earlier = await get_sent_message(db, room_id, user_id, client_msg_id)
+            if earlier is None or earlier["id"] is None:
+                await send_dedup.release(key)
+                return _sent_ack(client_msg_id, {})
+            await send_dedup.done(key, earlier)
+            return _sent_ack(client_msg_id, earlier)
+        msg_id, created_at, seq, reply_text, reply_user, reply_deleted = sent
+        replicas.note_write(username)
+
+        payload = {
+            "id": msg_id,
+            "username": username,
+            "room_id": room_id,
+            "content": content,
+            "created_at": created_at,
+            "edited_at": None,
+            "replied_to": replied_to,
+            "reply_user": reply_user,
+            "reply_text": reply_text,
+            "reply_deleted": reply_deleted,
+            "is_deleted": False,
+            "seq": seq,
+        }
+
+        if history_cache:
+            await history_cache.append(room_id, payload)
+        await unread.on_message(room_id, username, msg_id)
+        # client_msg_id فقط در broadcast؛ فرستنده نسخه‌ی محلی‌اش را با آن پیدا می‌کند
+        await batcher.emit("message", {**payload, "client_msg_id": client_msg_id} if client_msg_id else payload, room_id)
+        ack = {"id": msg_id, "created_at": created_at, "seq": seq}
+        if client_msg_id is not None:
+            await send_dedup.done(key, ack)
+        return {"ok": True, **ack, "client_msg_id": client_msg_id, "duplicate": False}
+
+    async def _send_failed(sid, key, error: str, retry: bool) -> dict:
+        client_msg_id = key[2]
+        if client_msg_id is not None:
+            await send_dedup.release(key)
+        await sio.emit("error", {"message": error}, to=sid)
+        return {"ok": False, "error": error, "client_msg_id": client_msg_id, "retry": retry}
+
+    async def _insert_message(room_id, user_id, username, content, replied_to, client_msg_id):
+        """(id, created_at, seq, reply_text, reply_user, reply_deleted), or None if client_msg_id was already sent."""
+        if message_writer:
+            reply = {"reply_text": None, "reply_user": None, "reply_deleted": False}
             if replied_to:
-                
-                q = await db.execute(
-                    select(Message.content, User.username)
-                    .join(User, User.id == Message.user_id)
-                    .where(Message.id == replied_to)
-                )
-                parent = q.first()
-                if parent:
-                    reply_text, reply_user = parent.content, parent.username
-                    
-            payload = {
-                "id": msg.id,
-                "username": username,
-                "room_id": room_id,
-                "content": content,
-                "created_at": msg.created_at,
-                "replied_to": replied_to,
-                "reply_user": reply_user,
-                "reply_text": reply_text,
-            }
-
-        await sio.emit("message", to_json_safe(payload), room=str(room_id))
+                async with AsyncSessionLocal() as db:
+                    reply = await get_reply_snapshot(db, replied_to)
+            written = await message_writer.submit(
+                room_id, user_id, username, content, replied_to, reply, client_msg_id
+            )
+            if written is None:
+                return None
+            return (*written, reply["reply_text"], reply["reply_user"], reply["reply_deleted"])
+        async with async_autocommit_engine.connect() as conn:
+            row = await insert_message_with_preview(conn, room_id, user_id, username, content, replied_to,
+                                                    client_msg_id)
+        if row is None:
+            return None
+        return (row["id"], row["created_at"], row["change_seq"],
+                row["reply_text"], row["reply_user"], bool(row["reply_deleted"]))
 
@@ -0,0 +1,40 @@
+"""
+Emits from processes without a Socket.IO server (Celery workers).
+
+Publishes on the Redis channel the API processes listen on: the shared one, or with
+app.supervisor the channel of the worker that owns the room (the same ring as
+app/socket/affinity.py, read from AFFINITY_KEY). With SOCKETIO_CLIENT_MANAGER=memory
+there is nobody to reach and the emit is dropped.
+"""
+from typing import Dict
+
+import redis
+import socketio
+
+from app.core import serializer
+from app.core.config import settings
+from app.socket.affinity import HashRing, channel
+
+_redis: redis.Redis | None = None
+# channel -> write-only manager
+_managers: Dict[str, socketio.RedisManager] = {}
+
+
+def _room_channel(room_id: int) -> str:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    slots = [int(s) for s in _redis.hkeys(settings.AFFINITY_KEY)]
+    return channel(HashRing(slots).owner(room_id)) if slots else "socketio"
+
+
+def emit_to_room(event: str, payload: dict, room_id: int) -> None:
+    if settings.SOCKETIO_CLIENT_MANAGER == "memory":
+        return
+    name = _room_channel(room_id)
+    mgr = _managers.get(name)
+    if mgr is None:
+        mgr = _managers[name] = socketio.RedisManager(
+            settings.REDIS_URL, channel=name, write_only=True, json=serializer
+        )
+    mgr.emit(event, payload, room=str(room_id))
@@ -0,0 +1,160 @@
+"""
+Metrics for Socket.IO handlers, exported on /api/metrics next to the DB ones.
+
+instrument(sio) wraps every registered handler and sio.emit: per-event latency,
+in-flight counts, errors, local fan-out per emit, and one structured log line
+(DB time vs emit time) for any handler slower than SLOW_HANDLER_MS.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+
+import socketio
+
+from app.core import serializer
+from app.core.config import settings
+from app.core.metrics import (
+    LOOP_LAG_SECONDS,
+    SOCKET_EMIT_FANOUT,
+    SOCKET_EVENT_ERRORS,
+    SOCKET_EVENT_SECONDS,
+    SOCKET_EVENTS_IN_FLIGHT,
+)
+from app.db.instrument import query_timer
+
+log = logging.getLogger(__name__)
+
+
+class _HandlerStats:
+    __slots__ = ("db", "emit", "emits", "recipients")
+
+    def __init__(self):
+        self.db = 0.0
+        self.emit = 0.0
+        self.emits = 0
+        self.recipients = 0
+
+
+_current: contextvars.ContextVar[_HandlerStats | None] = contextvars.ContextVar("handler_stats", default=None)
+
+
+def _local_recipients(sio: socketio.AsyncServer, target, namespace: str) -> int:
+    rooms = sio.manager.rooms.get(namespace, {})
+    targets = target if isinstance(target, (list, tuple, set)) else [target]
+    # target None = broadcast: every sid sits in the None room
+    return sum(len(rooms.get(t, ())) for t in targets)
+
+
+def _room_of(sio: socketio.AsyncServer, args: tuple):
+    data = args[1] if len(args) > 1 else None
+    if isinstance(data, dict) and data.get("room_id") is not None:
+        return data["room_id"]
+    sid = args[0] if args else None
+    try:
+        rooms = [r for r in sio.rooms(sid) if r != sid]
+    except Exception:
+        return None
+    return rooms[0] if rooms else None
+
+
+def _wrap_handler(sio: socketio.AsyncServer, event: str, handler):
+    seconds = SOCKET_EVENT_SECONDS.labels(event)
+    errors = SOCKET_EVENT_ERRORS.labels(event)
+    in_flight = SOCKET_EVENTS_IN_FLIGHT.labels(event)
+    slow = settings.SLOW_HANDLER_MS / 1000
+
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        stats = _HandlerStats()
+        token = _current.set(stats)
+        timer_token = query_timer.set(stats)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            return await handler(*args)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            seconds.observe(elapsed)
+            query_timer.reset(timer_token)
+            _current.reset(token)
+            if elapsed >= slow:
+                log.warning("slow socket handler %s", serializer.dumps({
+                    "event": event,
+                    "sid": args[0] if args else None,
+                    "room_id": _room_of(sio, args),
+                    "total_ms": round(elapsed * 1000, 1),
+                    "db_ms": round(stats.db * 1000, 1),
+                    "emit_ms": round(stats.emit * 1000, 1),
+                    "emits": stats.emits,
+                    "recipients": stats.recipients,
+                }))
+
+    return wrapper
+
+
+def instrument(sio: socketio.AsyncServer) -> None:
+    """Call once, after every handler has been registered."""
+    for namespace, handlers in sio.handlers.items():
+        for event, handler in list(handlers.items()):
+            if asyncio.iscoroutinefunction(handler):
+                handlers[event] = _wrap_handler(sio, event, handler)
+
+    emit = sio.emit
+
+    async def timed_emit(event, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await emit(event, *args, **kwargs)
+        finally:
+            target = kwargs.get("to", kwargs.get("room"))
+            recipients = _local_recipients(sio, target, kwargs.get("namespace") or "/")
+            SOCKET_EMIT_FANOUT.labels(event).observe(recipients)
+            stats = _current.get()
+            if stats is not None:
+                stats.emit += time.perf_counter() - start
+                stats.emits += 1
+                stats.recipients += recipients
+
+    sio.emit = timed_emit
+
+
+class LoopLagMonitor:
+    """Sleeps `interval` seconds in a loop and records how late it woke up."""
+
+    def __init__(self, interval: float, warn_ms: int):
+        self.interval = interval
+        self.warn = warn_ms / 1000
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.warn:
+                log.warning("event loop lag %.1f ms", lag * 1000)
+
+
+loop_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL, settings.LOOP_LAG_WARN_MS)
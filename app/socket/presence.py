@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Set, Tuple
+
+import socketio
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+
+class Presence:
+    """
+    Who is online in which room, shared by every API process.
+
+    Each sid holds a heartbeat deadline; a sid whose deadline passed (its process
+    crashed or hung) is treated as gone and swept. Join/leave changes are coalesced
+    per room and broadcast as one `presence_diff` event every `diff_window` seconds.
+    """
+
+    def __init__(self, ttl: float, heartbeat: float, diff_window: float):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat
+        self.diff_window = diff_window
+        # sids connected to this process: sid -> (room_id, username)
+        self._local: Dict[str, Tuple[int, str]] = {}
+        self._pending: Dict[int, Tuple[Set[str], Set[str]]] = {}
+        self._sio: socketio.AsyncServer | None = None
+        self._task: asyncio.Task | None = None
+
+    # --- backend primitives ---
+    async def _join(self, room_id: int, username: str, sid: str) -> bool: ...
+    async def _leave(self, room_id: int, username: str, sid: str) -> bool: ...
+    async def members(self, room_id: int) -> list[str]: ...
+    async def _refresh(self, sids: Dict[str, Tuple[int, str]]) -> None: ...
+    async def _sweep(self) -> Dict[int, list[str]]: ...
+
+    # --- public API ---
+    async def join(self, room_id: int, username: str, sid: str) -> bool:
+        """False if `username` is already online in the room from another live sid."""
+        if not await self._join(room_id, username, sid):
+            return False
+        self._local[sid] = (room_id, username)
+        self._note(room_id, joined=username)
+        return True
+
+    async def leave(self, room_id: int, username: str, sid: str) -> None:
+        self._local.pop(sid, None)
+        if await self._leave(room_id, username, sid):
+            self._note(room_id, left=username)
+
+    def start(self, sio: socketio.AsyncServer) -> None:
+        self._sio = sio
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # sidهای این پروسه را همین حالا آزاد کن، نه بعد از TTL
+        for sid, (room_id, username) in list(self._local.items()):
+            await self.leave(room_id, username, sid)
+        for room_id in list(self._pending):
+            await self._flush(room_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._refresh(dict(self._local))
+                for room_id, gone in (await self._sweep()).items():
+                    for username in gone:
+                        self._note(room_id, left=username)
+            except Exception:
+                log.exception("presence heartbeat failed")
+
+    # --- presence_diff batching ---
+    def _note(self, room_id: int, joined: str | None = None, left: str | None = None) -> None:
+        if room_id not in self._pending:
+            self._pending[room_id] = (set(), set())
+            if self._sio is not None:
+                asyncio.get_running_loop().call_later(
+                    self.diff_window, lambda: asyncio.ensure_future(self._flush(room_id))
+                )
+        joins, leaves = self._pending[room_id]
+        # ورود و خروج در یک پنجره همدیگر را خنثی می‌کنند
+        if joined:
+            if joined in leaves:
+                leaves.discard(joined)
+            else:
+                joins.add(joined)
+        if left:
+            if left in joins:
+                joins.discard(left)
+            else:
+                leaves.add(left)
+
+    async def _flush(self, room_id: int) -> None:
+        joins, leaves = self._pending.pop(room_id, (set(), set()))
+        if self._sio is None or not (joins or leaves):
+            return
+        await self._sio.emit(
+            "presence_diff",
+            {"room_id": room_id, "joined": sorted(joins), "left": sorted(leaves)},
+            room=str(room_id),
+        )
+
+
+class MemoryPresence(Presence):
+    """Single-process backend for tests and local runs."""
+
+    def __init__(self, ttl: float, heartbeat: float, diff_window: float):
+        super().__init__(ttl, heartbeat, diff_window)
+        # room -> username -> sid, and sid -> deadline
+        self._users: Dict[int, Dict[str, str]] = {}
+        self._deadlines: Dict[str, float] = {}
+
+    async def _join(self, room_id, username, sid):
+        users = self._users.setdefault(room_id, {})
+        current = users.get(username)
+        if current and current != sid:
+            if self._deadlines.get(current, 0) > time.time():
+                return False
+            self._deadlines.pop(current, None)
+        users[username] = sid
+        self._deadlines[sid] = time.time() + self.ttl
+        return True
+
+    async def _leave(self, room_id, username, sid):
+        users = self._users.get(room_id, {})
+        if users.get(username) != sid:
+            return False
+        del users[username]
+        self._deadlines.pop(sid, None)
+        if not users:
+            self._users.pop(room_id, None)
+        return True
+
+    async def members(self, room_id):
+        for username in (await self._sweep()).get(room_id, []):
+            self._note(room_id, left=username)
+        return sorted(self._users.get(room_id, {}))
+
+    async def _refresh(self, sids):
+        deadline = time.time() + self.ttl
+        for sid in sids:
+            if sid in self._deadlines:
+                self._deadlines[sid] = deadline
+
+    async def _sweep(self):
+        now = time.time()
+        gone: Dict[int, list[str]] = {}
+        for room_id, users in list(self._users.items()):
+            for username, sid in list(users.items()):
+                if self._deadlines.get(sid, 0) <= now:
+                    del users[username]
+                    self._deadlines.pop(sid, None)
+                    gone.setdefault(room_id, []).append(username)
+            if not users:
+                del self._users[room_id]
+        return gone
+
+
+# KEYS: users hash (username -> sid), sids hash (sid -> username), heartbeat zset (sid -> deadline)
+_JOIN = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current and current ~= ARGV[2] then
+  local deadline = redis.call('ZSCORE', KEYS[3], current)
+  if deadline and tonumber(deadline) > tonumber(ARGV[3]) then
+    return 0
+  end
+  redis.call('HDEL', KEYS[2], current)
+  redis.call('ZREM', KEYS[3], current)
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[2])
+return 1
+"""
+
+_LEAVE = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+  return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[2])
+redis.call('ZREM', KEYS[3], ARGV[2])
+return 1
+"""
+
+# returns {remaining member count, expired usernames...}
+_SWEEP = """
+local gone = {}
+for _, sid in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])) do
+  local username = redis.call('HGET', KEYS[2], sid)
+  redis.call('HDEL', KEYS[2], sid)
+  redis.call('ZREM', KEYS[3], sid)
+  if username and redis.call('HGET', KEYS[1], username) == sid then
+    redis.call('HDEL', KEYS[1], username)
+    table.insert(gone, username)
+  end
+end
+table.insert(gone, 1, redis.call('HLEN', KEYS[1]))
+return gone
+"""
+
+
+class RedisPresence(Presence):
+    """
+    Redis backend. Per-room keys share a `{room_id}` hash tag so each script touches
+    a single cluster slot; `presence:rooms` lists rooms that may need sweeping.
+    """
+
+    ROOMS_KEY = "presence:rooms"
+    SWEEP_LOCK = "presence:sweep-lock"
+
+    def __init__(self, redis: aioredis.Redis, ttl: float, heartbeat: float, diff_window: float):
+        super().__init__(ttl, heartbeat, diff_window)
+        self._redis = redis
+        self._join_script = redis.register_script(_JOIN)
+        self._leave_script = redis.register_script(_LEAVE)
+        self._sweep_script = redis.register_script(_SWEEP)
+
+    @staticmethod
+    def _keys(room_id: int) -> list[str]:
+        return [f"presence:{{{room_id}}}:users", f"presence:{{{room_id}}}:sids", f"presence:{{{room_id}}}:hb"]
+
+    async def _join(self, room_id, username, sid):
+        now = time.time()
+        ok = await self._join_script(keys=self._keys(room_id), args=[username, sid, now, now + self.ttl])
+        if ok:
+            await self._redis.sadd(self.ROOMS_KEY, room_id)
+        return bool(ok)
+
+    async def _leave(self, room_id, username, sid):
+        try:
+            return bool(await self._leave_script(keys=self._keys(room_id), args=[username, sid]))
+        except RedisError as e:
+            # heartbeat دیگر تمدید نمی‌شود و sweep بعدی پاکش می‌کند
+            log.warning("presence leave failed for %s in room %s: %s", username, room_id, e)
+            return False
+
+    async def members(self, room_id):
+        for username in await self._sweep_room(room_id):
+            self._note(room_id, left=username)
+        users = await self._redis.hkeys(self._keys(room_id)[0])
+        return sorted(u.decode() if isinstance(u, bytes) else u for u in users)
+
+    async def _refresh(self, sids):
+        if not sids:
+            return
+        deadline = time.time() + self.ttl
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for sid, (room_id, _) in sids.items():
+                pipe.zadd(self._keys(room_id)[2], {sid: deadline}, xx=True)
+            await pipe.execute()
+
+    async def _sweep_room(self, room_id: int) -> list[str]:
+        remaining, *gone = await self._sweep_script(keys=self._keys(room_id), args=[time.time()])
+        if not remaining:
+            await self._redis.srem(self.ROOMS_KEY, room_id)
+        return [u.decode() if isinstance(u, bytes) else u for u in gone]
+
+    async def _sweep(self):
+        # فقط یک پروسه در هر دوره sweep سراسری می‌کند
+        if not await self._redis.set(self.SWEEP_LOCK, 1, nx=True, px=int(self.heartbeat_interval * 1000)):
+            return {}
+        gone: Dict[int, list[str]] = {}
+        for member in await self._redis.smembers(self.ROOMS_KEY):
+            room_id = int(member)
+            expired = await self._sweep_room(room_id)
+            if expired:
+                gone[room_id] = expired
+        return gone
+
+
+def build_presence() -> Presence:
+    args = (settings.PRESENCE_TTL, settings.PRESENCE_HEARTBEAT, settings.PRESENCE_DIFF_WINDOW_MS / 1000)
+    if settings.PRESENCE_BACKEND == "memory":
+        return MemoryPresence(*args)
+    return RedisPresence(aioredis.from_url(settings.REDIS_URL), *args)
+
+presence = build_presence()
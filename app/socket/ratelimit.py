@@ -0,0 +1,99 @@
+import time
+from typing import Dict, Tuple
+
+from app.core.config import settings
+from app.core.metrics import RATE_LIMITED
+
+# event -> limit class
+EVENT_LIMITS = {
+    "message": "message",
+    "edit_message": "edit",
+    "delete_message": "edit",
+    "join": "read",
+    "load_older": "read",
+    "search": "read",
+    "mark_read": "read",
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def idle(self, now: float) -> bool:
+        """Refilled to the brim: dropping it loses nothing."""
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """
+    Per-sid token buckets for each limit class, plus one bucket per room for `message`.
+    In-process only: with several API processes the room limit applies per process.
+    """
+
+    MAX_ROOM_BUCKETS = 10000
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], room_limit: Tuple[float, int]):
+        self.limits = limits
+        self.room_limit = room_limit
+        self._sids: Dict[str, Dict[str, TokenBucket]] = {}
+        self._rooms: Dict[int, TokenBucket] = {}
+
+    def check(self, sid: str, event: str, room_id: int | None = None) -> str | None:
+        """None if the event may proceed, otherwise the scope that rejected it ("sid" or "room")."""
+        kind = EVENT_LIMITS.get(event)
+        if kind is None:
+            return None
+        now = time.monotonic()
+
+        rate, burst = self.limits[kind]
+        if rate > 0:
+            buckets = self._sids.setdefault(sid, {})
+            bucket = buckets.get(kind)
+            if bucket is None:
+                bucket = buckets[kind] = TokenBucket(rate, burst, now)
+            if not bucket.take(now):
+                RATE_LIMITED.labels(event, "sid").inc()
+                return "sid"
+
+        rate, burst = self.room_limit
+        if kind == "message" and room_id is not None and rate > 0:
+            bucket = self._rooms.get(room_id)
+            if bucket is None:
+                if len(self._rooms) >= self.MAX_ROOM_BUCKETS:
+                    self._prune_rooms(now)
+                bucket = self._rooms[room_id] = TokenBucket(rate, burst, now)
+            if not bucket.take(now):
+                RATE_LIMITED.labels(event, "room").inc()
+                return "room"
+        return None
+
+    def forget(self, sid: str) -> None:
+        self._sids.pop(sid, None)
+
+    def _prune_rooms(self, now: float) -> None:
+        for room_id in [r for r, b in self._rooms.items() if b.idle(now)]:
+            del self._rooms[room_id]
+
+
+limiter = RateLimiter(
+    {
+        "message": (settings.RATE_LIMIT_MESSAGE, settings.RATE_LIMIT_MESSAGE_BURST),
+        "edit": (settings.RATE_LIMIT_EDIT, settings.RATE_LIMIT_EDIT_BURST),
+        "read": (settings.RATE_LIMIT_READ, settings.RATE_LIMIT_READ_BURST),
+    },
+    (settings.RATE_LIMIT_ROOM, settings.RATE_LIMIT_ROOM_BURST),
+)
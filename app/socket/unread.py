@@ -0,0 +1,360 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Tuple
+
+import socketio
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.db.crud import get_message_counts, get_read_state, get_user_id, save_read_state
+from app.db.session import AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+# (read_pos, last_read_id)
+Pointer = Tuple[int, int]
+
+
+class Unread:
+    """
+    Unread counts without COUNT(*): every room has a head counter (messages ever posted)
+    and every user a read pointer per room holding the head as of their last mark_read.
+    unread = head - read_pos, so a message costs one increment and a badge one subtraction.
+
+    mark_read marks the room read up to now; message_id is what the read receipt carries
+    and keeps the pointer from moving backwards. Deleted messages still count.
+    Dirty heads and pointers are flushed to rooms.message_count / read_state every
+    `flush_interval` seconds and loaded back when the backend has lost them.
+    Receipts are coalesced per room into one `read_receipts` event every `receipt_window`.
+    """
+
+    def __init__(self, flush_interval: float, receipt_window: float):
+        self.flush_interval = flush_interval
+        self.receipt_window = receipt_window
+        # room -> username -> newest message_id read
+        self._pending: Dict[int, Dict[str, int]] = {}
+        self._sio: socketio.AsyncServer | None = None
+        self._task: asyncio.Task | None = None
+
+    # --- backend primitives ---
+    async def _incr_head(self, room_id: int) -> int | None:
+        """Bump the room's head; None (and nothing bumped) when the backend has no head for it yet."""
+    async def _heads(self, room_ids: list[int]) -> list[int | None]: ...
+    async def _seed_heads(self, counts: Dict[int, int]) -> None: ...
+    async def _pointer(self, username: str, room_id: int) -> Pointer | None: ...
+    async def _pointers(self, username: str) -> Dict[int, Pointer] | None:
+        """None until the user's durable pointers have been loaded (_seed_pointers)."""
+    async def _seed_pointers(self, username: str, pointers: Dict[int, Pointer]) -> None: ...
+    async def _advance(self, username: str, room_id: int, pointer: Pointer) -> bool: ...
+    async def _mark_dirty(self, rooms: Iterable[int] = (), reads: Iterable[Tuple[int, str]] = ()) -> None: ...
+    async def _pop_dirty(self, n: int) -> Tuple[list[int], list[Tuple[int, str]]]: ...
+
+    # --- public API ---
+    async def on_message(self, room_id: int, username: str, message_id: int) -> None:
+        """O(1) per message: bump the room head and move the sender's own pointer past it."""
+        pos = await self._incr_head(room_id)
+        if pos is None:
+            # تازه یا بعد از از دست رفتن بک‌اند: اول از نسخه‌ی پایدار بکار (setnx؛ هم‌زمان‌ها یکی می‌شوند)
+            await self._load_heads([room_id])
+            pos = await self._incr_head(room_id)
+        await self._advance(username, room_id, (pos, message_id))
+        await self._mark_dirty(rooms=[room_id], reads=[(room_id, username)])
+
+    async def joined(self, room_id: int, username: str) -> None:
+        """Start a pointer at the current head, so joining a room does not make its history unread."""
+        pointers = await self._load(username)
+        if room_id in pointers:
+            return
+        head = (await self._load_heads([room_id]))[room_id]
+        await self._seed_pointers(username, {room_id: (head, 0)})
+        await self._mark_dirty(reads=[(room_id, username)])
+
+    async def mark_read(self, room_id: int, username: str, message_id: int) -> bool:
+        """False if the user had already read past message_id."""
+        await self._load(username)
+        head = (await self._load_heads([room_id]))[room_id]
+        if not await self._advance(username, room_id, (head, message_id)):
+            return False
+        await self._mark_dirty(reads=[(room_id, username)])
+        self._note(room_id, username, message_id)
+        return True
+
+    async def counts(self, username: str) -> Dict[int, int]:
+        pointers = await self._load(username)
+        heads = await self._load_heads(list(pointers))
+        return {room_id: max(heads[room_id] - pos, 0) for room_id, (pos, _) in pointers.items()}
+
+    def start(self, sio: socketio.AsyncServer) -> None:
+        self._sio = sio
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for room_id in list(self._pending):
+            await self._flush_receipts(room_id)
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("final unread flush failed")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("unread flush failed")
+
+    # --- durable flush / reload ---
+    async def flush(self, batch: int = 1000) -> None:
+        while True:
+            rooms, reads = await self._pop_dirty(batch)
+            if not rooms and not reads:
+                return
+            try:
+                await self._save(rooms, reads)
+            except Exception:
+                # دوباره کثیف علامت بزن تا دور بعد تکرار شود
+                await self._mark_dirty(rooms, reads)
+                raise
+            if len(rooms) < batch and len(reads) < batch:
+                return
+
+    async def _save(self, rooms: list[int], reads: list[Tuple[int, str]]) -> None:
+        heads = dict(zip(rooms, await self._heads(rooms)))
+        rows = []
+        async with AsyncSessionLocal() as session:
+            for room_id, username in reads:
+                pointer = await self._pointer(username, room_id)
+                if pointer is None:
+                    continue
+                rows.append({
+                    "user_id": await get_user_id(session, username),
+                    "room_id": room_id,
+                    "read_pos": pointer[0],
+                    "last_read_id": pointer[1],
+                })
+            await save_read_state(session, {r: h for r, h in heads.items() if h is not None}, rows)
+
+    async def _load(self, username: str) -> Dict[int, Pointer]:
+        pointers = await self._pointers(username)
+        if pointers is not None:
+            return pointers
+        async with AsyncSessionLocal() as session:
+            rows = await get_read_state(session, username)
+        # also seeds an empty set, so a user without rows is not looked up again
+        await self._seed_pointers(username, {room_id: (pos, last_id) for room_id, pos, last_id in rows})
+        return await self._pointers(username) or {}
+
+    async def _load_heads(self, room_ids: list[int]) -> Dict[int, int]:
+        heads = dict(zip(room_ids, await self._heads(room_ids)))
+        missing = [r for r, h in heads.items() if h is None]
+        if missing:
+            async with AsyncSessionLocal() as session:
+                durable = await get_message_counts(session, missing)
+            await self._seed_heads({r: durable.get(r, 0) for r in missing})
+            heads.update(zip(missing, await self._heads(missing)))
+        return {r: h or 0 for r, h in heads.items()}
+
+    # --- read_receipts batching ---
+    def _note(self, room_id: int, username: str, message_id: int) -> None:
+        if room_id not in self._pending:
+            self._pending[room_id] = {}
+            if self._sio is not None:
+                asyncio.get_running_loop().call_later(
+                    self.receipt_window, lambda: asyncio.ensure_future(self._flush_receipts(room_id))
+                )
+        reads = self._pending[room_id]
+        reads[username] = max(message_id, reads.get(username, 0))
+
+    async def _flush_receipts(self, room_id: int) -> None:
+        reads = self._pending.pop(room_id, None)
+        if self._sio is None or not reads:
+            return
+        await self._sio.emit("read_receipts", {"room_id": room_id, "reads": reads}, room=str(room_id))
+
+
+class MemoryUnread(Unread):
+    """Single-process backend for tests and local runs."""
+
+    def __init__(self, flush_interval: float, receipt_window: float):
+        super().__init__(flush_interval, receipt_window)
+        self._head: Dict[int, int] = {}
+        self._reads: Dict[str, Dict[int, Pointer]] = {}
+        self._loaded: set[str] = set()
+        self._dirty_rooms: set[int] = set()
+        self._dirty_reads: set[Tuple[int, str]] = set()
+
+    async def _incr_head(self, room_id):
+        if room_id not in self._head:
+            return None
+        self._head[room_id] += 1
+        return self._head[room_id]
+
+    async def _heads(self, room_ids):
+        return [self._head.get(r) for r in room_ids]
+
+    async def _seed_heads(self, counts):
+        for room_id, count in counts.items():
+            self._head.setdefault(room_id, count)
+
+    async def _pointer(self, username, room_id):
+        return self._reads.get(username, {}).get(room_id)
+
+    async def _pointers(self, username):
+        return dict(self._reads.get(username, {})) if username in self._loaded else None
+
+    async def _seed_pointers(self, username, pointers):
+        self._loaded.add(username)
+        reads = self._reads.setdefault(username, {})
+        for room_id, pointer in pointers.items():
+            reads.setdefault(room_id, pointer)
+
+    async def _advance(self, username, room_id, pointer):
+        reads = self._reads.setdefault(username, {})
+        current = reads.get(room_id)
+        if current is not None and current[1] >= pointer[1]:
+            return False
+        reads[room_id] = pointer
+        return True
+
+    async def _mark_dirty(self, rooms=(), reads=()):
+        self._dirty_rooms.update(rooms)
+        self._dirty_reads.update(reads)
+
+    async def _pop_dirty(self, n):
+        rooms = [self._dirty_rooms.pop() for _ in range(min(n, len(self._dirty_rooms)))]
+        reads = [self._dirty_reads.pop() for _ in range(min(n, len(self._dirty_reads)))]
+        return rooms, reads
+
+
+# KEYS: the heads hash; ARGV: room_id. Nil when the room has no head yet, so the caller seeds it first.
+_INCR_HEAD = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+  return false
+end
+return redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+"""
+
+# KEYS: the user's pointer hash (room_id -> "read_pos:last_read_id", plus LOADED once seeded)
+# ARGV: room_id, read_pos, last_read_id, ttl seconds
+_ADVANCE = """
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current and tonumber(string.match(current, ':(%d+)$')) >= tonumber(ARGV[3]) then
+  return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':' .. ARGV[3])
+return 1
+"""
+
+
+class RedisUnread(Unread):
+    """
+    Redis backend: one hash of head counters, one pointer hash per user and two dirty
+    sets drained with SPOP, so concurrent flushers never write the same entry twice.
+    Every command touches a single key, which keeps it usable on Redis Cluster.
+    Pointer hashes of users inactive for `pointer_ttl` seconds expire and are reloaded
+    from read_state on next use.
+    """
+
+    HEADS_KEY = "unread:heads"
+    DIRTY_ROOMS = "unread:dirty:rooms"
+    DIRTY_READS = "unread:dirty:reads"
+    LOADED = "loaded"
+
+    def __init__(self, redis: aioredis.Redis, flush_interval: float, receipt_window: float, pointer_ttl: int):
+        super().__init__(flush_interval, receipt_window)
+        self._redis = redis
+        self.pointer_ttl = pointer_ttl
+        self._incr_script = redis.register_script(_INCR_HEAD)
+        self._advance_script = redis.register_script(_ADVANCE)
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return f"unread:reads:{username}"
+
+    async def _incr_head(self, room_id):
+        pos = await self._incr_script(keys=[self.HEADS_KEY], args=[room_id])
+        return None if pos is None else int(pos)
+
+    async def _heads(self, room_ids):
+        if not room_ids:
+            return []
+        return [None if h is None else int(h) for h in await self._redis.hmget(self.HEADS_KEY, room_ids)]
+
+    async def _seed_heads(self, counts):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for room_id, count in counts.items():
+                pipe.hsetnx(self.HEADS_KEY, room_id, count)
+            await pipe.execute()
+
+    @staticmethod
+    def _parse(value: bytes) -> Pointer:
+        pos, last_id = value.split(b":")
+        return int(pos), int(last_id)
+
+    async def _pointer(self, username, room_id):
+        value = await self._redis.hget(self._key(username), room_id)
+        return None if value is None else self._parse(value)
+
+    async def _pointers(self, username):
+        raw = await self._redis.hgetall(self._key(username))
+        if self.LOADED.encode() not in raw:
+            return None
+        return {int(r): self._parse(v) for r, v in raw.items() if r != self.LOADED.encode()}
+
+    async def _seed_pointers(self, username, pointers):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for room_id, (pos, last_id) in pointers.items():
+                pipe.hsetnx(self._key(username), room_id, f"{pos}:{last_id}")
+            pipe.hset(self._key(username), self.LOADED, 1)
+            pipe.expire(self._key(username), self.pointer_ttl)
+            await pipe.execute()
+
+    async def _advance(self, username, room_id, pointer):
+        return bool(await self._advance_script(
+            keys=[self._key(username)], args=[room_id, *pointer, self.pointer_ttl]
+        ))
+
+    async def _mark_dirty(self, rooms=(), reads=()):
+        rooms, reads = list(rooms), [f"{room_id}:{username}" for room_id, username in reads]
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                if rooms:
+                    pipe.sadd(self.DIRTY_ROOMS, *rooms)
+                if reads:
+                    pipe.sadd(self.DIRTY_READS, *reads)
+                await pipe.execute()
+        except RedisError as e:
+            # شمارنده‌ها درست‌اند؛ فقط flush بعدی این مورد را نمی‌بیند
+            log.warning("unread dirty mark failed: %s", e)
+
+    async def _pop_dirty(self, n):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.spop(self.DIRTY_ROOMS, n)
+            pipe.spop(self.DIRTY_READS, n)
+            rooms, reads = await pipe.execute()
+        parsed = []
+        for member in reads or []:
+            room_id, username = member.decode().split(":", 1)
+            parsed.append((int(room_id), username))
+        return [int(r) for r in rooms or []], parsed
+
+
+def build_unread() -> Unread:
+    args = (settings.UNREAD_FLUSH_INTERVAL, settings.READ_RECEIPT_WINDOW_MS / 1000)
+    if settings.UNREAD_BACKEND == "memory":
+        return MemoryUnread(*args)
+    return RedisUnread(aioredis.from_url(settings.REDIS_URL), *args, settings.UNREAD_POINTER_TTL)
+
+unread = build_unread()
@@ -0,0 +1,138 @@
+"""
+Room-affine multi-process server: N uvicorn workers, each owning a share of the rooms.
+
+    python -m app.supervisor --workers 4 [--host 0.0.0.0] [--base-port 8001]
+                             [--public-url http://chat.example.com:{port}] [-- uvicorn args...]
+
+Worker i listens on base-port + i with WORKER_SLOT=i. Once it accepts connections its
+public url is added to the AFFINITY_KEY hash in Redis; when it exits it is removed at
+once (its rooms rehash onto the survivors) and restarted with backoff, then added back.
+Workers map rooms to slots themselves (app/socket/affinity.py). Put a load balancer in
+front of all workers for REST; sockets connect to the url from GET /api/rooms/{id}/worker.
+
+Presence defaults to the in-process backend here, since a room's members all live on
+its owner. Needs Redis (REDIS_URL) for the ring and for emits between workers.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import redis
+
+from app.core.config import settings
+
+log = logging.getLogger("app.supervisor")
+
+MAX_BACKOFF = 30
+# a worker that ran at least this long before dying restarts without delay
+STABLE_AFTER = 10
+
+
+class Worker:
+    def __init__(self, slot: int, port: int, url: str):
+        self.slot = slot
+        self.port = port
+        self.url = url
+        self.proc: subprocess.Popen | None = None
+        self.started = 0.0
+        self.ready = False
+        self.backoff = 0.0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    def __init__(self, workers: int, host: str, base_port: int, public_url: str, uvicorn_args: list[str]):
+        self.host = host
+        self.uvicorn_args = uvicorn_args
+        self.workers = [
+            Worker(i, base_port + i, public_url.format(port=base_port + i)) for i in range(workers)
+        ]
+        self.redis = redis.Redis.from_url(settings.REDIS_URL)
+        self.stopping = False
+
+    def _spawn(self, w: Worker) -> None:
+        env = dict(os.environ, WORKER_SLOT=str(w.slot))
+        env.setdefault("PRESENCE_BACKEND", "memory")
+        w.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", self.host, "--port", str(w.port),
+             *self.uvicorn_args],
+            env=env,
+        )
+        w.started = time.monotonic()
+        w.ready = False
+        log.info("worker %d started (pid %d, port %d)", w.slot, w.proc.pid, w.port)
+
+    def _listening(self, w: Worker) -> bool:
+        host = "127.0.0.1" if self.host in ("0.0.0.0", "") else self.host
+        try:
+            with socket.create_connection((host, w.port), timeout=0.2):
+                return True
+        except OSError:
+            return False
+
+    def tick(self) -> None:
+        now = time.monotonic()
+        for w in self.workers:
+            if w.proc is None:
+                if now >= w.restart_at:
+                    self._spawn(w)
+            elif w.proc.poll() is not None:
+                # اول از حلقه خارج شود تا اتاق‌هایش فوراً جابه‌جا شوند
+                self.redis.hdel(settings.AFFINITY_KEY, w.slot)
+                ran = now - w.started
+                w.backoff = 0.0 if ran >= STABLE_AFTER else min(max(w.backoff * 2, 1.0), MAX_BACKOFF)
+                w.restart_at = now + w.backoff
+                log.warning("worker %d exited with %s after %.1fs; restarting in %.0fs",
+                            w.slot, w.proc.returncode, ran, w.backoff)
+                w.proc, w.ready = None, False
+            elif not w.ready and self._listening(w):
+                self.redis.hset(settings.AFFINITY_KEY, w.slot, w.url)
+                w.ready = True
+                log.info("worker %d ready at %s", w.slot, w.url)
+
+    def run(self) -> None:
+        # حلقه‌ی یک اجرای قبلی که درست بسته نشده
+        self.redis.delete(settings.AFFINITY_KEY)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            while not self.stopping:
+                self.tick()
+                time.sleep(0.2)
+        finally:
+            self.shutdown()
+
+    def _stop(self, *_):
+        self.stopping = True
+
+    def shutdown(self) -> None:
+        self.redis.delete(settings.AFFINITY_KEY)
+        running = [w.proc for w in self.workers if w.proc is not None and w.proc.poll() is None]
+        for proc in running:
+            proc.terminate()
+        deadline = time.monotonic() + 15
+        for proc in running:
+            try:
+                proc.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--base-port", type=int, default=8001)
+    parser.add_argument("--public-url", default="http://localhost:{port}",
+                        help="url clients use to reach a worker; {port} is its port")
+    parser.add_argument("uvicorn_args", nargs=argparse.REMAINDER,
+                        help="passed to every uvicorn worker after --")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    extra = args.uvicorn_args[1:] if args.uvicorn_args[:1] == ["--"] else args.uvicorn_args
+    Supervisor(args.workers, args.host, args.base_port, args.public_url, extra).run()
@@ -0,0 +1,83 @@
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, text
+
+from app.celery_app import app
+from app.core.config import settings
+from app.db import archive
+from app.db.crud import _history_row, _history_select
+from app.db.instrument import query_tag
+from app.db.models import Message
+from app.db.partitions import (
+    add_months,
+    detach_and_drop,
+    ensure_partitions,
+    list_partitions,
+    month_bounds,
+    month_start,
+)
+from app.db.session import sync_engine
+
+log = logging.getLogger(__name__)
+
+
+@query_tag
+def archive_partition(name: str, month) -> int:
+    """
+    Export one monthly partition to its archive segment, then detach and drop it.
+    The partition is locked against writes for the duration, so nothing changes under the export.
+    """
+    lower, upper = month_bounds(month)
+    with sync_engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+        # history (and so the archive) never shows rows whose user was deleted
+        expected = conn.execute(
+            select(func.count()).select_from(text(name)).where(text("user_id IS NOT NULL"))
+        ).scalar_one()
+
+        # فیلتر روی created_at = فقط همین پارتیشن اسکن می‌شود
+        stmt = (
+            _history_select()
+            .where(Message.created_at >= lower, Message.created_at < upper)
+            .order_by(Message.room_id, Message.created_at, Message.id)
+        )
+        result = conn.execution_options(yield_per=5000).execute(stmt)
+        written = archive.write_segment(month, (_history_row(r._mapping) for r in result))
+        try:
+            if written != expected:
+                raise RuntimeError(f"{name}: exported {written} rows, partition has {expected}")
+            detach_and_drop(conn, name)
+        except Exception:
+            # تا وقتی پارتیشن سر جایش است، سگمنت آرشیو نباید خوانده شود
+            archive.remove_segment(month)
+            raise
+    log.info("archived %s (%d rows)", name, written)
+    return written
+
+
+@app.task(name="ensure_partitions_task")
+def ensure_partitions_task() -> list[str]:
+    if sync_engine.dialect.name != "postgresql":
+        return []
+    with sync_engine.begin() as conn:
+        return ensure_partitions(conn, settings.PARTITION_MONTHS_AHEAD)
+
+
+@app.task(name="archive_partitions_task")
+def archive_partitions_task(after_months: int | None = None) -> list[str]:
+    """Archive every partition whose month ended more than `after_months` months ago."""
+    if sync_engine.dialect.name != "postgresql":
+        return []
+    if after_months is None:
+        after_months = settings.ARCHIVE_AFTER_MONTHS
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -after_months)
+
+    with sync_engine.connect() as conn:
+        candidates = [(name, month) for name, month in list_partitions(conn) if add_months(month, 1) <= cutoff]
+
+    done = []
+    for name, month in candidates:
+        archive_partition(name, month)
+        done.append(name)
+    return done
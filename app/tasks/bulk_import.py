@@ -0,0 +1,225 @@
+"""
+Bulk message import from an NDJSON file, one message per line:
+
+    {"room_id": 7, "username": "ali", "content": "...", "created_at": "2024-03-01T10:00:00+00:00",
+     "edited_at": null, "is_deleted": false, "replied_to": null}
+
+created_at defaults to the import time; edited_at, is_deleted and replied_to (a message id
+in this database) are optional. Lines that do not parse, and rows falling in an archived
+month, are counted as skipped.
+
+Each batch of IMPORT_BATCH_SIZE rows resolves its usernames and rooms with one SELECT
+(plus one INSERT for the missing ones), reserves change_seqs per room and is loaded with
+COPY on Postgres (executemany elsewhere). The job's byte offset advances in the same
+transaction, so a failed or interrupted job resumes from the last committed batch without
+duplicating rows. Imported messages do not count as unread and are not pushed to the hot
+history cache; import into rooms before they go live, or expect clients to refetch.
+"""
+import io
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.celery_app import app
+from app.core.config import settings
+from app.db import archive
+from app.db.crud import _bump_seq, _reply_snapshot
+from app.db.instrument import query_tag
+from app.db.models import ImportJob, Message, Room, User
+from app.db.partitions import ensure_months, month_start
+from app.db.session import sync_engine
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ("room_id", "user_id", "username", "content", "created_at", "edited_at", "is_deleted", "replied_to",
+           "change_seq", "reply_text", "reply_user", "reply_deleted")
+
+
+def import_path(job_id: str) -> str:
+    return os.path.join(settings.IMPORT_DIR, f"{job_id}.ndjson")
+
+
+def _timestamp(value) -> datetime | None:
+    if value is None:
+        return None
+    ts = datetime.fromisoformat(value)
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def parse_line(line: bytes, now: datetime) -> dict | None:
+    try:
+        obj = json.loads(line)
+        row = {
+            "room_id": int(obj["room_id"]),
+            "username": str(obj["username"]).strip(),
+            "content": obj["content"],
+            "created_at": _timestamp(obj.get("created_at")) or now,
+            "edited_at": _timestamp(obj.get("edited_at")),
+            "is_deleted": bool(obj.get("is_deleted", False)),
+            "replied_to": int(obj["replied_to"]) if obj.get("replied_to") is not None else None,
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not row["username"] or len(row["username"]) > 64 or not isinstance(row["content"], str):
+        return None
+    return row
+
+
+def _dialect_insert(conn):
+    return postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+
+
+def _resolve_users(conn, usernames: set[str]) -> dict[str, int]:
+    stmt = select(User.username, User.id).where(User.username.in_(usernames))
+    ids = dict(conn.execute(stmt).all())
+    missing = usernames - ids.keys()
+    if missing:
+        conn.execute(
+            _dialect_insert(conn)(User).on_conflict_do_nothing(index_elements=[User.username]),
+            [{"username": u} for u in missing],
+        )
+        ids = dict(conn.execute(stmt).all())
+    return ids
+
+
+def _ensure_rooms(conn, room_ids: set[int]) -> None:
+    existing = set(conn.execute(select(Room.id).where(Room.id.in_(room_ids))).scalars())
+    if room_ids - existing:
+        conn.execute(
+            _dialect_insert(conn)(Room).on_conflict_do_nothing(index_elements=[Room.id]),
+            [{"id": r} for r in room_ids - existing],
+        )
+
+
+def _copy_value(v) -> str:
+    if v is None:
+        return r"\N"
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _load(conn, rows: list[dict]) -> None:
+    if conn.dialect.name != "postgresql":
+        conn.execute(insert(Message.__table__), rows)
+        return
+    buf = io.StringIO()
+    for r in rows:
+        buf.write("\t".join(_copy_value(r[c]) for c in COLUMNS))
+        buf.write("\n")
+    buf.seek(0)
+    # psycopg2؛ همان تراکنش conn
+    with conn.connection.dbapi_connection.cursor() as cur:
+        cur.copy_expert(f"COPY messages ({', '.join(COLUMNS)}) FROM STDIN", buf)
+
+
+def import_batch(conn, rows: list[dict]) -> None:
+    """Insert one parsed batch inside the caller's transaction."""
+    user_ids = _resolve_users(conn, {r["username"] for r in rows})
+    room_ids = {r["room_id"] for r in rows}
+    _ensure_rooms(conn, room_ids)
+    if conn.dialect.name == "postgresql":
+        ensure_months(conn, {month_start(r["created_at"].astimezone(timezone.utc)) for r in rows})
+
+    # پیش‌نمایش پاسخ‌ها با یک SELECT برای کل دسته
+    parent_ids = {r["replied_to"] for r in rows if r["replied_to"]}
+    parents = {}
+    if parent_ids:
+        parents = {p.id: p for p in conn.execute(
+            select(Message.id, Message.content, Message.is_deleted, Message.username).where(Message.id.in_(parent_ids))
+        )}
+
+    per_room: dict[int, list[dict]] = {}
+    for r in rows:
+        r["user_id"] = user_ids[r["username"]]
+        r.update(_reply_snapshot(parents.get(r["replied_to"])))
+        per_room.setdefault(r["room_id"], []).append(r)
+    for room_id, room_rows in per_room.items():
+        last = conn.execute(_bump_seq(room_id, len(room_rows))).scalar_one()
+        for i, r in enumerate(room_rows):
+            r["change_seq"] = last - len(room_rows) + 1 + i
+    _load(conn, rows)
+
+
+class ImportConflict(Exception):
+    """Another run of the same job committed a batch first."""
+
+
+@query_tag
+def run_import(job_id: str, progress=None) -> dict:
+    """
+    Import (or resume) a job from its committed offset. `progress(job)` is called after
+    every batch. Returns the final job state.
+    """
+    with sync_engine.begin() as conn:
+        job = conn.execute(select(ImportJob.__table__).where(ImportJob.id == job_id)).mappings().one()
+        if job["status"] == "done":
+            return dict(job)
+        conn.execute(update(ImportJob).where(ImportJob.id == job_id).values(status="running", error=None))
+    offset, done, skipped = job["offset"], job["rows"], job["skipped"]
+    archived = set(archive.archived_months())
+    now = datetime.now(timezone.utc)
+
+    def commit(batch: list[dict], end: int, bad: int) -> None:
+        nonlocal offset, done, skipped
+        with sync_engine.begin() as conn:
+            if batch:
+                import_batch(conn, batch)
+            moved = conn.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.offset == offset)
+                .values(offset=end, rows=ImportJob.rows + len(batch), skipped=ImportJob.skipped + bad,
+                        updated_at=datetime.now(timezone.utc))
+            ).rowcount
+            if moved != 1:
+                # rollback کل دسته؛ اجرای دیگری جلوتر است
+                raise ImportConflict(f"import {job_id} advanced past offset {offset} by another run")
+        offset, done, skipped = end, done + len(batch), skipped + bad
+        if progress:
+            progress({"id": job_id, "offset": offset, "total_bytes": job["total_bytes"], "rows": done, "skipped": skipped})
+
+    try:
+        with open(import_path(job_id), "rb") as f:
+            f.seek(offset)
+            batch, bad, pos = [], 0, offset
+            for line in f:
+                pos += len(line)
+                if not line.strip():
+                    continue
+                row = parse_line(line, now)
+                if row is None or month_start(row["created_at"].astimezone(timezone.utc)) in archived:
+                    bad += 1
+                else:
+                    batch.append(row)
+                if len(batch) >= settings.IMPORT_BATCH_SIZE:
+                    commit(batch, pos, bad)
+                    batch, bad = [], 0
+            if batch or bad or pos != offset:
+                commit(batch, pos, bad)
+    except ImportConflict:
+        raise
+    except Exception as e:
+        with sync_engine.begin() as conn:
+            conn.execute(update(ImportJob).where(ImportJob.id == job_id).values(status="failed", error=str(e)[:2000]))
+        raise
+
+    with sync_engine.begin() as conn:
+        conn.execute(
+            update(ImportJob).where(ImportJob.id == job_id)
+            .values(status="done", updated_at=datetime.now(timezone.utc))
+        )
+        final = dict(conn.execute(select(ImportJob.__table__).where(ImportJob.id == job_id)).mappings().one())
+    log.info("import %s done: %d rows, %d skipped", job_id, final["rows"], final["skipped"])
+    return final
+
+
+@app.task(name="import_messages_task", bind=True)
+def import_messages_task(self, job_id: str) -> dict:
+    final = run_import(job_id, progress=lambda p: self.update_state(state="PROGRESS", meta=p))
+    return {k: final[k] for k in ("id", "status", "rows", "skipped")}
@@ -0,0 +1,135 @@
+"""
+Tombstone compaction.
+
+Deleting a message only marks it (is_deleted, content cleared, edited_at = deletion
+time), so clients that are behind still receive the delete through get_changes. After
+TOMBSTONE_RETENTION_DAYS the rows are hard-deleted in batches of TOMBSTONE_BATCH_SIZE,
+each in its own short transaction, and replies pointing at them get replied_to = NULL
+(their reply_deleted snapshot keeps showing "deleted"). Each batch raises its rooms'
+compacted_seq to the newest change_seq it removed, so a client reconnecting from before
+that gets the full history instead of a delta that is missing those deletes.
+
+Tombstones from before content was cleared on delete are emptied first, whatever their
+age, so their storage is reclaimed without waiting for the retention window.
+
+prune_sent_messages_task drops sent_messages rows (client_msg_id dedup keys) older than
+CLIENT_MSG_ID_RETENTION_HOURS; a client retrying later than that sends a new message.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, case, delete, select, tuple_, update
+
+from app.celery_app import app
+from app.core.config import settings
+from app.db.instrument import query_tag
+from app.db.models import Message, Room, SentMessage
+from app.db.session import sync_engine
+
+log = logging.getLogger(__name__)
+
+
+def _by_keys(conn, keys) -> tuple:
+    ids = Message.id.in_([k.id for k in keys])
+    if conn.dialect.name != "postgresql":
+        return (ids,)
+    # بازه‌ی created_at تا فقط پارتیشن‌های همین ردیف‌ها بررسی شوند
+    created = [k.created_at for k in keys]
+    return ids, Message.created_at >= min(created), Message.created_at <= max(created)
+
+
+@query_tag
+def clear_batch(conn, limit: int) -> int:
+    """Empty the content of up to `limit` tombstones that still have it."""
+    keys = conn.execute(
+        select(Message.id, Message.created_at)
+        .where(Message.is_deleted == True, Message.content != "")
+        .limit(limit)
+    ).all()
+    if not keys:
+        return 0
+    return conn.execute(update(Message).where(*_by_keys(conn, keys)).values(content="")).rowcount
+
+
+@query_tag
+def compact_batch(conn, cutoff: datetime, limit: int) -> int:
+    """Hard-delete up to `limit` tombstones deleted before `cutoff`; returns the rows removed."""
+    keys = conn.execute(
+        select(Message.id, Message.created_at, Message.room_id, Message.change_seq)
+        .where(Message.is_deleted == True, Message.edited_at < cutoff)
+        .order_by(Message.edited_at)
+        .limit(limit)
+    ).all()
+    if not keys:
+        return 0
+    horizon: dict[int, int] = {}
+    for k in keys:
+        horizon[k.room_id] = max(horizon.get(k.room_id, 0), k.change_seq)
+    # در همان تراکنش حذف، تا هیچ delta ناقصی دیده نشود
+    seq = bindparam("seq")
+    conn.execute(
+        update(Room)
+        .where(Room.id == bindparam("room"))
+        .values(compacted_seq=case((Room.compacted_seq < seq, seq), else_=Room.compacted_seq)),
+        [{"room": room_id, "seq": s} for room_id, s in sorted(horizon.items())],
+    )
+    conn.execute(
+        update(Message).where(Message.replied_to.in_([k.id for k in keys])).values(replied_to=None)
+    )
+    return conn.execute(delete(Message).where(*_by_keys(conn, keys))).rowcount
+
+
+@query_tag
+def prune_sent_batch(conn, cutoff: datetime, limit: int) -> int:
+    """Delete up to `limit` sent_messages rows created before `cutoff`."""
+    keys = conn.execute(
+        select(SentMessage.room_id, SentMessage.user_id, SentMessage.client_msg_id)
+        .where(SentMessage.created_at < cutoff)
+        .limit(limit)
+    ).all()
+    if not keys:
+        return 0
+    key = tuple_(SentMessage.room_id, SentMessage.user_id, SentMessage.client_msg_id)
+    return conn.execute(delete(SentMessage).where(key.in_([tuple(k) for k in keys]))).rowcount
+
+
+def _drain(step, label: str) -> dict:
+    rows, batches, started = 0, [], time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        with sync_engine.begin() as conn:
+            n = step(conn)
+        if not n:
+            break
+        seconds = time.perf_counter() - t0
+        rows += n
+        batches.append({"rows": n, "seconds": round(seconds, 4)})
+        log.info("%s: %d rows in %.3fs", label, n, seconds)
+    return {"rows": rows, "batches": batches, "seconds": round(time.perf_counter() - started, 4)}
+
+
+@app.task(name="compact_tombstones_task")
+def compact_tombstones_task(retention_days: float | None = None, batch_size: int | None = None) -> dict:
+    if retention_days is None:
+        retention_days = settings.TOMBSTONE_RETENTION_DAYS
+    batch_size = batch_size or settings.TOMBSTONE_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+    cleared = _drain(lambda conn: clear_batch(conn, batch_size), "tombstones cleared")
+    reclaimed = _drain(lambda conn: compact_batch(conn, cutoff, batch_size), "tombstones reclaimed")
+    log.info(
+        "tombstone compaction: %d rows reclaimed in %d batches (%.1fs), %d cleared",
+        reclaimed["rows"], len(reclaimed["batches"]), reclaimed["seconds"], cleared["rows"],
+    )
+    return {"cutoff": cutoff.isoformat(), "cleared": cleared, "reclaimed": reclaimed}
+
+
+@app.task(name="prune_sent_messages_task")
+def prune_sent_messages_task(retention_hours: float | None = None, batch_size: int | None = None) -> dict:
+    if retention_hours is None:
+        retention_hours = settings.CLIENT_MSG_ID_RETENTION_HOURS
+    batch_size = batch_size or settings.TOMBSTONE_BATCH_SIZE
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+    pruned = _drain(lambda conn: prune_sent_batch(conn, cutoff, batch_size), "sent_messages pruned")
+    return {"cutoff": cutoff.isoformat(), "pruned": pruned}
@@ -0,0 +1,51 @@
+import json
+import os
+
+from app.celery_app import app
+from app.core.storage import DERIVED_DIR, IMAGE_VARIANTS, UPLOAD_DIR, derived_name
+
+
+def render_derivatives(name: str) -> dict:
+    """
+    Write a WebP per IMAGE_VARIANTS entry for uploads/<name> and a <sha>.json
+    sidecar describing them. Already-rendered variants are skipped.
+    """
+    from PIL import Image, ImageOps
+
+    sha = name[:64]
+    meta = {"sha256": sha, "original": name, "variants": {}}
+    with Image.open(os.path.join(UPLOAD_DIR, name)) as im:
+        im = ImageOps.exif_transpose(im)
+        meta["width"], meta["height"] = im.size
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "PA") else "RGB")
+
+        for variant, max_side in IMAGE_VARIANTS.items():
+            out_path = os.path.join(DERIVED_DIR, derived_name(sha, variant))
+            if not os.path.exists(out_path):
+                copy = im.copy()
+                copy.thumbnail((max_side, max_side), Image.LANCZOS)
+                tmp_path = out_path + ".tmp"
+                copy.save(tmp_path, "WEBP", quality=80, method=4)
+                # rename اتمیک؛ هرگز فایل نیمه‌کاره سرو نمی‌شود
+                os.replace(tmp_path, out_path)
+            with Image.open(out_path) as done:
+                width, height = done.size
+            meta["variants"][variant] = {
+                "url": f"/api/uploads/derived/{derived_name(sha, variant)}",
+                "width": width,
+                "height": height,
+                "bytes": os.path.getsize(out_path),
+            }
+
+    meta_path = os.path.join(DERIVED_DIR, f"{sha}.json")
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return meta
+
+
+# prefork worker pool = process pool؛ هر تصویر در یک پروسه‌ی جدا رندر می‌شود
+@app.task(name="make_derivatives_task")
+def make_derivatives_task(name: str) -> dict:
+    return render_derivatives(name)
@@ -1,9 +1,34 @@
 from app.celery_app import app
 from app.db.session import SyncSessionLocal
 from app.db.crud import save_message_sync
+from app.db.history_cache import invalidate_sync
+from app.socket.external import emit_to_room
 
 @app.task(name="save_message_task")
-def save_message_task(room_id: int, username: str, content: str) -> int:
+def save_message_task(room_id: int, username: str, content: str, replied_to: int | None = None,
+                      client_msg_id: str | None = None) -> int | None:
     with SyncSessionLocal() as db:
-        msg_id = save_message_sync(db, room_id=room_id, username=username, content=content)
-        return msg_id
+        msg = save_message_sync(db, room_id=room_id, username=username, content=content, replied_to=replied_to,
+                                client_msg_id=client_msg_id)
+        if msg is None:
+            return None
+        payload = {
+            "id": msg.id,
+            "username": username,
+            "room_id": room_id,
+            "content": content,
+            "created_at": msg.created_at,
+            "edited_at": None,
+            "replied_to": replied_to,
+            "reply_user": msg.reply_user,
+            "reply_text": msg.reply_text,
+            "reply_deleted": bool(msg.reply_deleted),
+            "is_deleted": False,
+            "seq": msg.change_seq,
+        }
+    if client_msg_id:
+        payload["client_msg_id"] = client_msg_id
+    # write-behind این پیام را پخش نکرده بود؛ حالا که ذخیره شد
+    invalidate_sync(room_id)
+    emit_to_room("message", payload, room_id)
+    return payload["id"]
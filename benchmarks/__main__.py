@@ -0,0 +1,64 @@
+"""
+Run the micro-benchmarks (and optionally the load test) and write one JSON document
+with run metadata, for comparing runs over time.
+
+    python -m benchmarks [--load] [--db URL_ASYNC URL_SYNC] [--out results/2026-10-18.json]
+
+Each benchmark runs in its own process, so engines and env vars do not leak between them.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+MICRO = ["bench_serializer", "bench_batching", "bench_crud", "bench_message_insert", "bench_import"]
+# these take no --db
+NO_DB = {"bench_serializer", "bench_batching"}
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run(module: str, extra: list[str]) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-m", f"benchmarks.{module}", *extra], capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+    # فقط JSON خروجی؛ لاگ‌ها روی stderr هستند
+    return json.loads(proc.stdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("--load", action="store_true", help="also run benchmarks.load_test")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    db_args = ["--db", *args.db] if args.db else []
+    modules = MICRO + (["load_test"] if args.load else [])
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db": "custom" if args.db else "sqlite",
+        },
+        "results": {
+            m: _run(m, [] if m in NO_DB else db_args) for m in modules
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
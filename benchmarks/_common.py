@@ -0,0 +1,27 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import statistics
+import tempfile
+
+
+def setup_env(db: list[str] | None) -> None:
+    """Point the app at `db` (async URL, sync URL) or at a throwaway SQLite file.
+    Must run before anything under app/ is imported."""
+    if db:
+        os.environ["ASYNC_DATABASE_URL"], os.environ["DATABASE_URL"] = db
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+
+def summary(samples: list[float]) -> dict:
+    if not samples:
+        return {"n": 0}
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 4),
+        "p99_ms": round(samples[max(int(len(samples) * 0.99) - 1, 0)] * 1000, 4),
+    }
@@ -0,0 +1,93 @@
+"""
+Room broadcasts with and without adaptive batching (app.socket.batching).
+
+    python -m benchmarks.bench_batching [--members 200] [--rate 200] [--seconds 3]
+                                        [--threshold 50] [--window-ms 20]
+
+One room with --members local clients receives --rate `message` events/sec, first with
+batching off, then with the given threshold (events/sec, as BROADCAST_BATCH_RATE). Counts the
+emits that would be pub/sub publishes under AsyncRedisManager, the websocket frames
+and bytes written, and the send-to-frame delay batching adds. No sockets or Redis.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import socketio
+
+from app.core import serializer
+from app.socket.batching import RoomBatcher
+from benchmarks._common import summary
+
+
+async def _run(threshold: float, members: int, rate: float, seconds: float, window: float) -> dict:
+    sio = socketio.AsyncServer(async_mode="asgi", json=serializer)
+    stats = {"publishes": 0, "frames": 0, "bytes": 0, "delay": []}
+
+    emit = sio.manager.emit
+
+    async def counting_emit(*args, **kwargs):
+        stats["publishes"] += 1
+        return await emit(*args, **kwargs)
+
+    async def send_packet(eio_sid, pkt):
+        stats["frames"] += 1
+        stats["bytes"] += len(pkt.encode())
+        # فقط یک عضو تاخیر را ثبت می‌کند
+        if eio_sid != "e0":
+            return
+        # engineio packet: '2' + the socketio packet, e.g. '2["message",{...}]'
+        event, data = json.loads(pkt.data[1:])
+        now = time.perf_counter()
+        for sent in ([d["sent"] for _, d in data["events"]] if event == "message_batch" else [data["sent"]]):
+            stats["delay"].append(now - sent)
+
+    sio.manager.emit = counting_emit
+    sio.eio.send_packet = send_packet
+    for i in range(members):
+        sid = await sio.manager.connect(f"e{i}", "/")
+        await sio.enter_room(sid, "1")
+
+    batcher = RoomBatcher(threshold, window, 200, {})
+    batcher.attach(sio)
+    n = int(rate * seconds)
+    t0 = time.perf_counter()
+    for i in range(n):
+        # ارسال با نرخ ثابت
+        await asyncio.sleep(max(t0 + i / rate - time.perf_counter(), 0))
+        payload = {"id": i, "room_id": 1, "username": "bench", "content": "hello " * 8, "sent": time.perf_counter()}
+        await batcher.emit("message", payload, 1)
+    await asyncio.sleep(window * 2)
+    await batcher.flush_all()
+    return {
+        "messages": n,
+        "publishes": stats["publishes"],
+        "frames": stats["frames"],
+        "bytes": stats["bytes"],
+        "delivery_delay": summary(stats["delay"]),
+    }
+
+
+async def run(members: int, rate: float, seconds: float, threshold: float, window_ms: int) -> dict:
+    window = window_ms / 1000
+    return {
+        "members": members,
+        "rate": rate,
+        "threshold": threshold,
+        "window_ms": window_ms,
+        "immediate": await _run(0, members, rate, seconds, window),
+        "batched": await _run(threshold, members, rate, seconds, window),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=200, help="messages/sec sent to the room")
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--threshold", type=float, default=50)
+    parser.add_argument("--window-ms", type=int, default=20)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.members, args.rate, args.seconds, args.threshold, args.window_ms))
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,124 @@
+"""
+Micro-benchmarks for the crud functions behind the socket handlers and REST routes.
+
+    python -m benchmarks.bench_crud [--db URL_ASYNC URL_SYNC] [--messages 20000] [-n 500]
+
+Seeds one room with --messages rows (every fifth one a reply), then times each
+function -n times. Defaults to a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmarks._common import setup_env, summary
+
+
+async def _time(fn, n: int) -> dict:
+    for _ in range(min(20, n)):
+        await fn()
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    return summary(samples)
+
+
+async def run(n_messages: int, n: int) -> dict:
+    from sqlalchemy import insert
+    from app.db import crud
+    from app.db.models import Base, Message, Room
+    from app.db.session import AsyncSessionLocal, async_autocommit_engine, async_engine
+
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await crud.get_or_create_room(db, 1)
+        user_id = await crud.get_user_id(db, "bench")
+        words = ["سلام", "hello", "deploy", "review", "lunch", "release", "bug", "fix", "chat", "test"]
+        rows = [
+            {
+                "room_id": 1,
+                "user_id": user_id,
+                "username": "bench",
+                "content": " ".join(random.choices(words, k=8)),
+                "replied_to": i - 1 if i % 5 == 0 and i > 1 else None,
+                "change_seq": i,
+            }
+            for i in range(1, n_messages + 1)
+        ]
+        for i in range(0, len(rows), 5000):
+            await db.execute(insert(Message), rows[i:i + 5000])
+        await db.execute(Room.__table__.update().where(Room.id == 1).values(change_seq=n_messages))
+        await db.commit()
+
+        _, _, cursor = await crud.get_history(db, 1, limit=50)
+
+    async def get_history_newest():
+        async with AsyncSessionLocal() as db:
+            await crud.get_history(db, 1, limit=50)
+
+    async def get_history_before():
+        async with AsyncSessionLocal() as db:
+            await crud.get_history(db, 1, limit=50, before=cursor)
+
+    async def get_changes_recent():
+        async with AsyncSessionLocal() as db:
+            await crud.get_changes(db, 1, n_messages - 20, 200)
+
+    async def search():
+        async with AsyncSessionLocal() as db:
+            await crud.search_messages(db, 1, "deploy", limit=50)
+
+    async def get_user_id_cached():
+        async with AsyncSessionLocal() as db:
+            await crud.get_user_id(db, "bench")
+
+    async def insert_with_preview():
+        async with async_autocommit_engine.connect() as conn:
+            await crud.insert_message_with_preview(conn, 1, user_id, "bench", "hello", 1)
+
+    edit_ids = iter(range(2, n_messages))
+
+    async def update_message():
+        async with AsyncSessionLocal() as db:
+            await crud.update_message(db, next(edit_ids), "bench", "edited")
+
+    delete_ids = iter(range(n_messages - 1, 1, -1))
+
+    async def delete_message():
+        async with AsyncSessionLocal() as db:
+            await crud.delete_message_db(db, next(delete_ids), "bench")
+
+    async def get_reply_ids():
+        async with AsyncSessionLocal() as db:
+            await crud.get_reply_ids(db, 4)
+
+    results = {"dialect": async_engine.dialect.name, "messages": n_messages}
+    for name, fn in (
+        ("get_history", get_history_newest),
+        ("get_history_before", get_history_before),
+        ("get_changes", get_changes_recent),
+        ("search_messages", search),
+        ("get_user_id_cached", get_user_id_cached),
+        ("get_reply_ids", get_reply_ids),
+        ("insert_message_with_preview", insert_with_preview),
+        ("update_message", update_message),
+        ("delete_message_db", delete_message),
+    ):
+        results[name] = await _time(fn, n)
+    await async_engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("-n", type=int, default=500)
+    args = parser.parse_args()
+    setup_env(args.db)
+    print(json.dumps(asyncio.run(run(args.messages, args.n)), indent=2))
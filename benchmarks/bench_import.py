@@ -0,0 +1,69 @@
+"""
+Bulk import throughput (app.tasks.bulk_import.run_import, called directly, no Celery).
+
+    python -m benchmarks.bench_import [--db URL_ASYNC URL_SYNC] [--rows 200000] [--rooms 20] [--users 500]
+
+Writes an NDJSON file of --rows messages spread over --rooms rooms and --users users,
+imports it into an empty schema and reports rows/sec. Postgres loads with COPY,
+the default throwaway SQLite file with executemany.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks._common import setup_env
+
+
+def run(n_rows: int, rooms: int, users: int) -> dict:
+    from sqlalchemy import insert
+    from app.core.config import settings
+    from app.db.models import Base, ImportJob
+    from app.db.session import sync_engine
+    from app.tasks.bulk_import import import_path, run_import
+
+    Base.metadata.drop_all(sync_engine)
+    Base.metadata.create_all(sync_engine)
+
+    settings.IMPORT_DIR = tempfile.mkdtemp()
+    job_id = "bench"
+    t0 = datetime.now(timezone.utc) - timedelta(days=60)
+    words = ["سلام", "hello", "deploy", "review", "lunch", "release", "bug", "fix", "chat", "test"]
+    with open(import_path(job_id), "w") as f:
+        for i in range(n_rows):
+            f.write(json.dumps({
+                "room_id": i % rooms + 1,
+                "username": f"user{random.randrange(users)}",
+                "content": " ".join(random.choices(words, k=8)),
+                "created_at": (t0 + timedelta(seconds=i * 10)).isoformat(),
+            }, ensure_ascii=False) + "\n")
+    size = os.path.getsize(import_path(job_id))
+    with sync_engine.begin() as conn:
+        conn.execute(insert(ImportJob), [{"id": job_id, "filename": "bench.ndjson", "status": "queued", "total_bytes": size}])
+
+    start = time.perf_counter()
+    final = run_import(job_id)
+    elapsed = time.perf_counter() - start
+    os.remove(import_path(job_id))
+    return {
+        "dialect": sync_engine.dialect.name,
+        "rows": final["rows"],
+        "bytes": size,
+        "batch_size": settings.IMPORT_BATCH_SIZE,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(final["rows"] / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+    setup_env(args.db)
+    print(json.dumps(run(args.rows, args.rooms, args.users), indent=2))
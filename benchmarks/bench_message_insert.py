@@ -0,0 +1,66 @@
+"""
+Per-message latency of the `message` hot path: legacy (get_or_create_user + create_message
++ parent SELECT) vs cached user id + single-statement insert with reply preview.
+
+    python -m benchmarks.bench_message_insert [--db URL_ASYNC URL_SYNC] [-n 2000]
+
+Defaults to a throwaway SQLite file; point it at Postgres to measure the CTE path.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks._common import setup_env, summary
+
+
+async def run(n: int) -> dict:
+    from sqlalchemy import select
+    from app.db import crud
+    from app.db.models import Base, Message, User
+    from app.db.session import AsyncSessionLocal, async_autocommit_engine, async_engine
+
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        await crud.get_or_create_room(db, 1)
+        parent = await crud.create_message(db, 1, (await crud.get_or_create_user(db, "bench")).id, "parent", username="bench")
+
+    async def legacy():
+        async with AsyncSessionLocal() as db:
+            user = await crud.get_or_create_user(db, "bench")
+            await crud.create_message(db, 1, user.id, "hello", parent.id, "bench")
+            q = await db.execute(
+                select(Message.content, User.username)
+                .join(User, User.id == Message.user_id)
+                .where(Message.id == parent.id)
+            )
+            q.first()
+
+    async def single():
+        async with AsyncSessionLocal() as db:
+            user_id = await crud.get_user_id(db, "bench")
+        async with async_autocommit_engine.connect() as conn:
+            await crud.insert_message_with_preview(conn, 1, user_id, "bench", "hello", parent.id)
+
+    results = {"dialect": async_engine.dialect.name}
+    for name, fn in (("legacy", legacy), ("single_round_trip", single)):
+        for _ in range(min(50, n)):
+            await fn()
+        samples = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - t0)
+        results[name] = summary(samples)
+    await async_engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("-n", type=int, default=2000)
+    args = parser.parse_args()
+    setup_env(args.db)
+    print(json.dumps(asyncio.run(run(args.n)), indent=2))
@@ -0,0 +1,84 @@
+"""
+Encode cost of a history-sized `history` emit: old path (to_json_safe dumps/loads, then
+stdlib json for the Redis publish and the Socket.IO packet) vs app.core.serializer.
+
+    python -m benchmarks.bench_serializer [-n 2000] [--rounds 50]
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import socketio.packet
+
+from app.core import serializer
+
+
+def _history_payload(n: int) -> dict:
+    t0 = datetime(2025, 10, 15, tzinfo=timezone.utc)
+    messages = [
+        {
+            "id": i,
+            "room_id": 1,
+            "username": f"user{i % 50}",
+            "content": "سلام، این یک پیام آزمایشی است " * 3,
+            "created_at": t0 + timedelta(seconds=i),
+            "edited_at": None,
+            "replied_to": i - 1 if i % 5 == 0 else None,
+            "reply_text": "parent" if i % 5 == 0 else None,
+            "reply_user": "user0" if i % 5 == 0 else None,
+            "reply_deleted": False,
+            "is_deleted": False,
+        }
+        for i in range(n)
+    ]
+    return {"room_id": 1, "messages": messages, "users": sorted({m["username"] for m in messages})}
+
+
+def _legacy_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError
+
+
+def _encode_packet(json_module, data) -> str:
+    socketio.packet.Packet.json = json_module
+    return socketio.packet.Packet(socketio.packet.EVENT, data=["history", data]).encode()
+
+
+def legacy(payload):
+    safe = json.loads(json.dumps(payload, default=_legacy_default))
+    json.dumps({"method": "emit", "data": [safe]})
+    return _encode_packet(json, safe)
+
+
+def current(payload):
+    serializer.dumps({"method": "emit", "data": [payload]})
+    return _encode_packet(serializer, payload)
+
+
+def _time(fn, payload, rounds: int) -> dict:
+    fn(payload)
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(payload)
+        samples.append(time.perf_counter() - t0)
+    return {"mean_ms": round(statistics.fmean(samples) * 1000, 3), "min_ms": round(min(samples) * 1000, 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    payload = _history_payload(args.n)
+    result = {
+        "messages": args.n,
+        "backend": "orjson" if serializer.orjson else "stdlib",
+        "legacy": _time(legacy, payload, args.rounds),
+        "current": _time(current, payload, args.rounds),
+    }
+    result["speedup"] = round(result["legacy"]["mean_ms"] / result["current"]["mean_ms"], 2)
+    print(json.dumps(result, indent=2))
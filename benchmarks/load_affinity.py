@@ -0,0 +1,218 @@
+"""
+Multi-process harness for the room-affine mode (app.supervisor, app/socket/affinity.py).
+
+    python -m benchmarks.load_affinity [--db URL_ASYNC URL_SYNC] [--workers 4] [--clients 400]
+                                       [--rooms 40] [--messages 5] [--rate 1.0] [--kill]
+
+Starts the supervisor with --workers processes, connects every client to the worker
+that owns its room (GET /api/rooms/{id}/worker) and measures deliveries like
+benchmarks.load_test; run it with --workers 1 and --workers N to compare throughput.
+With --kill it then SIGKILLs worker 0 and reports how long the ring took to drop it,
+how many rooms moved (only worker 0's should), whether their clients could rejoin on
+the new owners, and how many `room_moved` hand-offs followed once worker 0 returned.
+
+Needs Redis at REDIS_URL. SQLite is shared by all workers; use --db with Postgres for
+anything beyond a smoke run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from benchmarks._common import setup_env, summary
+from benchmarks.load_test import SimClient, _free_port
+
+
+def _start_supervisor(workers: int, base_port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        HISTORY_CACHE_BACKEND="memory",
+        SEND_DEDUP_BACKEND="memory",
+        CELERY_BROKER_URL="memory://",
+        CELERY_RESULT_BACKEND="cache+memory://",
+    )
+    env.setdefault("RATE_LIMIT_ROOM", "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.supervisor", "--workers", str(workers), "--host", "127.0.0.1",
+         "--base-port", str(base_port), "--public-url", "http://127.0.0.1:{port}",
+         "--", "--log-level", "warning"],
+        env=env,
+    )
+
+
+def _worker_pid(port: int) -> int | None:
+    """pid of the uvicorn process listening on `port`, from its command line."""
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = f.read().split(b"\0")
+        except OSError:
+            continue
+        if b"uvicorn" in args and b"--port" in args and args[args.index(b"--port") + 1] == str(port).encode():
+            return int(pid)
+    return None
+
+
+class AffineClient(SimClient):
+    def __init__(self, index: int, room_id: int, stats: dict):
+        super().__init__(index, room_id, stats)
+        self.sio.on("room_moved", self._on_moved)
+
+    async def _on_moved(self, data):
+        self.stats["moved"] += 1
+
+
+async def _ring(r, size: int, timeout: float = 60) -> dict:
+    """The worker hash once it has `size` entries."""
+    from app.core.config import settings
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ring = {int(k): v.decode() for k, v in (await r.hgetall(settings.AFFINITY_KEY)).items()}
+        if len(ring) == size:
+            return ring
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"worker ring did not reach {size} workers")
+
+
+async def _owners(http, base: str, rooms: int) -> dict:
+    owners = {}
+    for room_id in range(1, rooms + 1):
+        async with http.get(f"{base}/api/rooms/{room_id}/worker") as resp:
+            owners[room_id] = await resp.json()
+    return owners
+
+
+async def run(workers: int, clients: int, rooms: int, messages: int, rate: float, kill: bool) -> dict:
+    import aiohttp
+    from redis import asyncio as aioredis
+
+    from app.core.config import settings
+    from app.db.models import Base
+    from app.db.session import sync_engine
+
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    base_port = _free_port()
+    proc = _start_supervisor(workers, base_port)
+    r = aioredis.from_url(settings.REDIS_URL)
+    stats = {"join": [], "latency": [], "sent": 0, "errors": 0, "moved": 0,
+             "ack_latency": [], "resent": 0, "duplicate_acks": 0}
+    sims = [AffineClient(i, i % rooms + 1, stats) for i in range(clients)]
+    result = {"workers": workers, "clients": clients, "rooms": rooms, "messages_per_client": messages}
+    try:
+        ring = await _ring(r, workers)
+        # تا همه‌ی workerها حلقه‌ی کامل را خوانده باشند
+        await asyncio.sleep(settings.AFFINITY_REFRESH_INTERVAL * 2)
+        async with aiohttp.ClientSession() as http:
+            owners = await _owners(http, ring[0], rooms)
+            result["rooms_per_worker"] = {
+                slot: sum(1 for o in owners.values() if o["worker"] == slot) for slot in sorted(ring)
+            }
+
+            gate = asyncio.Semaphore(100)
+
+            async def join(sim):
+                async with gate:
+                    await sim.connect_and_join(owners[sim.room_id]["url"])
+
+            joined = await asyncio.gather(*(join(s) for s in sims), return_exceptions=True)
+            active = [s for s, j in zip(sims, joined) if not isinstance(j, BaseException)]
+            members = {}
+            for s in active:
+                members[s.room_id] = members.get(s.room_id, 0) + 1
+            expected = sum(n * n * messages for n in members.values())
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(s.send(messages, rate) for s in active))
+            send_elapsed = time.perf_counter() - t0
+            deadline = time.monotonic() + 30
+            while len(stats["latency"]) < expected and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            total_elapsed = time.perf_counter() - t0
+            result.update({
+                "join_failures": len(sims) - len(active),
+                "send_to_receive": summary(stats["latency"]),
+                "sent": stats["sent"],
+                "deliveries": len(stats["latency"]),
+                "expected_deliveries": expected,
+                "messages_per_sec": round(stats["sent"] / send_elapsed, 1),
+                "deliveries_per_sec": round(len(stats["latency"]) / total_elapsed, 1),
+                "errors": stats["errors"],
+            })
+
+            if kill and workers > 1:
+                result["rebalance"] = await _kill_and_rebalance(http, r, ring, owners, sims, stats, rooms)
+    finally:
+        await asyncio.gather(*(s.sio.disconnect() for s in sims), return_exceptions=True)
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(30)
+        await r.aclose()
+    return result
+
+
+async def _kill_and_rebalance(http, r, ring, owners, sims, stats, rooms) -> dict:
+    from app.core.config import settings
+
+    victim = ring[0]
+    orphaned = {room for room, o in owners.items() if o["worker"] == 0}
+    os.kill(_worker_pid(int(victim.rsplit(":", 1)[1])), signal.SIGKILL)
+    t0 = time.perf_counter()
+    survivors = await _ring(r, len(ring) - 1, timeout=10)
+    ring_update = time.perf_counter() - t0
+    # تا وقتی یک worker زنده اتاق‌های worker مرده را به خودش یا دیگری نسبت دهد
+    deadline = time.monotonic() + settings.AFFINITY_REFRESH_INTERVAL * 5
+    while True:
+        after = await _owners(http, next(iter(survivors.values())), rooms)
+        if all(after[room]["worker"] not in (0, None) for room in orphaned) or time.monotonic() > deadline:
+            break
+        await asyncio.sleep(0.02)
+    reroute = time.perf_counter() - t0
+    moved = {room for room in owners if owners[room]["worker"] != after[room]["worker"]}
+
+    # کلاینت‌های worker مرده دوباره به مالک جدید وصل می‌شوند
+    lost = []
+    for i, s in enumerate(sims):
+        if s.room_id in orphaned:
+            sims[i] = AffineClient(i, s.room_id, stats)
+            lost.append(sims[i])
+    rejoined = await asyncio.gather(
+        *(asyncio.wait_for(s.connect_and_join(after[s.room_id]["url"]), 10) for s in lost), return_exceptions=True
+    )
+
+    # worker 0 برمی‌گردد و اتاق‌هایش را پس می‌گیرد
+    moved_before = stats["moved"]
+    t0 = time.perf_counter()
+    await _ring(r, len(ring), timeout=60)
+    await asyncio.sleep(settings.AFFINITY_REFRESH_INTERVAL * 2)
+    return {
+        "ring_update_s": round(ring_update, 3),
+        "reroute_s": round(reroute, 3),
+        "rooms_on_killed_worker": len(orphaned),
+        "rooms_moved": len(moved),
+        "other_rooms_moved": len(moved - orphaned),
+        "clients_rejoined": sum(1 for j in rejoined if not isinstance(j, BaseException)),
+        "clients_to_rejoin": len(lost),
+        "restart_s": round(time.perf_counter() - t0, 3),
+        "room_moved_on_return": stats["moved"] - moved_before,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=400)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=5, help="messages sent by each client")
+    parser.add_argument("--rate", type=float, default=1.0, help="mean messages/sec per client")
+    parser.add_argument("--kill", action="store_true", help="kill worker 0 afterwards and check the rebalance")
+    args = parser.parse_args()
+    setup_env(args.db)
+    result = asyncio.run(run(args.workers, args.clients, args.rooms, args.messages, args.rate, args.kill))
+    print(json.dumps(result, indent=2))
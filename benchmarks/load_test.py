@@ -0,0 +1,248 @@
+"""
+End-to-end load test: starts app.main:app under uvicorn (in-memory Socket.IO manager,
+presence, history cache, unread counters and send dedup, so no Redis) and drives simulated
+python-socketio clients.
+
+    python -m benchmarks.load_test [--db URL_ASYNC URL_SYNC] [--clients 1000] [--rooms 10]
+                                   [--messages 5] [--rate 1.0] [--idempotent 0.5] [--resend 0.1]
+                                   [--out result.json]
+
+A share (--idempotent) of the messages carry a client_msg_id and ask for an ack, and a
+share of those (--resend) is sent a second time right away: the resends must come back
+as duplicate acks and never be delivered, so deliveries should still equal the expected
+count.
+
+Reports join latency (join -> history), send-to-receive latency over every delivery,
+messages/sec and the server's peak RSS as JSON. Defaults to a throwaway SQLite file;
+with --db the schema is created with metadata.create_all, so use an empty database.
+Every client lives in this process, so at high client counts the harness itself can
+become the bottleneck; watch its CPU.
+
+Needs the client extras: pip install "python-socketio[asyncio_client]" uvicorn
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks._common import setup_env, summary
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_bytes(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _start_server(port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        SOCKETIO_CLIENT_MANAGER="memory",
+        PRESENCE_BACKEND="memory",
+        HISTORY_CACHE_BACKEND="memory",
+        UNREAD_BACKEND="memory",
+        SEND_DEDUP_BACKEND="memory",
+        CELERY_BROKER_URL="memory://",
+        CELERY_RESULT_BACKEND="cache+memory://",
+    )
+    # the harness measures throughput; keep the per-room limit out of the way unless asked
+    env.setdefault("RATE_LIMIT_ROOM", "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    import aiohttp
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError("server exited during start-up")
+            try:
+                async with http.get(f"{url}/api/metrics") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not come up")
+
+
+class SimClient:
+    def __init__(self, index: int, room_id: int, stats: dict):
+        import socketio
+
+        self.username = f"load{index}"
+        self.room_id = room_id
+        self.stats = stats
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.joined = asyncio.Event()
+        self.sio.on("history", self._on_history)
+        self.sio.on("message", self._on_message)
+        self.sio.on("error", self._on_error)
+
+    async def _on_history(self, data):
+        self.joined.set()
+
+    async def _on_message(self, data):
+        content = data.get("content") or ""
+        if content.startswith("bench "):
+            self.stats["latency"].append(time.perf_counter() - float(content[6:]))
+
+    async def _on_error(self, data):
+        self.stats["errors"] += 1
+
+    async def connect_and_join(self, url: str) -> None:
+        await self.sio.connect(url, transports=["websocket"], wait_timeout=30)
+        t0 = time.perf_counter()
+        await self.sio.emit("join", {"username": self.username, "room_id": self.room_id})
+        await asyncio.wait_for(self.joined.wait(), 30)
+        self.stats["join"].append(time.perf_counter() - t0)
+
+    def _on_ack(self, sent_at: float):
+        def ack(data):
+            self.stats["ack_latency"].append(time.perf_counter() - sent_at)
+            if not data or not data.get("ok"):
+                self.stats["errors"] += 1
+            elif data.get("duplicate"):
+                self.stats["duplicate_acks"] += 1
+        return ack
+
+    async def send(self, n: int, rate: float, idempotent: float = 0.0, resend: float = 0.0) -> None:
+        for i in range(n):
+            # تاخیر تصادفی تا همه‌ی کلاینت‌ها هم‌زمان نفرستند
+            await asyncio.sleep(random.expovariate(rate))
+            sent_at = time.perf_counter()
+            data = {
+                "username": self.username,
+                "room_id": self.room_id,
+                "content": f"bench {sent_at!r}",
+            }
+            if random.random() >= idempotent:
+                await self.sio.emit("message", data)
+                self.stats["sent"] += 1
+                continue
+            data["client_msg_id"] = f"{self.username}-{i}"
+            await self.sio.emit("message", data, callback=self._on_ack(sent_at))
+            self.stats["sent"] += 1
+            if random.random() < resend:
+                # مثل تکرار بعد از reconnect؛ نباید دوباره پخش شود
+                await self.sio.emit("message", data, callback=self._on_ack(sent_at))
+                self.stats["resent"] += 1
+
+
+async def run(clients: int, rooms: int, messages: int, rate: float,
+              idempotent: float = 0.5, resend: float = 0.1) -> dict:
+    from app.db.models import Base
+    from app.db.session import sync_engine
+
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    proc = _start_server(port)
+    peak_rss = 0
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, _rss_bytes(proc.pid) or 0)
+            await asyncio.sleep(0.5)
+
+    stats = {"join": [], "latency": [], "sent": 0, "errors": 0,
+             "ack_latency": [], "resent": 0, "duplicate_acks": 0}
+    sampler = asyncio.create_task(sample_rss())
+    sims = [SimClient(i, i % rooms + 1, stats) for i in range(clients)]
+    try:
+        await _wait_ready(url, proc)
+        idle_rss = _rss_bytes(proc.pid)
+
+        gate = asyncio.Semaphore(100)
+
+        async def join(sim):
+            async with gate:
+                await sim.connect_and_join(url)
+
+        t0 = time.perf_counter()
+        joined = await asyncio.gather(*(join(s) for s in sims), return_exceptions=True)
+        join_elapsed = time.perf_counter() - t0
+        active = [s for s, r in zip(sims, joined) if not isinstance(r, BaseException)]
+        join_failures = len(sims) - len(active)
+
+        members = {}
+        for s in active:
+            members[s.room_id] = members.get(s.room_id, 0) + 1
+        expected = sum(n * n * messages for n in members.values())
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(s.send(messages, rate, idempotent, resend) for s in active))
+        send_elapsed = time.perf_counter() - t0
+        deadline = time.monotonic() + 30
+        while len(stats["latency"]) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        total_elapsed = time.perf_counter() - t0
+    finally:
+        sampler.cancel()
+        await asyncio.gather(*(s.sio.disconnect() for s in sims), return_exceptions=True)
+        proc.terminate()
+        proc.wait(10)
+
+    return {
+        "clients": clients,
+        "rooms": rooms,
+        "messages_per_client": messages,
+        "join_latency": summary(stats["join"]),
+        "joins_per_sec": round(len(active) / join_elapsed, 1),
+        "join_failures": join_failures,
+        "send_to_receive": summary(stats["latency"]),
+        "sent": stats["sent"],
+        "deliveries": len(stats["latency"]),
+        "expected_deliveries": expected,
+        "messages_per_sec": round(stats["sent"] / send_elapsed, 1),
+        "deliveries_per_sec": round(len(stats["latency"]) / total_elapsed, 1),
+        "ack_latency": summary(stats["ack_latency"]),
+        "resent": stats["resent"],
+        "duplicate_acks": stats["duplicate_acks"],
+        "errors": stats["errors"],
+        "server_rss_idle_mb": round((idle_rss or 0) / 2**20, 1),
+        "server_rss_peak_mb": round(peak_rss / 2**20, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", nargs=2, metavar=("ASYNC_URL", "SYNC_URL"))
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5, help="messages sent by each client")
+    parser.add_argument("--rate", type=float, default=1.0, help="mean messages/sec per client")
+    parser.add_argument("--idempotent", type=float, default=0.5, help="share of messages sent with a client_msg_id")
+    parser.add_argument("--resend", type=float, default=0.1, help="share of those sent twice")
+    parser.add_argument("--out", help="also write the JSON result to this file")
+    args = parser.parse_args()
+    setup_env(args.db)
+    result = asyncio.run(run(args.clients, args.rooms, args.messages, args.rate, args.idempotent, args.resend))
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,46 @@
+"""
+Settings are read at import time, so the environment is set here before any app module
+loads: a throwaway SQLite file, in-process backends, and eager Celery.
+"""
+import os
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="chat-tests-")
+_DB = os.path.join(_TMP, "primary.db")
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_DB}",
+    ASYNC_DATABASE_URL=f"sqlite+aiosqlite:///{_DB}",
+    REPLICA_DATABASE_URLS="",
+    HISTORY_CACHE_BACKEND="memory",
+    PRESENCE_BACKEND="memory",
+    UNREAD_BACKEND="memory",
+    SEND_DEDUP_BACKEND="memory",
+    SOCKETIO_CLIENT_MANAGER="memory",
+    CELERY_BROKER_URL="memory://",
+    CELERY_RESULT_BACKEND="cache+memory://",
+    CELERY_ALWAYS_EAGER="1",
+    UPLOAD_DIR=os.path.join(_TMP, "uploads"),
+    IMPORT_DIR=os.path.join(_TMP, "imports"),
+    ARCHIVE_DIR=os.path.join(_TMP, "archive"),
+)
+
+import pytest
+
+from app.db.models import Base
+from app.db.session import AsyncSessionLocal, async_engine
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session():
+    """A session on an empty schema (create_all, as local SQLite runs do)."""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as s:
+        yield s
@@ -0,0 +1,36 @@
+from app.socket.affinity import HashRing
+
+ROOMS = range(1, 5001)
+
+
+def _owners(ring: HashRing) -> dict[int, int]:
+    return {room_id: ring.owner(room_id) for room_id in ROOMS}
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing(()).owner(1) is None
+
+
+def test_rooms_spread_over_all_slots():
+    owners = _owners(HashRing([0, 1, 2, 3]))
+    for slot in range(4):
+        share = sum(1 for o in owners.values() if o == slot) / len(ROOMS)
+        assert 0.15 < share < 0.35
+
+
+def test_removing_a_slot_moves_only_its_rooms():
+    before = _owners(HashRing([0, 1, 2, 3]))
+    after = _owners(HashRing([0, 1, 3]))
+
+    moved = {r for r in ROOMS if before[r] != after[r]}
+    assert moved == {r for r in ROOMS if before[r] == 2}
+
+
+def test_adding_a_slot_only_takes_rooms_for_itself():
+    before = _owners(HashRing([0, 1, 2]))
+    after = _owners(HashRing([0, 1, 2, 3]))
+
+    moved = {r for r in ROOMS if before[r] != after[r]}
+    assert moved and all(after[r] == 3 for r in moved)
+    # ring به ترتیب ورود slotها وابسته نیست
+    assert after == _owners(HashRing([3, 1, 0, 2]))
@@ -0,0 +1,34 @@
+import io
+import json
+import os
+
+import httpx
+import pytest
+from PIL import Image
+
+from app.core.storage import DERIVED_DIR
+from app.main import fastapi_app
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upload_renders_derivatives_with_eager_celery():
+    raw = io.BytesIO()
+    Image.new("RGB", (2000, 1000), "teal").save(raw, "PNG")
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post("/api/upload/", files={"file": ("photo.png", raw.getvalue(), "image/png")})
+        assert r.status_code == 200
+        body = r.json()
+        thumb = await client.get(body["derivatives"]["thumb"])
+
+    with open(os.path.join(DERIVED_DIR, f"{body['sha256']}.json")) as f:
+        meta = json.load(f)
+    assert (meta["width"], meta["height"]) == (2000, 1000)
+    assert (meta["variants"]["thumb"]["width"], meta["variants"]["thumb"]["height"]) == (320, 160)
+    assert (meta["variants"]["preview"]["width"], meta["variants"]["preview"]["height"]) == (1280, 640)
+
+    assert thumb.status_code == 200
+    assert thumb.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(thumb.content)).size == (320, 160)
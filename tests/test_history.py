@@ -0,0 +1,62 @@
+import httpx
+import pytest
+
+from app.db import crud
+from app.main import fastapi_app
+
+pytestmark = pytest.mark.anyio
+
+
+async def _post(session, room_id: int, username: str, count: int) -> list[int]:
+    await crud.get_or_create_room(session, room_id)
+    user = await crud.get_or_create_user(session, username)
+    return [
+        (await crud.create_message(session, room_id, user.id, f"m{i}", username=username)).id
+        for i in range(count)
+    ]
+
+
+async def test_cursor_walks_the_whole_room(session):
+    # created_at از server_default: چند پیام در یک ثانیه، فقط id ترتیبشان را تعیین می‌کند
+    ids = await _post(session, 1, "alice", 25)
+
+    seen, before = [], None
+    for _ in range(5):
+        page, _, before = await crud.get_history(session, 1, limit=10, before=before)
+        seen = [m["id"] for m in page] + seen
+        if before is None:
+            break
+
+    assert seen == ids
+    assert before is None
+
+
+async def test_cursor_mixes_server_default_and_bound_timestamps(session):
+    first_id, explicit_id = await _post(session, 1, "alice", 2)
+    first = await session.get(crud.Message, first_id)
+    explicit = await session.get(crud.Message, explicit_id)
+    # مثل bulk import: created_at صریح با میکروثانیه، در همان ثانیه‌ی ردیف قبلی
+    explicit.created_at = first.created_at.replace(microsecond=500)
+    await session.commit()
+
+    page, _, cursor = await crud.get_history(session, 1, limit=1)
+    assert [m["id"] for m in page] == [explicit_id]
+    page, _, cursor = await crud.get_history(session, 1, limit=1, before=cursor)
+    assert [m["id"] for m in page] == [first_id]
+    assert cursor is None
+
+
+async def test_rest_history_keeps_reply_fields_and_seq(session):
+    [parent_id] = await _post(session, 1, "alice", 1)
+    user = await crud.get_or_create_user(session, "bob")
+    reply = await crud.create_message(session, 1, user.id, "re", replied_to=parent_id, username="bob")
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        full = (await client.get("/api/rooms/1/history")).json()
+        delta = (await client.get("/api/rooms/1/history", params={"since_seq": 1})).json()
+
+    last = full["messages"][-1]
+    assert (last["replied_to"], last["reply_text"], last["reply_user"]) == (parent_id, "m0", "alice")
+    assert last["seq"] == reply.change_seq
+    assert delta["messages"] == [last]
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+
+from app.db.history_cache import MemoryHistoryCache, RedisHistoryCache
+
+pytestmark = pytest.mark.anyio
+
+T0 = datetime(2026, 10, 18, 12, 0, 0)
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def cache(request):
+    if request.param == "memory":
+        yield MemoryHistoryCache(capacity=5, max_rooms=2)
+        return
+    redis = fakeredis.FakeAsyncRedis()
+    yield RedisHistoryCache(redis, capacity=5, max_rooms=2)
+    await redis.aclose()
+
+
+def _message(i: int, room_id: int = 1, replied_to: int | None = None) -> dict:
+    return {
+        "id": i, "room_id": room_id, "username": f"u{i % 2}", "content": f"m{i}",
+        "created_at": T0 + timedelta(seconds=i), "edited_at": None, "replied_to": replied_to,
+        "reply_text": f"m{replied_to}" if replied_to else None, "reply_user": None,
+        "reply_deleted": False, "is_deleted": False, "seq": i,
+    }
+
+
+async def _fill(cache, room_id: int, messages: list[dict]) -> None:
+    await cache.fill(room_id, messages, await cache.generation(room_id))
+
+
+async def test_miss_then_fill_then_append(cache):
+    assert await cache.get_page(1, 3) is None
+
+    await _fill(cache, 1, [_message(i) for i in range(1, 4)])
+    page, users, cursor = await cache.get_page(1, 2)
+    assert [m["id"] for m in page] == [2, 3]
+    assert users == ["u0", "u1"]
+    assert cursor is not None
+
+    await cache.append(1, _message(4))
+    page, _, cursor = await cache.get_page(1, 5)
+    assert [m["id"] for m in page] == [1, 2, 3, 4]
+    assert cursor is None
+
+
+async def test_buffer_keeps_capacity_and_reports_older_rows(cache):
+    await _fill(cache, 1, [_message(i) for i in range(1, 8)])
+    page, _, cursor = await cache.get_page(1, 5)
+    assert [m["id"] for m in page] == [3, 4, 5, 6, 7]
+    # بافر پر است، پس پیام قدیمی‌تری در دیتابیس هست
+    assert cursor is not None
+    # بیشتر از ظرفیت: از دیتابیس خوانده می‌شود
+    assert await cache.get_page(1, 6) is None
+
+
+async def test_fill_that_raced_a_write_is_dropped(cache):
+    gen = await cache.generation(1)
+    # پیامی که بعد از خواندن دیتابیس و قبل از fill رسیده
+    await cache.append(1, _message(4))
+    await cache.fill(1, [_message(i) for i in range(1, 4)], gen)
+    assert await cache.get_page(1, 3) is None
+
+    gen = await cache.generation(1)
+    await cache.update_message(1, 2, "edited", T0, 9)
+    await cache.fill(1, [_message(i) for i in range(1, 4)], gen)
+    assert await cache.get_page(1, 3) is None
+
+
+async def test_edit_patches_message_seq_and_reply_previews(cache):
+    await _fill(cache, 1, [_message(1), _message(2, replied_to=1)])
+    await cache.update_message(1, 1, "edited", T0, 7)
+
+    page, _, _ = await cache.get_page(1, 2)
+    edited, reply = page
+    assert (edited["content"], edited["seq"]) == ("edited", 7)
+    assert edited["edited_at"] == T0.isoformat()
+    assert (reply["reply_text"], reply["seq"]) == ("edited", 2)
+
+
+async def test_delete_leaves_a_tombstone(cache):
+    await _fill(cache, 1, [_message(1), _message(2, replied_to=1), _message(3)])
+    await cache.delete_message(1, 1, 8)
+
+    page, _, _ = await cache.get_page(1, 5)
+    assert [m["id"] for m in page] == [2, 3]
+    assert page[0]["reply_deleted"] and page[0]["reply_text"] is None
+
+    entries = await cache._load(1)
+    assert entries[0]["is_deleted"] and entries[0]["seq"] == 8
+
+
+async def test_least_recently_used_room_is_evicted(cache):
+    for room_id in (1, 2):
+        await _fill(cache, room_id, [_message(1, room_id)])
+    # اتاق ۱ تازه خوانده شد، پس اتاق ۲ قدیمی‌ترین است
+    assert await cache.get_page(1, 1) is not None
+    await _fill(cache, 3, [_message(1, 3)])
+
+    assert await cache.get_page(1, 1) is not None
+    assert await cache.get_page(2, 1) is None
+    assert await cache.get_page(3, 1) is not None
@@ -0,0 +1,76 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.socket.presence import MemoryPresence, RedisPresence
+
+pytestmark = pytest.mark.anyio
+
+TTL = 0.2
+
+
+class FakeSio:
+    def __init__(self):
+        self.emitted = []
+
+    async def emit(self, event, data, room=None, **kwargs):
+        self.emitted.append((event, data))
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def presence(request):
+    # heartbeat طولانی: sweep فقط از members() در خود تست اجرا می‌شود
+    args = (TTL, 60, 0.01)
+    if request.param == "memory":
+        p = MemoryPresence(*args)
+        yield p
+        await p.stop()
+        return
+    redis = fakeredis.FakeAsyncRedis()
+    p = RedisPresence(redis, *args)
+    yield p
+    await p.stop()
+    await redis.aclose()
+
+
+async def test_join_rejects_a_second_live_sid(presence):
+    assert await presence.join(1, "alice", "s1")
+    assert await presence.join(1, "bob", "s2")
+    assert not await presence.join(1, "alice", "s3")
+    # همان sid دوباره join می‌کند (reconnect به همان اتاق)
+    assert await presence.join(1, "alice", "s1")
+    assert await presence.members(1) == ["alice", "bob"]
+
+
+async def test_leave_ignores_a_stale_sid(presence):
+    await presence.join(1, "alice", "s1")
+    await presence.leave(1, "alice", "old-sid")
+    assert await presence.members(1) == ["alice"]
+    await presence.leave(1, "alice", "s1")
+    assert await presence.members(1) == []
+
+
+async def test_expired_sid_is_swept_and_can_be_taken_over(presence):
+    await presence.join(1, "alice", "s1")
+    await presence.join(1, "bob", "s2")
+    await asyncio.sleep(TTL / 2)
+    await presence._refresh({"s2": (1, "bob")})
+    await asyncio.sleep(TTL / 2 + 0.05)
+
+    assert await presence.members(1) == ["bob"]
+    # s1 مرده؛ sid تازه‌ی همان کاربر پذیرفته می‌شود
+    assert await presence.join(1, "alice", "s3")
+    assert await presence.members(1) == ["alice", "bob"]
+
+
+async def test_diffs_are_coalesced_per_window(presence):
+    sio = FakeSio()
+    presence.start(sio)
+    await presence.join(1, "alice", "s1")
+    await presence.join(1, "bob", "s2")
+    await presence.leave(1, "bob", "s2")
+    await asyncio.sleep(0.05)
+
+    # ورود و خروج bob در یک پنجره خنثی شدند
+    assert sio.emitted == [("presence_diff", {"room_id": 1, "joined": ["alice"], "left": []})]
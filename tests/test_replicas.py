@@ -0,0 +1,67 @@
+import httpx
+import pytest
+from sqlalchemy import create_engine
+
+from app.api import routes
+from app.db import crud, replicas as replicas_module
+from app.db.models import Base
+from app.db.replicas import ReplicaSet
+from app.db.session import async_engine
+from app.main import fastapi_app
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def replica_set(monkeypatch, tmp_path):
+    """A second, empty SQLite file as the only replica: reads that reach it see no messages."""
+    path = tmp_path / "replica.db"
+    Base.metadata.create_all(create_engine(f"sqlite:///{path}"))
+    rs = ReplicaSet([f"sqlite+aiosqlite:///{path}"], max_lag=5, check_interval=1, ryw_window=10)
+    await rs.check()
+    monkeypatch.setattr(replicas_module, "replicas", rs)
+    monkeypatch.setattr(routes, "replicas", rs)
+    yield rs
+    for engine in rs.engines:
+        await engine.dispose()
+
+
+async def test_unreachable_replica_falls_back_to_the_primary(tmp_path, replica_set):
+    assert replica_set.session().bind is replica_set.engines[0]
+
+    broken = ReplicaSet([f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db"], 5, 1, 10)
+    await broken.check()
+    assert broken.session().bind is async_engine
+    await broken.engines[0].dispose()
+
+
+async def _delta(client, **params):
+    r = await client.get("/api/rooms/1/history", params={"since_seq": 0, **params})
+    return [m["content"] for m in r.json()["messages"]]
+
+
+async def test_rest_reads_see_rest_writes(session, replica_set):
+    await crud.get_or_create_room(session, 1)
+    user = await crud.get_or_create_user(session, "alice")
+    msg = await crud.create_message(session, 1, user.id, "draft", username="alice")
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert await _delta(client) == []
+
+        r = await client.patch(f"/api/messages/{msg.id}", json={"username": "alice", "content": "final"})
+        assert r.status_code == 200
+        assert await _delta(client) == ["final"]
+
+
+async def test_username_routes_to_the_primary(session, replica_set):
+    await crud.get_or_create_room(session, 1)
+    user = await crud.get_or_create_user(session, "alice")
+    await crud.create_message(session, 1, user.id, "hi", username="alice")
+
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert await _delta(client, username="alice") == []
+        replica_set.note_write("alice")
+        assert await _delta(client, username="alice") == ["hi"]
+        assert await _delta(client) == []
@@ -0,0 +1,25 @@
+import pytest
+
+from app.db import crud
+from app.db.session import async_autocommit_engine
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_missing_room_is_rejected_with_or_without_client_msg_id(session):
+    user = await crud.get_or_create_user(session, "alice")
+    async with async_autocommit_engine.connect() as conn:
+        for client_msg_id in (None, "c1"):
+            with pytest.raises(crud.RoomNotFound):
+                await crud.insert_message_with_preview(conn, 404, user.id, "alice", "hi", client_msg_id=client_msg_id)
+        assert await crud.get_sent_message(conn, 404, user.id, "c1") is None
+
+
+async def test_resend_returns_none_and_the_original_row(session):
+    await crud.get_or_create_room(session, 1)
+    user = await crud.get_or_create_user(session, "alice")
+    async with async_autocommit_engine.connect() as conn:
+        first = await crud.insert_message_with_preview(conn, 1, user.id, "alice", "hi", client_msg_id="c1")
+        assert await crud.insert_message_with_preview(conn, 1, user.id, "alice", "hi", client_msg_id="c1") is None
+        sent = await crud.get_sent_message(conn, 1, user.id, "c1")
+    assert (sent["id"], sent["seq"]) == (first["id"], first["change_seq"])
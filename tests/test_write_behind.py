@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.db import crud
+from app.db.models import Message
+from app.db.write_behind import MessageWriter, WriteBehindDeferred, WriteBehindRejected
+from app.tasks import save_message
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def writer(session):
+    w = MessageWriter(batch_size=50, flush_ms=50, queue_size=100, put_timeout=1)
+    w.start()
+    yield w
+    await w.stop()
+
+
+async def _setup(session) -> int:
+    await crud.get_or_create_room(session, 1)
+    return (await crud.get_or_create_user(session, "alice")).id
+
+
+async def _count(session) -> int:
+    return await session.scalar(select(func.count()).select_from(Message))
+
+
+async def test_bad_row_is_split_out_of_the_batch(session, writer):
+    user_id = await _setup(session)
+    # اتاق ۴۰۴ وجود ندارد؛ کل دسته با یک flush نوشته می‌شود
+    rooms = [1, 1, 1, 404, 1, 1]
+    results = await asyncio.gather(
+        *(writer.submit(room_id, user_id, "alice", f"m{i}") for i, room_id in enumerate(rooms)),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[3], WriteBehindRejected)
+    saved = [r for i, r in enumerate(results) if i != 3]
+    assert len({msg_id for msg_id, _, _ in saved}) == 5
+    assert sorted(seq for _, _, seq in saved) == [1, 2, 3, 4, 5]
+    assert await _count(session) == 5
+
+
+async def test_repeated_client_msg_id_in_a_batch_is_inserted_once(session, writer):
+    user_id = await _setup(session)
+    first, again = await asyncio.gather(
+        writer.submit(1, user_id, "alice", "hi", client_msg_id="c1"),
+        writer.submit(1, user_id, "alice", "hi", client_msg_id="c1"),
+    )
+
+    assert first is not None and again is None
+    assert await _count(session) == 1
+
+
+async def test_failed_batch_is_saved_and_broadcast_by_the_worker(session, writer, monkeypatch):
+    user_id = await _setup(session)
+    emitted = []
+    monkeypatch.setattr(save_message, "emit_to_room", lambda event, payload, room_id: emitted.append(payload))
+
+    async def unavailable(batch):
+        raise OperationalError("INSERT", {}, Exception("connection lost"))
+    monkeypatch.setattr(writer, "_write", unavailable)
+
+    with pytest.raises(WriteBehindDeferred):
+        await writer.submit(1, user_id, "alice", "later", client_msg_id="c1")
+
+    # Celery در حالت eager همین‌جا ذخیره و پخش کرده است
+    assert await _count(session) == 1
+    [payload] = emitted
+    assert (payload["content"], payload["client_msg_id"], payload["seq"]) == ("later", "c1", 1)